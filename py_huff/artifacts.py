@@ -0,0 +1,60 @@
+from typing import TextIO, Optional
+import json
+from .compile import CompileResult
+from .parser import Json
+from .utils import keccak256
+
+# Bytes hex encoded per write when streaming bytecode
+HEX_CHUNK_SIZE = 1 << 16
+
+
+def to_compact_json(value: Json) -> str:
+    return json.dumps(value, separators=(',', ':'))
+
+
+def artifact_json(result: CompileResult) -> dict[str, Json]:
+    return {
+        'abi': result.abi,
+        'deployedBytecode': {
+            'object': f'0x{result.runtime.hex()}'
+        },
+        'bytecode': {
+            'object': f'0x{result.deploy.hex()}'
+        }
+    }
+
+
+def write_hex(f: TextIO, data: bytes):
+    view = memoryview(data)
+    for i in range(0, len(view), HEX_CHUNK_SIZE):
+        f.write(view[i:i + HEX_CHUNK_SIZE].hex())
+
+
+def write_ndjson_artifact(
+    f: TextIO,
+    name: str,
+    result: CompileResult,
+    metadata: Optional[dict[str, Json]] = None
+):
+    '''
+    Writes a compiled unit as a single, compact JSON line. Bytecode is hex encoded directly into
+    the stream rather than first building the complete line in memory.
+    '''
+    f.write(f'{{"name":{to_compact_json(name)},"abi":{to_compact_json(result.abi)}')
+    f.write(',"bytecode":{"object":"0x')
+    write_hex(f, result.deploy)
+    f.write('"},"deployedBytecode":{"object":"0x')
+    write_hex(f, result.runtime)
+    f.write('"},"hashes":{')
+    f.write(f'"bytecode":"0x{keccak256(result.deploy).hex()}",')
+    f.write(f'"deployedBytecode":"0x{keccak256(result.runtime).hex()}"}}')
+    if metadata is not None:
+        f.write(f',"metadata":{to_compact_json(metadata)}')
+    f.write('}\n')
+    f.flush()
+
+
+def write_ndjson_error(f: TextIO, name: str, error: str):
+    f.write(to_compact_json({'name': name, 'error': error}))
+    f.write('\n')
+    f.flush()
@@ -2,7 +2,7 @@ from typing import NamedTuple
 from enum import Enum
 from .opcodes import Op, create_push
 from .context import ObjectId
-from .utils import build_unique_dict
+from .utils import build_unique_dict, s
 
 
 class MarkPurpose(Enum):
@@ -26,14 +26,21 @@ class MarkId (NamedTuple(
 Mark = NamedTuple('Mark', [('mid', MarkId)])
 MarkRef = NamedTuple('MarkRef', [('mid', MarkId)])
 MarkDeltaRef = NamedTuple('MarkDeltaRef', [('start', MarkId), ('end', MarkId)])
+# Raw, fixed size big-endian offset of a mark (e.g. entries of jump tables)
+MarkOffset = NamedTuple('MarkOffset', [('mid', MarkId), ('size', int)])
 SizedRef = NamedTuple(
     'SizedRef',
     [('ref', MarkRef | MarkDeltaRef), ('offset_size', int)]
 )
 
 
-Asm = Op | Mark | MarkRef | MarkDeltaRef | bytes
-SolidAsm = Op | Mark | SizedRef | bytes
+# Raw data, memory views allow large data (e.g. memory mapped code tables) to be carried through
+# assembly without copies until the final bytecode is written
+Data = bytes | memoryview
+DATA_TYPES = (bytes, memoryview)
+
+Asm = Op | Mark | MarkRef | MarkDeltaRef | MarkOffset | Data
+SolidAsm = Op | Mark | SizedRef | MarkOffset | Data
 
 
 def to_start_mark(obj_id: ObjectId) -> Mark:
@@ -65,10 +72,12 @@ def set_size(ref: SizedRef, size: int) -> SizedRef:
 def min_static_size(step: Asm) -> int:
     if isinstance(step, Op):
         return 1 + len(step.extra_data)
-    elif isinstance(step, bytes):
+    elif isinstance(step, DATA_TYPES):
         return len(step)
     elif isinstance(step, (MarkRef, MarkDeltaRef)):
         return 1
+    elif isinstance(step, MarkOffset):
+        return step.size
     elif isinstance(step, Mark):
         return 0
     else:
@@ -78,10 +87,12 @@ def min_static_size(step: Asm) -> int:
 def get_size(step: SolidAsm) -> int:
     if isinstance(step, Op):
         return 1 + len(step.extra_data)
-    elif isinstance(step, bytes):
+    elif isinstance(step, DATA_TYPES):
         return len(step)
     elif isinstance(step, SizedRef):
         return 1 + step.offset_size
+    elif isinstance(step, MarkOffset):
+        return step.size
     elif isinstance(step, Mark):
         return 0
     else:
@@ -125,7 +136,7 @@ def validate_asm(asm: list[Asm]) -> None:
         if isinstance(step, Mark)
     ], lambda mid: f'Duplicate mid #{mid}')
     for i, step in enumerate(asm):
-        if isinstance(step, MarkRef):
+        if isinstance(step, (MarkRef, MarkOffset)):
             assert step.mid in indices, f'Assembly step #{i} has invalid reference to {step.mid}'
         elif isinstance(step, MarkDeltaRef):
             assert step.start in indices, f'Assembly step #{i} has invalid reference to {step.start}'
@@ -180,14 +191,15 @@ def shorten_asm(asm: list[SolidAsm]) -> list[SolidAsm]:
 
 def solid_asm_to_bytecode(asm: list[SolidAsm]) -> bytes:
     mark_offsets: dict[MarkId, int] = get_solid_offsets(asm)
-    final_bytes: bytes = bytes()
+    # Parts are only joined at the very end to avoid repeatedly copying the partial bytecode
+    parts: list[Data] = []
 
     # Create skeleton for final bytecode
     for step in asm:
         if isinstance(step, Op):
-            final_bytes += bytes(step.get_bytes())
-        elif isinstance(step, bytes):
-            final_bytes += step
+            parts.append(bytes(step.get_bytes()))
+        elif isinstance(step, DATA_TYPES):
+            parts.append(step)
         elif isinstance(step, SizedRef):
             ref = step.ref
             if isinstance(ref, MarkRef):
@@ -197,18 +209,48 @@ def solid_asm_to_bytecode(asm: list[SolidAsm]) -> bytes:
             else:
                 assert False
             push = create_push(value.to_bytes(step.offset_size, 'big'))
-            final_bytes += bytes(push.get_bytes())
+            parts.append(bytes(push.get_bytes()))
+        elif isinstance(step, MarkOffset):
+            offset = mark_offsets[step.mid]
+            assert needed_bytes(offset) <= step.size, \
+                f'Offset {offset} of {step.mid} does not fit into {step.size} byte{s(step.size)}'
+            parts.append(offset.to_bytes(step.size, 'big'))
         elif isinstance(step, Mark):
             # Mark generates no bytes
             pass
         else:
             raise ValueError(f'Unrecognized assembly step {step}')
 
-    return final_bytes
+    return b''.join(parts)
 
 
-def asm_to_bytecode(asm: list[Asm]) -> bytes:
+def assemble(asm: list[Asm]) -> tuple[bytes, dict[MarkId, int]]:
+    '''Assembles `asm` returning the bytecode together with the final offsets of all its marks'''
     validate_asm(asm)
     solid_asm = asm_to_solid(asm)
     solid_asm = shorten_asm(solid_asm)
-    return solid_asm_to_bytecode(solid_asm)
+    return solid_asm_to_bytecode(solid_asm), get_solid_offsets(solid_asm)
+
+
+def asm_to_bytecode(asm: list[Asm]) -> bytes:
+    bytecode, _ = assemble(asm)
+    return bytecode
+
+
+def embed_with_marks(code: bytes, marks: list[tuple[int, Mark]]) -> list[Asm]:
+    '''
+    Splits already assembled `code` into chunks so that the given marks can be placed at their
+    respective offsets, allowing other assembly to reference locations inside of `code`.
+    '''
+    embedded: list[Asm] = []
+    view = memoryview(code)
+    last_offset = 0
+    for offset, mark in sorted(marks, key=lambda om: om[0]):
+        assert 0 <= offset <= len(code), f'Mark offset {offset} outside of code'
+        if offset > last_offset:
+            embedded.append(view[last_offset:offset])
+            last_offset = offset
+        embedded.append(mark)
+    if last_offset < len(code):
+        embedded.append(view[last_offset:])
+    return embedded
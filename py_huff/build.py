@@ -0,0 +1,326 @@
+'''
+Manifest driven project builds (`huffy build`).
+
+A manifest (`huff.json` by default) lists the contracts of a project, the constant override
+profiles to build them with and where to write their artifacts:
+
+    {
+        "outDir": "out",
+        "options": {"evmVersion": "shanghai", "optimize": "gas"},
+        "profiles": {"mainnet": {"OWNER": "0x1234"}},
+        "contracts": [
+            {"path": "src/Token.huff", "profiles": ["default", "mainnet"]},
+            {"name": "Vault", "path": "src/Vault.huff", "options": {"strict": true}}
+        ]
+    }
+
+Paths are relative to the manifest. Every contract is built for each of its profiles (`default`,
+without overrides, if none are given) into `<outDir>/<name>.json` (`<name>.<profile>.json` for
+other profiles). The files each compilation read (the contract, its includes and table files)
+are recorded with their hashes in a state file, later builds only recompile contracts whose
+inputs, overrides, options or compiler changed. Stale contracts are compiled in parallel.
+'''
+from typing import NamedTuple, Optional, Sequence, TypeVar
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+import sys
+from .artifacts import artifact_json
+from .cache import compiler_fingerprint
+from .compile import compile
+from .evm_version import EvmVersion, EVM_VERSIONS, validate_evm_version
+from .optimize import OptimizeMode, OPTIMIZE_MODES
+from .parser import Identifier, Json, literal_to_bytes
+from .sources import DISK_SOURCE, RecordingSource
+from .synthesis import SynthesisObjective, SYNTHESIS_OBJECTIVES
+
+DEFAULT_MANIFEST = 'huff.json'
+DEFAULT_PROFILE = 'default'
+STATE_FILE = '.huffy-build.json'
+STATE_FORMAT_VERSION = 1
+
+BUILD_OPTIONS = frozenset({'evmVersion', 'optimize', 'strict', 'synthesize'})
+
+# Validated manifest options, named like the corresponding `compile` arguments
+BuildOptions = NamedTuple(
+    'BuildOptions',
+    [
+        ('evm_version', EvmVersion),
+        ('optimize', Optional[OptimizeMode]),
+        ('strict', bool),
+        ('synthesize', Optional[SynthesisObjective])
+    ]
+)
+
+ManifestContract = NamedTuple(
+    'ManifestContract',
+    [
+        ('name', str),
+        ('path', str),
+        ('profiles', list[str]),
+        ('options', BuildOptions)
+    ]
+)
+
+Manifest = NamedTuple(
+    'Manifest',
+    [
+        ('root', str),
+        ('out_dir', str),
+        ('profiles', dict[str, dict[Identifier, bytes]]),
+        ('contracts', list[ManifestContract])
+    ]
+)
+
+BuildJob = NamedTuple(
+    'BuildJob',
+    [
+        # `<name>` or `<name>.<profile>`, unique within a manifest
+        ('target', str),
+        ('path', str),
+        ('overrides', dict[Identifier, bytes]),
+        ('options', BuildOptions),
+        ('artifact', str)
+    ]
+)
+
+BuildOutcome = NamedTuple(
+    'BuildOutcome',
+    [
+        ('target', str),
+        # Hashes of all files read, by path
+        ('inputs', dict[str, str]),
+        ('error', Optional[str])
+    ]
+)
+
+BuildReport = NamedTuple(
+    'BuildReport',
+    [
+        ('built', list[str]),
+        ('up_to_date', list[str]),
+        ('failed', dict[str, str])
+    ]
+)
+
+
+def parse_overrides(profile: str, values: dict) -> dict[Identifier, bytes]:
+    overrides: dict[Identifier, bytes] = {}
+    for name, value in values.items():
+        assert isinstance(value, str) and value.startswith('0x'), \
+            f'Profile "{profile}": Override for "{name}" must be a hex string (found {value!r})'
+        overrides[name.upper()] = literal_to_bytes(value[2:])
+    return overrides
+
+
+Choice = TypeVar('Choice', bound=str)
+
+
+def choice_option(contract: str, options: dict[str, Json], option: str, choices: tuple[Choice, ...]) -> Optional[Choice]:
+    value = options.get(option)
+    for choice in choices:
+        if value == choice:
+            return choice
+    assert value is None, \
+        f'Contract "{contract}": Build option "{option}" must be one of {", ".join(choices)} (found {value!r})'
+    return None
+
+
+def parse_options(contract: str, options: dict[str, Json]) -> BuildOptions:
+    for option in options:
+        assert option in BUILD_OPTIONS, f'Contract "{contract}": Unknown build option "{option}"'
+    strict = options.get('strict', False)
+    assert isinstance(strict, bool), f'Contract "{contract}": Build option "strict" must be a bool (found {strict!r})'
+    return BuildOptions(
+        validate_evm_version(choice_option(contract, options, 'evmVersion', EVM_VERSIONS)),
+        choice_option(contract, options, 'optimize', OPTIMIZE_MODES),
+        strict,
+        choice_option(contract, options, 'synthesize', SYNTHESIS_OBJECTIVES)
+    )
+
+
+def load_manifest(fp: str) -> Manifest:
+    with open(fp) as f:
+        data = json.load(f)
+    root = os.path.dirname(os.path.abspath(fp))
+    global_options = data.get('options', {})
+    for option in global_options:
+        assert option in BUILD_OPTIONS, f'Unknown build option "{option}"'
+
+    profiles: dict[str, dict[Identifier, bytes]] = {DEFAULT_PROFILE: {}}
+    for profile, values in data.get('profiles', {}).items():
+        assert profile != DEFAULT_PROFILE, f'Profile "{DEFAULT_PROFILE}" is reserved'
+        profiles[profile] = parse_overrides(profile, values)
+
+    contracts: list[ManifestContract] = []
+    names: set[str] = set()
+    for entry in data.get('contracts', []):
+        assert 'path' in entry, f'Contract entry without "path": {entry}'
+        name = entry.get('name', os.path.splitext(os.path.basename(entry['path']))[0])
+        assert name not in names, f'Duplicate contract name "{name}"'
+        names.add(name)
+        contract_profiles = entry.get('profiles', [DEFAULT_PROFILE])
+        for profile in contract_profiles:
+            assert profile in profiles, f'Contract "{name}": Unknown profile "{profile}"'
+        options = parse_options(name, {**global_options, **entry.get('options', {})})
+        contracts.append(ManifestContract(
+            name, os.path.join(root, entry['path']), contract_profiles, options
+        ))
+    assert contracts, f'No contracts in manifest {fp}'
+    return Manifest(root, os.path.join(root, data.get('outDir', 'out')), profiles, contracts)
+
+
+def build_jobs(manifest: Manifest) -> list[BuildJob]:
+    jobs: list[BuildJob] = []
+    for contract in manifest.contracts:
+        for profile in contract.profiles:
+            target = contract.name if profile == DEFAULT_PROFILE else f'{contract.name}.{profile}'
+            jobs.append(BuildJob(
+                target,
+                DISK_SOURCE.normalize(contract.path),
+                manifest.profiles[profile],
+                contract.options,
+                os.path.join(manifest.out_dir, f'{target}.json')
+            ))
+    return jobs
+
+
+def job_digest(job: BuildJob) -> str:
+    '''Hash of everything besides the input files that determines a job's artifact'''
+    data: Json = {
+        'compiler': compiler_fingerprint(),
+        'path': job.path,
+        'constants': {ident: value.hex() for ident, value in sorted(job.overrides.items())},
+        'options': job.options._asdict()
+    }
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def file_hash(fp: str) -> Optional[str]:
+    try:
+        with open(fp, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def run_job(job: BuildJob) -> BuildOutcome:
+    '''Compiles a job and writes its artifact, returning the hashes of the files it read'''
+    options = job.options
+    # Inputs are exactly the files the compilation itself read, hashed as they were served to it
+    source = RecordingSource(DISK_SOURCE)
+    try:
+        result = compile(
+            job.path,
+            job.overrides,
+            options.evm_version,
+            options.optimize,
+            source=source,
+            strict=options.strict,
+            synthesize=options.synthesize
+        )
+    except Exception as err:
+        return BuildOutcome(job.target, {}, f'{type(err).__name__}: {err}')
+    inputs = dict(source.read)
+    os.makedirs(os.path.dirname(job.artifact), exist_ok=True)
+    with open(job.artifact, 'w') as f:
+        json.dump(artifact_json(result), f, indent=2)
+    return BuildOutcome(job.target, inputs, None)
+
+
+def load_state(out_dir: str) -> dict[str, dict]:
+    try:
+        with open(os.path.join(out_dir, STATE_FILE)) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(state, dict) or state.get('version') != STATE_FORMAT_VERSION:
+        return {}
+    return state.get('targets', {})
+
+
+def save_state(out_dir: str, targets: dict[str, dict]):
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, STATE_FILE), 'w') as f:
+        json.dump({'version': STATE_FORMAT_VERSION, 'targets': targets}, f, indent=2)
+
+
+def is_up_to_date(job: BuildJob, record: Optional[dict]) -> bool:
+    if record is None or record.get('digest') != job_digest(job) or not os.path.exists(job.artifact):
+        return False
+    return all(file_hash(fp) == digest for fp, digest in record['inputs'].items())
+
+
+def escape_make_path(fp: str) -> str:
+    return fp.replace('$', '$$').replace('#', '\\#').replace(' ', '\\ ')
+
+
+def write_depfile(job: BuildJob, inputs: Sequence[str]):
+    '''Writes `<artifact>.d` listing the artifact's inputs as a Make rule'''
+    deps = ' \\\n  '.join(map(escape_make_path, inputs))
+    with open(f'{job.artifact}.d', 'w') as f:
+        f.write(f'{escape_make_path(job.artifact)}: {deps}\n')
+        # Empty rules so that deleted inputs don't break make
+        for fp in inputs:
+            f.write(f'\n{escape_make_path(fp)}:\n')
+
+
+def build(
+    manifest: Manifest,
+    force: bool = False,
+    depfiles: bool = False,
+    max_workers: Optional[int] = None
+) -> BuildReport:
+    '''Builds all stale targets of `manifest`, in parallel unless `max_workers` is 1'''
+    state = load_state(manifest.out_dir)
+    jobs = build_jobs(manifest)
+    stale = [job for job in jobs if force or not is_up_to_date(job, state.get(job.target))]
+    up_to_date = [job.target for job in jobs if job not in stale]
+
+    if max_workers == 1 or len(stale) <= 1:
+        outcomes = list(map(run_job, stale))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            outcomes = list(pool.map(run_job, stale))
+
+    failed: dict[str, str] = {}
+    for job, outcome in zip(stale, outcomes):
+        if outcome.error is not None:
+            failed[job.target] = outcome.error
+            state.pop(job.target, None)
+            continue
+        state[job.target] = {'digest': job_digest(job), 'inputs': outcome.inputs}
+    # Forget targets no longer in the manifest
+    state = {job.target: state[job.target] for job in jobs if job.target in state}
+    save_state(manifest.out_dir, state)
+
+    if depfiles:
+        for job in jobs:
+            if job.target in state:
+                write_depfile(job, list(state[job.target]['inputs']))
+
+    built = [job.target for job in stale if job.target not in failed]
+    return BuildReport(built, up_to_date, failed)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = ArgumentParser(prog='huffy build', description='Build the contracts of a project manifest')
+    parser.add_argument('manifest', nargs='?', default=DEFAULT_MANIFEST)
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help='maximum number of parallel compilations (default: CPU count)')
+    parser.add_argument('--force', '-f', action='store_true', help='rebuild all contracts')
+    parser.add_argument('--depfiles', action='store_true',
+                        help='write Make compatible <artifact>.d dependency files')
+    args = parser.parse_args(argv)
+
+    report = build(load_manifest(args.manifest), args.force, args.depfiles, args.jobs)
+    for target in report.built:
+        print(f'built {target}', file=sys.stderr)
+    for target, error in report.failed.items():
+        print(f'failed {target}: {error}', file=sys.stderr)
+    print(f'{len(report.built)} built, {len(report.up_to_date)} up to date, '
+          f'{len(report.failed)} failed', file=sys.stderr)
+    if report.failed:
+        sys.exit(1)
@@ -0,0 +1,159 @@
+'''
+Builder API constructing programs directly from Python objects, without generating and lexing
+Huff source text. Macros, constants and code tables are handed to the compiler already parsed
+(as `ParsedDef`), only function, event and error declarations (needed for the ABI and selectors)
+are lexed from their one-line declaration:
+
+    program = ProgramBuilder()
+    program.function('function balanceOf(address) view returns (uint256)')
+    program.constant('BALANCES_SLOT', 0x01)
+    program.macro('MAIN', [
+        lit(0), 'calldataload', lit(0xe0), 'shr', invoke('__FUNC_SIG', ref('balanceOf')), 'eq',
+        ref('balance_of'), 'jumpi', lit(0), lit(0), 'revert',
+        label('balance_of'), invoke('BALANCE_OF')
+    ])
+    result = program.compile({}, 'cancun')
+
+Plain strings in macro bodies are references (opcodes, labels, functions, ...), ints and bytes
+are literals.
+'''
+from typing import Iterable, Optional, Sequence
+from collections import defaultdict
+import re
+from parsimonious.exceptions import ParseError
+from .assembler import Data
+from .compile import CompileResult, compile_from_defs
+from .evm_version import EvmTarget
+from .expansion import ExpansionLimits, DEFAULT_EXPANSION_LIMITS
+from .lexer import lex_huff_cached
+from .optimize import OptimizeMode
+from .parser import (
+    Identifier, ConstRef, GeneralRef, InvokeArg, Invocation, LabelDef, Literal, Macro, MacroElement,
+    MacroParam, get_defs, get_ident
+)
+from .relocation import HuffObject
+from .resolver import Definition, ParsedDef
+from .synthesis import SynthesisObjective
+from .utils import byte_size
+
+IDENTIFIER = re.compile(r'[a-zA-Z_][a-zA-Z0-9_]*')
+DECLARATIONS = ('function', 'event', 'error')
+
+BodyItem = MacroElement | str | int | bytes
+
+
+def validate_ident(ident: Identifier) -> Identifier:
+    assert IDENTIFIER.fullmatch(ident) is not None, f'Invalid identifier "{ident}"'
+    return ident
+
+
+def to_bytes(value: int | bytes) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    assert value >= 0, f'Literal must not be negative (found {value})'
+    return value.to_bytes(byte_size(value), 'big')
+
+
+def lit(value: int | bytes, size: Optional[int] = None) -> Literal:
+    '''Pushes `value`, with a `PUSH<size>` if `size` is given'''
+    data = to_bytes(value)
+    assert 1 <= len(data) <= 32, f'Literal must be 1 to 32 bytes long (found {len(data)})'
+    assert size is None or len(data) <= size <= 32, f'Literal 0x{data.hex()} does not fit into push{size}'
+    return Literal(data, size)
+
+
+def label(ident: Identifier) -> LabelDef:
+    return LabelDef(validate_ident(ident))
+
+
+def ref(ident: Identifier) -> GeneralRef:
+    '''Reference to an opcode, label, function, event, error or code table'''
+    return GeneralRef(validate_ident(ident))
+
+
+def const(ident: Identifier) -> ConstRef:
+    return ConstRef(validate_ident(ident))
+
+
+def arg(ident: Identifier) -> MacroParam:
+    return MacroParam(validate_ident(ident))
+
+
+def to_element(item: BodyItem) -> MacroElement:
+    if isinstance(item, str):
+        return ref(item)
+    if isinstance(item, (int, bytes)):
+        return lit(item)
+    return item
+
+
+def invoke(ident: Identifier, *args: InvokeArg | str | int | bytes) -> Invocation:
+    elements: list[InvokeArg] = []
+    for el in map(to_element, args):
+        assert isinstance(el, InvokeArg), f'Invalid call argument {el}'
+        elements.append(el)
+    return Invocation(validate_ident(ident), elements)
+
+
+class ProgramBuilder:
+    defs: dict[str, list[Definition]]
+
+    def __init__(self) -> None:
+        self.defs = defaultdict(list)
+
+    def macro(self, ident: Identifier, body: Iterable[BodyItem], params: Sequence[Identifier] = ()) -> Macro:
+        els = list(map(to_element, body))
+        macro = Macro(validate_ident(ident), list(map(validate_ident, params)), els)
+        # Same validation as `parse_macro`
+        for el in els:
+            if isinstance(el, MacroParam):
+                assert el.ident in macro.params, f'Invalid macro arg {el.ident} for {ident} ({macro.params})'
+        self.defs['macro'].append(ParsedDef('macro', ident, macro))
+        return macro
+
+    def constant(self, ident: Identifier, value: Optional[int | bytes]):
+        '''Defines a constant, `None` for `FREE_STORAGE_POINTER()`'''
+        data = None if value is None else to_bytes(value)
+        assert data is None or len(data) <= 32, f'Constant "{ident}" longer than 32 bytes'
+        self.defs['const'].append(ParsedDef('const', validate_ident(ident), data))
+
+    def table(self, ident: Identifier, data: Data):
+        self.defs['code_table'].append(ParsedDef('code_table', validate_ident(ident), data))
+
+    def declare(self, kind: str, declaration: str) -> Identifier:
+        '''Adds a `kind` (function, event or error) declaration, the `#define <kind>` is optional'''
+        assert kind in DECLARATIONS, f'Unknown declaration kind "{kind}"'
+        text = re.sub(rf'^\s*(#define\s+)?({kind}\s+)?', f'#define {kind} ', declaration)
+        try:
+            defs = list(get_defs(lex_huff_cached(text)))
+        except ParseError:
+            defs = []
+        assert len(defs) == 1 and defs[0].name == kind, f'Expected a single {kind} declaration, found {declaration!r}'
+        self.defs[kind].append(defs[0])
+        return get_ident(defs[0])
+
+    def function(self, declaration: str) -> Identifier:
+        '''E.g. `transfer(address, uint256) nonpayable returns (bool)`'''
+        return self.declare('function', declaration)
+
+    def event(self, declaration: str) -> Identifier:
+        return self.declare('event', declaration)
+
+    def error(self, declaration: str) -> Identifier:
+        return self.declare('error', declaration)
+
+    def compile(
+        self,
+        constant_overrides: dict[Identifier, bytes],
+        evm_version: EvmTarget,
+        optimize: Optional[OptimizeMode] = None,
+        strict: bool = False,
+        synthesize: Optional[SynthesisObjective] = None,
+        objects: Sequence[HuffObject] = (),
+        size_report: bool = False,
+        expansion_limits: ExpansionLimits = DEFAULT_EXPANSION_LIMITS
+    ) -> CompileResult:
+        return compile_from_defs(
+            self.defs, constant_overrides, evm_version, optimize, strict=strict, synthesize=synthesize,
+            objects=objects, size_report=size_report, expansion_limits=expansion_limits
+        )
@@ -0,0 +1,256 @@
+'''
+On-disk cache of whole compilation results.
+
+Results are keyed by a hash of every source file and binary code table reachable from the entry
+file, the constant overrides, the compile options, linked objects and the compiler itself (its
+version and a digest of its source). Files are located by scanning for includes and table paths
+without lexing, on a cache hit nothing is lexed, parsed or assembled.
+
+Entries are written to a temporary file and atomically renamed into place so that any number of
+processes can share one cache directory. Once the cache exceeds its size limit the least recently
+used entries (by modification time, refreshed on every hit) are evicted.
+'''
+from typing import Optional, Sequence, Generator
+from functools import lru_cache
+from importlib import metadata
+import hashlib
+import json
+import os
+import re
+import tempfile
+from .compile import compile, CompileResult
+from .evm_version import EvmTarget, validate_evm_version
+from .expansion import ExpansionLimits, DEFAULT_EXPANSION_LIMITS
+from .objects import object_to_json
+from .optimize import OptimizeMode, OptimizationNote
+from .parser import Identifier, Json
+from .relocation import HuffObject
+from .size_report import size_report_to_json, size_report_from_json
+from .sources import SourceProvider, DISK_SOURCE
+from .synthesis import SynthesisObjective
+
+CACHE_FORMAT_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+    'py-huff'
+)
+DEFAULT_MAX_CACHE_BYTES = 64 * 1024 * 1024
+ENTRY_SUFFIX = '.json'
+
+# Comments are matched first so that includes and table files within them are skipped
+DEPENDENCY_SCAN = re.compile(
+    r'//[^\n]*|/\*.*?\*/|#include\s*"([^"\n]*)"|file\s*\(\s*"([^"\n]*)"\s*\)',
+    re.S
+)
+
+
+@lru_cache(maxsize=None)
+def compiler_fingerprint() -> str:
+    '''Installed py-huff version together with a digest of the compiler's own source files'''
+    try:
+        version = metadata.version('py-huff')
+    except metadata.PackageNotFoundError:
+        version = 'unknown'
+    digest = hashlib.sha256()
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(package_dir)):
+        if name.endswith('.py'):
+            with open(os.path.join(package_dir, name), 'rb') as f:
+                digest.update(name.encode() + b'\0' + f.read())
+    return f'{version}+{digest.hexdigest()}'
+
+
+def scan_dependencies(
+    fp: str,
+    source: SourceProvider = DISK_SOURCE,
+    visited: Optional[set[str]] = None
+) -> Generator[tuple[str, bytes], None, None]:
+    '''Path and contents of `fp`, every file it (transitively) includes and all table files'''
+    if visited is None:
+        visited = set()
+    fp = source.normalize(fp)
+    if fp in visited:
+        return
+    visited.add(fp)
+    text = source.read_text(fp)
+    yield fp, text.encode()
+    for m in DEPENDENCY_SCAN.finditer(text):
+        include, table_file = m.groups()
+        if include is not None:
+            yield from scan_dependencies(source.join(fp, include), source, visited)
+        elif table_file is not None and (table_fp := source.join(fp, table_file)) not in visited:
+            visited.add(table_fp)
+            yield table_fp, bytes(source.read_binary(table_fp))
+
+
+def cache_key(
+    entry_fp: str,
+    constant_overrides: dict[Identifier, bytes],
+    options: dict[str, Json],
+    source: SourceProvider = DISK_SOURCE,
+    objects: Sequence[HuffObject] = ()
+) -> Optional[str]:
+    '''Hash identifying a compilation, `None` if its inputs cannot be read'''
+    try:
+        files: list[Json] = [
+            [path, hashlib.sha256(contents).hexdigest()]
+            for path, contents in scan_dependencies(entry_fp, source)
+        ]
+    except OSError:
+        return None
+    key_data: Json = {
+        'cache': CACHE_FORMAT_VERSION,
+        'compiler': compiler_fingerprint(),
+        'entry': source.normalize(entry_fp),
+        'files': files,
+        'constants': {ident: value.hex() for ident, value in sorted(constant_overrides.items())},
+        'options': options,
+        'objects': [
+            hashlib.sha256(json.dumps(object_to_json(obj)).encode()).hexdigest()
+            for obj in objects
+        ]
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+
+def entry_path(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, key + ENTRY_SUFFIX)
+
+
+def result_to_json(result: CompileResult) -> dict[str, Json]:
+    warnings: list[Json] = list(result.warnings)
+    return {
+        'runtime': result.runtime.hex(),
+        'deploy': result.deploy.hex(),
+        'abi': result.abi,
+        'optimizations': [list(note) for note in result.optimizations],
+        'warnings': warnings,
+        'sizeReport': None if result.size_report is None else size_report_to_json(result.size_report)
+    }
+
+
+def result_from_json(data: dict) -> CompileResult:
+    return CompileResult(
+        runtime=bytes.fromhex(data['runtime']),
+        deploy=bytes.fromhex(data['deploy']),
+        abi=data['abi'],
+        optimizations=[OptimizationNote(*note) for note in data['optimizations']],
+        warnings=data['warnings'],
+        size_report=None if data['sizeReport'] is None else size_report_from_json(data['sizeReport'])
+    )
+
+
+def load_result(cache_dir: str, key: str) -> Optional[CompileResult]:
+    fp = entry_path(cache_dir, key)
+    try:
+        with open(fp) as f:
+            result = result_from_json(json.load(f))
+        # Refresh for least recently used eviction
+        os.utime(fp)
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return result
+
+
+def store_result(
+    cache_dir: str,
+    key: str,
+    result: CompileResult,
+    max_bytes: int = DEFAULT_MAX_CACHE_BYTES
+):
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_fp = tempfile.mkstemp(dir=cache_dir, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(result_to_json(result), f, separators=(',', ':'))
+        os.replace(tmp_fp, entry_path(cache_dir, key))
+    except BaseException:
+        try:
+            os.remove(tmp_fp)
+        except OSError:
+            pass
+        raise
+    evict(cache_dir, max_bytes)
+
+
+def cache_entries(cache_dir: str) -> list[tuple[float, int, str]]:
+    '''Modification time, size and path of all entries, oldest first'''
+    entries: list[tuple[float, int, str]] = []
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(ENTRY_SUFFIX) or entry.name.startswith('.'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except FileNotFoundError:
+        return []
+    return sorted(entries)
+
+
+def evict(cache_dir: str, max_bytes: int):
+    '''Removes the least recently used entries until the cache fits within `max_bytes`'''
+    entries = cache_entries(cache_dir)
+    total = sum(size for _, size, _ in entries)
+    for _, size, fp in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(fp)
+        except FileNotFoundError:
+            # Concurrently evicted by another process
+            pass
+        total -= size
+
+
+def clear_cache(cache_dir: str = DEFAULT_CACHE_DIR) -> int:
+    '''Removes all entries, returns how many were removed'''
+    entries = cache_entries(cache_dir)
+    for _, _, fp in entries:
+        try:
+            os.remove(fp)
+        except FileNotFoundError:
+            pass
+    return len(entries)
+
+
+def compile_cached(
+    entry_fp: str,
+    constant_overrides: dict[Identifier, bytes],
+    evm_version: EvmTarget,
+    optimize: Optional[OptimizeMode] = None,
+    source: SourceProvider = DISK_SOURCE,
+    strict: bool = False,
+    synthesize: Optional[SynthesisObjective] = None,
+    objects: Sequence[HuffObject] = (),
+    size_report: bool = False,
+    expansion_limits: ExpansionLimits = DEFAULT_EXPANSION_LIMITS,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    max_bytes: int = DEFAULT_MAX_CACHE_BYTES
+) -> CompileResult:
+    '''`compile` returning the stored result if the same inputs were compiled before'''
+    options: dict[str, Json] = {
+        'evmVersion': validate_evm_version(evm_version),
+        'optimize': optimize,
+        'strict': strict,
+        'synthesize': synthesize,
+        'sizeReport': size_report,
+        'expansionLimits': list(expansion_limits)
+    }
+    key = cache_key(entry_fp, constant_overrides, options, source, objects)
+    if key is not None and (cached := load_result(cache_dir, key)) is not None:
+        return cached
+    result = compile(
+        entry_fp, constant_overrides, evm_version, optimize, source, strict, synthesize, objects,
+        size_report, expansion_limits
+    )
+    if key is not None:
+        try:
+            store_result(cache_dir, key, result, max_bytes)
+        except OSError:
+            # Caching is best effort, e.g. for read-only cache directories
+            pass
+    return result
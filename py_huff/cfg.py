@@ -0,0 +1,304 @@
+'''
+Control-flow graph over expanded assembly, with unreachable code elimination and jump threading.
+
+Blocks start at a `JUMPDEST` (together with the marks directly preceding it) and after every
+`JUMP`, `JUMPI` or terminating opcode. A `MarkRef` directly followed by `JUMP` / `JUMPI` is a static
+edge. Any other reference to a mark (e.g. pushed return addresses, `__tablestart`, jump tables)
+lets the address escape: the block containing the mark is then conservatively treated as reachable
+from the referencing block.
+
+Only non-mark steps are removed, marks of removed blocks are kept so that invocation and table
+marks stay balanced. Programs jumping to literal offsets, using `PC` or computing jump targets
+while containing a `JUMPDEST` without label are left untouched as removing code would shift their
+targets.
+'''
+from typing import NamedTuple, Optional
+from .assembler import (
+    Asm, Mark, MarkId, MarkPurpose, MarkRef, MarkDeltaRef, MarkOffset, get_min_static_size_bytes
+)
+from .opcodes import Op, op, OP_MAP, TERMINATING_OPS, BASE_GAS
+from .optimize import OptimizationNote
+from .utils import s
+
+JUMP_OPS = frozenset({OP_MAP['jump'], OP_MAP['jumpi']})
+
+# PUSH <label> JUMP + JUMPDEST skipped per threaded jump
+THREADED_GAS = 3 + BASE_GAS[OP_MAP['jump']] + BASE_GAS[OP_MAP['jumpdest']]
+
+BasicBlock = NamedTuple('BasicBlock', [('start', int), ('end', int)])
+
+ControlFlowGraph = NamedTuple(
+    'ControlFlowGraph',
+    [
+        ('blocks', list[BasicBlock]),
+        ('successors', list[list[int]]),
+        # Blocks reachable independent of the static edges: the entry & escaped labels
+        ('roots', set[int]),
+        ('mark_blocks', dict[MarkId, int])
+    ]
+)
+
+
+def is_op(step: Asm, name: str) -> bool:
+    return isinstance(step, Op) and step.op == OP_MAP[name]
+
+
+def is_static_jump(asm: list[Asm], i: int) -> bool:
+    '''Whether step `i` is a `MarkRef` consumed as the target of the directly following jump'''
+    return (
+        isinstance(asm[i], MarkRef)
+        and i + 1 < len(asm)
+        and isinstance(next_step := asm[i + 1], Op)
+        and next_step.op in JUMP_OPS
+    )
+
+
+def has_dynamic_offsets(asm: list[Asm]) -> bool:
+    '''
+    Whether the code jumps to literal offsets, uses `PC` or computes jump targets while containing a
+    `JUMPDEST` without label (only reachable through a literal offset)
+    '''
+    computed_jump = bare_jumpdest = False
+    for i, step in enumerate(asm):
+        if not isinstance(step, Op):
+            continue
+        if step.op == OP_MAP['pc']:
+            return True
+        if step.op in JUMP_OPS and i > 0:
+            prev = asm[i - 1]
+            if isinstance(prev, Op) and OP_MAP['push0'] <= prev.op <= OP_MAP['push32']:
+                return True
+            computed_jump |= not isinstance(prev, MarkRef)
+        if step.op == OP_MAP['jumpdest']:
+            bare_jumpdest |= not (i > 0 and isinstance(prev := asm[i - 1], Mark)
+                                  and prev.mid.purpose == MarkPurpose.Label)
+        if computed_jump and bare_jumpdest:
+            return True
+    return False
+
+
+def split_blocks(asm: list[Asm]) -> list[BasicBlock]:
+    starts = [0]
+    for i, step in enumerate(asm):
+        if is_op(step, 'jumpdest'):
+            start = i
+            while start > starts[-1] and isinstance(asm[start - 1], Mark):
+                start -= 1
+            if start > starts[-1]:
+                starts.append(start)
+        elif isinstance(step, Op) and (step.op in TERMINATING_OPS or step.op in JUMP_OPS):
+            if i + 1 < len(asm):
+                starts.append(i + 1)
+    return [BasicBlock(start, end) for start, end in zip(starts, starts[1:] + [len(asm)])]
+
+
+def escaped_marks(step: Asm) -> list[MarkId]:
+    if isinstance(step, MarkRef):
+        return [step.mid]
+    if isinstance(step, MarkDeltaRef):
+        return [step.start, step.end]
+    if isinstance(step, MarkOffset):
+        return [step.mid]
+    return []
+
+
+def last_op(asm: list[Asm], block: BasicBlock) -> Optional[Op]:
+    for step in reversed(asm[block.start:block.end]):
+        if isinstance(step, Op):
+            return step
+        if not isinstance(step, Mark):
+            return None
+    return None
+
+
+def build_cfg(asm: list[Asm], external_refs: list[Asm] = []) -> ControlFlowGraph:
+    '''CFG of `asm`, references within `external_refs` (e.g. appended tables) escape'''
+    blocks = split_blocks(asm)
+    mark_blocks: dict[MarkId, int] = {}
+    block_of_step: list[int] = []
+    for b, block in enumerate(blocks):
+        for i in range(block.start, block.end):
+            block_of_step.append(b)
+            if isinstance(step := asm[i], Mark):
+                mark_blocks[step.mid] = b
+
+    successors: list[list[int]] = [[] for _ in blocks]
+    roots: set[int] = {0} if blocks else set()
+    roots.update(
+        mark_blocks[mid]
+        for step in external_refs
+        for mid in escaped_marks(step)
+        if mid in mark_blocks
+    )
+    for i, step in enumerate(asm):
+        # Escaped addresses may be jumped to at any point once their block was reached
+        targets = [step.mid] if isinstance(step, MarkRef) else escaped_marks(step)
+        successors[block_of_step[i]].extend(mark_blocks[mid] for mid in targets if mid in mark_blocks)
+    for b, block in enumerate(blocks):
+        final = last_op(asm, block)
+        if b + 1 < len(blocks) and not (final is not None and final.op in TERMINATING_OPS):
+            successors[b].append(b + 1)
+    return ControlFlowGraph(blocks, successors, roots, mark_blocks)
+
+
+def reachable_blocks(cfg: ControlFlowGraph) -> set[int]:
+    reachable: set[int] = set()
+    stack = list(cfg.roots)
+    while stack:
+        b = stack.pop()
+        if b in reachable:
+            continue
+        reachable.add(b)
+        stack.extend(cfg.successors[b])
+    return reachable
+
+
+def step_bytes(step: Asm, ref_size: int) -> int:
+    if isinstance(step, (MarkRef, MarkDeltaRef)):
+        return 1 + ref_size
+    if isinstance(step, Op):
+        return 1 + len(step.extra_data)
+    if isinstance(step, Mark):
+        return 0
+    if isinstance(step, MarkOffset):
+        return step.size
+    return len(step)
+
+
+def remove_unreachable(asm: list[Asm], external_refs: list[Asm] = []) -> tuple[list[Asm], int, int]:
+    '''Removes the steps of unreachable blocks, returns the new asm, removed blocks and bytes'''
+    cfg = build_cfg(asm, external_refs)
+    reachable = reachable_blocks(cfg)
+    if len(reachable) == len(cfg.blocks):
+        return asm, 0, 0
+    ref_size = get_min_static_size_bytes(asm)
+    new_asm: list[Asm] = []
+    removed_blocks = 0
+    removed_bytes = 0
+    for b, block in enumerate(cfg.blocks):
+        steps = asm[block.start:block.end]
+        if b in reachable:
+            new_asm.extend(steps)
+            continue
+        removed = [step for step in steps if not isinstance(step, Mark)]
+        if removed:
+            removed_blocks += 1
+            removed_bytes += sum(step_bytes(step, ref_size) for step in removed)
+        new_asm.extend(step for step in steps if isinstance(step, Mark))
+    return new_asm, removed_blocks, removed_bytes
+
+
+def trampoline_target(asm: list[Asm], block: BasicBlock) -> Optional[MarkId]:
+    '''Target of a block that only consists of `JUMPDEST PUSH <label> JUMP`'''
+    steps = [step for step in asm[block.start:block.end] if not isinstance(step, Mark)]
+    if len(steps) != 3 or not is_op(steps[0], 'jumpdest') or not is_op(steps[2], 'jump'):
+        return None
+    target = steps[1]
+    return target.mid if isinstance(target, MarkRef) else None
+
+
+def thread_jumps(asm: list[Asm], external_refs: list[Asm] = []) -> tuple[list[Asm], int, int]:
+    '''
+    Retargets static jumps to blocks that only jump onward to their final destination and drops
+    jumps to the directly following instruction. Returns the new asm, the number of retargeted
+    and the number of dropped jumps.
+    '''
+    cfg = build_cfg(asm, external_refs)
+    forwards: dict[MarkId, MarkId] = {}
+    for block in cfg.blocks:
+        if (target := trampoline_target(asm, block)) is None:
+            continue
+        for step in asm[block.start:block.end]:
+            if isinstance(step, Mark):
+                forwards[step.mid] = target
+
+    def final_target(mid: MarkId) -> MarkId:
+        seen = {mid}
+        while (nxt := forwards.get(mid)) is not None and nxt not in seen:
+            seen.add(nxt)
+            mid = nxt
+        return mid
+
+    def falls_through_to(i: int, target: MarkId) -> bool:
+        for step in asm[i:]:
+            if step == Mark(target):
+                return True
+            if not isinstance(step, Mark):
+                return False
+        return False
+
+    new_asm: list[Asm] = []
+    retargeted = 0
+    dropped = 0
+    i = 0
+    while i < len(asm):
+        step = asm[i]
+        if not is_static_jump(asm, i):
+            new_asm.append(step)
+            i += 1
+            continue
+        assert isinstance(step, MarkRef)
+        jump = asm[i + 1]
+        target = final_target(step.mid)
+        if falls_through_to(i + 2, target):
+            # A conditional jump still has to consume its condition
+            if is_op(jump, 'jumpi'):
+                new_asm.append(op('pop'))
+            dropped += 1
+        else:
+            retargeted += target != step.mid
+            new_asm.extend([MarkRef(target), jump])
+        i += 2
+    return new_asm, retargeted, dropped
+
+
+def optimize_control_flow(
+    asm: list[Asm],
+    root: str,
+    external_refs: list[Asm] = []
+) -> tuple[list[Asm], list[OptimizationNote]]:
+    '''
+    Threads jumps and removes unreachable code until neither changes anything, references in
+    `external_refs` escape. Returns the new asm with a note per kind of applied change.
+    '''
+    if has_dynamic_offsets(asm):
+        return asm, []
+    ref_size = get_min_static_size_bytes(asm)
+    total_retargeted = total_dropped = total_blocks = total_removed = 0
+    while True:
+        asm, retargeted, dropped = thread_jumps(asm, external_refs)
+        asm, blocks, removed = remove_unreachable(asm, external_refs)
+        total_retargeted += retargeted
+        total_dropped += dropped
+        total_blocks += blocks
+        total_removed += removed
+        if not (retargeted or dropped or blocks):
+            break
+
+    notes: list[OptimizationNote] = []
+    if total_retargeted:
+        notes.append(OptimizationNote(
+            'jump-threading',
+            root,
+            0,
+            -THREADED_GAS,
+            f'{total_retargeted} jump{s(total_retargeted)} retargeted past blocks that only jump '
+            f'onward, saving ~{THREADED_GAS} gas per skipped hop'
+        ))
+    if total_dropped:
+        notes.append(OptimizationNote(
+            'jump-threading',
+            root,
+            total_dropped * (1 + ref_size),
+            -THREADED_GAS,
+            f'{total_dropped} jump{s(total_dropped)} to the directly following instruction removed'
+        ))
+    if total_blocks:
+        notes.append(OptimizationNote(
+            'dead-code',
+            root,
+            total_removed,
+            0,
+            f'{total_blocks} unreachable block{s(total_blocks)} removed, saving ~{total_removed} bytes'
+        ))
+    return asm, notes
@@ -1,26 +1,179 @@
 import re
+import sys
 from argparse import ArgumentParser
 import json
-from .parser import Identifier, literal_to_bytes
-from .compile import compile
+from .parser import Identifier, Json, literal_to_bytes
+from .utils import s
+from .compile import compile, CompileResult
+from .cache import DEFAULT_CACHE_DIR, compile_cached, clear_cache
+from .objects import compile_object, save_object, load_object
+from .relocation import HuffObject
+from .size_report import format_size_report, size_report_to_json
+from .optimize import OPTIMIZE_MODES, format_note
+from .evm_version import EVM_VERSIONS, DEFAULT_EVM_VERSION, PRE_PUSH0_EVM_VERSION, validate_evm_version
+from .synthesis import SYNTHESIS_OBJECTIVES
+from .expansion import ExpansionLimits, DEFAULT_EXPANSION_LIMITS
+from .artifacts import artifact_json, write_ndjson_artifact, write_ndjson_error
+from .fuzz import main as fuzz_main
+from .lsp import main as lsp_main
+from .build import main as build_main
+from .create2 import main as create2_main
 
 
 def parse_args():
     parser = ArgumentParser(
         description='A CLI for compiling Huff source code files to bytecode'
     )
-    parser.add_argument('path', type=str)
+    parser.add_argument('path', type=str, nargs='*')
     parser.add_argument('--runtime', '-r', action='store_true')
     parser.add_argument('--deploy', '-b', action='store_true')
     parser.add_argument('--constant', '-c', action='append', default=[])
     parser.add_argument('--artifacts', '-a', nargs='?',
                         const='artifacts.json', default=None)
-    parser.add_argument('--avoid-push0', action='store_true')
+    parser.add_argument('--evm-version', choices=EVM_VERSIONS, default=None,
+                        help=f'target EVM version (default: {DEFAULT_EVM_VERSION})')
+    parser.add_argument('--avoid-push0', action='store_true',
+                        help=f'deprecated, same as --evm-version {PRE_PUSH0_EVM_VERSION}')
+    parser.add_argument('--optimize', '-O', choices=OPTIMIZE_MODES, default=None)
+    parser.add_argument('--synthesize', choices=SYNTHESIS_OBJECTIVES, default=None,
+                        help='synthesize wide constants with cheaper instruction sequences')
+    parser.add_argument('--strict', action='store_true',
+                        help='validate all definitions, not only those reachable from MAIN / CONSTRUCTOR')
+    parser.add_argument('--ndjson', nargs='?', const='-', default=None,
+                        help='stream one compact JSON artifact line per compiled file ("-" for stdout)')
+    parser.add_argument('--metadata', action='store_true',
+                        help='include compiler options in NDJSON artifacts')
+    parser.add_argument('--emit-object', type=str, default=None, metavar='OBJECT',
+                        help='compile the library at path into a relocatable object file')
+    parser.add_argument('--link', action='append', default=[], metavar='OBJECT',
+                        help='link a library object file, can be repeated')
+    parser.add_argument('--size-report', action='store_true',
+                        help='print the code size attributed to each macro')
+    parser.add_argument('--size-report-json', type=str, default=None, metavar='FILE',
+                        help='write the per-macro size report as JSON')
+    parser.add_argument('--max-expansion-steps', type=int, default=DEFAULT_EXPANSION_LIMITS.max_steps,
+                        help='reject entry points predicted to expand to more assembly steps '
+                        f'(default: {DEFAULT_EXPANSION_LIMITS.max_steps})')
+    parser.add_argument('--max-expansion-depth', type=int, default=DEFAULT_EXPANSION_LIMITS.max_depth,
+                        help='maximum macro nesting depth (default: no limit)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always recompile, bypassing the result cache')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='remove all cached results before compiling')
+    parser.add_argument('--cache-dir', type=str, default=DEFAULT_CACHE_DIR,
+                        help=f'result cache directory (default: {DEFAULT_CACHE_DIR})')
     return parser.parse_args()
 
 
+def compile_path(args, path: str, constant_overrides: dict[Identifier, bytes], objects: list[HuffObject]) -> CompileResult:
+    size_report = args.size_report or args.size_report_json is not None
+    limits = ExpansionLimits(args.max_expansion_steps, args.max_expansion_depth)
+    if args.no_cache:
+        return compile(
+            path, constant_overrides, args.evm_version, args.optimize,
+            strict=args.strict, synthesize=args.synthesize, objects=objects, size_report=size_report,
+            expansion_limits=limits
+        )
+    return compile_cached(
+        path, constant_overrides, args.evm_version, args.optimize,
+        strict=args.strict, synthesize=args.synthesize, objects=objects, size_report=size_report,
+        expansion_limits=limits, cache_dir=args.cache_dir
+    )
+
+
+def print_bytecode(args, compiled: CompileResult, header: str | None):
+    if header is not None:
+        print(f'{header}:')
+    if args.runtime and args.deploy:
+        print(f'bytecode: {compiled.deploy.hex()}')
+        print(f'\nruntime: {compiled.runtime.hex()}')
+    elif args.runtime:
+        print(compiled.runtime.hex())
+    elif args.deploy:
+        print(compiled.deploy.hex())
+
+
+def print_diagnostics(compiled: CompileResult):
+    for warning in compiled.warnings:
+        print(f'warning: {warning}', file=sys.stderr)
+    for note in compiled.optimizations:
+        print(format_note(note), file=sys.stderr)
+
+
+def report_sizes(args, path: str, compiled: CompileResult, reports: dict[str, Json]):
+    if compiled.size_report is None:
+        return
+    if args.size_report:
+        if len(args.path) > 1:
+            print(f'{path}:', file=sys.stderr)
+        print(format_size_report(compiled.size_report), file=sys.stderr)
+    reports[path] = size_report_to_json(compiled.size_report)
+
+
+def write_size_reports(args, reports: dict[str, Json]):
+    if args.size_report_json is not None:
+        with open(args.size_report_json, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+
+def stream_ndjson(
+    args,
+    constant_overrides: dict[Identifier, bytes],
+    objects: list[HuffObject],
+    reports: dict[str, Json]
+) -> bool:
+    metadata = {
+        'constants': {name: f'0x{value.hex()}' for name, value in constant_overrides.items()},
+        'evmVersion': args.evm_version,
+        'optimize': args.optimize,
+        'strict': args.strict,
+        'synthesize': args.synthesize
+    } if args.metadata else None
+    out = sys.stdout if args.ndjson == '-' else open(args.ndjson, 'w')
+    all_ok = True
+    try:
+        for path in args.path:
+            try:
+                compiled = compile_path(args, path, constant_overrides, objects)
+            except Exception as err:
+                all_ok = False
+                write_ndjson_error(out, path, f'{type(err).__name__}: {err}')
+                continue
+            print_diagnostics(compiled)
+            report_sizes(args, path, compiled, reports)
+            write_ndjson_artifact(out, path, compiled, metadata)
+            if out is not sys.stdout:
+                print_bytecode(args, compiled, path if len(args.path) > 1 else None)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return all_ok
+
+
+SUBCOMMANDS = {
+    'build': build_main,
+    'create2': create2_main,
+    'fuzz': fuzz_main,
+    'lsp': lsp_main
+}
+
+
 def main() -> None:
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+        return
+
     args = parse_args()
+    assert not (args.avoid_push0 and args.evm_version is not None), \
+        'Cannot combine --avoid-push0 with --evm-version'
+    args.evm_version = validate_evm_version(args.evm_version or args.avoid_push0)
+
+    if args.clear_cache:
+        removed = clear_cache(args.cache_dir)
+        print(f'Removed {removed} cached result{s(removed)}', file=sys.stderr)
+        if not args.path:
+            return
+    assert args.path, 'No input files'
 
     constant_overrides: dict[Identifier, bytes] = {}
     for override in args.constant:
@@ -31,29 +184,41 @@ def main() -> None:
         assert name not in constant_overrides, f'Duplicate override for constant "{name}"'
         constant_overrides[name] = literal_to_bytes(value)
 
-    compiled = compile(args.path, constant_overrides, args.avoid_push0)
+    if args.emit_object is not None:
+        assert len(args.path) == 1, 'Objects can only be emitted for a single library'
+        save_object(compile_object(args.path[0], args.evm_version), args.emit_object)
+        return
 
-    if args.runtime and args.deploy:
-        print(f'bytecode: {compiled.deploy.hex()}')
-        print(f'\nruntime: {compiled.runtime.hex()}')
-    elif args.runtime:
-        print(compiled.runtime.hex())
-    elif args.deploy:
-        print(compiled.deploy.hex())
-    else:
+    objects = [load_object(fp) for fp in args.link]
+    reports: dict[str, Json] = {}
+
+    if args.ndjson is not None:
+        assert args.artifacts is None, 'Cannot combine --artifacts with --ndjson'
+        all_ok = stream_ndjson(args, constant_overrides, objects, reports)
+        write_size_reports(args, reports)
+        if not all_ok:
+            sys.exit(1)
+        return
+
+    assert args.artifacts is None or len(args.path) == 1, \
+        'JSON artifacts only support a single input, use --ndjson for multiple'
+
+    if not (args.runtime or args.deploy):
         print('WARNING: Neither runtime or deploy bytecode output')
 
-    if args.artifacts is not None:
-        with open(args.artifacts, 'w') as f:
-            json.dump({
-                'abi': compiled.abi,
-                'deployedBytecode': {
-                    'object': f'0x{compiled.runtime.hex()}'
-                },
-                'bytecode': {
-                    'object': f'0x{compiled.deploy.hex()}'
-                }
-            }, f, indent=2)
+    for path in args.path:
+        compiled = compile_path(args, path, constant_overrides, objects)
+
+        print_diagnostics(compiled)
+        report_sizes(args, path, compiled, reports)
+
+        print_bytecode(args, compiled, path if len(args.path) > 1 else None)
+
+        if args.artifacts is not None:
+            with open(args.artifacts, 'w') as f:
+                json.dump(artifact_json(compiled), f, indent=2)
+
+    write_size_reports(args, reports)
 
 
 if __name__ == '__main__':
@@ -1,11 +1,15 @@
-from typing import NamedTuple, Callable, Optional, Any, Iterable
+from typing import NamedTuple, Callable, Optional, Any, Iterable, Mapping
+from types import MappingProxyType
 import inspect
 from .lexer import ExNode
 from .assembler import *
 from .parser import *
 from .opcodes import OP_MAP, Op, op
-from .context import ContextTracker
-from .utils import s, keccak256, set_unique, byte_size
+from .context import ContextTracker, ObjectId
+from .relocation import ObjectMacro, SymbolicMarkId, SymbolicMark, SymbolicMarkRef, SymbolicMarkDeltaRef
+from .dispatch import DispatchEntry, gen_dispatch
+from .evm_version import EvmVersion, has_push0, supports_opcode, unsupported_opcode_error
+from .utils import s, sig_hash, set_unique, byte_size
 
 
 MacroArg = Op | MarkRef
@@ -20,7 +24,8 @@ ConstructorData = NamedTuple(
 CodeTable = NamedTuple(
     'CodeTable',
     [
-        ('data', bytes),
+        # Generated tables (e.g. jump tables) consist of assembly steps
+        ('data', Data | tuple[Asm, ...]),
         ('obj_id', ObjectId)
     ]
 )
@@ -34,14 +39,27 @@ GlobalScope = NamedTuple(
         ('code_tables', dict[Identifier, CodeTable]),
         ('functions', dict[Identifier, ExNode]),
         ('events', dict[Identifier, ExNode]),
-        ('errors', dict[Identifier, ExNode])
+        ('errors', dict[Identifier, ExNode]),
+        # Pre-expanded macros of linked objects
+        ('object_macros', dict[Identifier, ObjectMacro])
     ]
 )
 
 CompileOptions = NamedTuple(
     'CompileOptions',
     [
-        ('avoid_push0', bool)
+        ('evm_version', EvmVersion)
+    ]
+)
+
+# Context of a built-in invocation, available to built-ins declared with `env_builtin`
+BuiltinEnv = NamedTuple(
+    'BuiltinEnv',
+    [
+        ('coptions', CompileOptions),
+        ('labels', dict[Identifier, MarkId]),
+        ('ctx', ContextTracker),
+        ('trace', str)
     ]
 )
 
@@ -50,24 +68,49 @@ InvokeValue = MacroArg | GeneralRef | MacroParam
 
 class Scope:
     g: GlobalScope
-    referenced_tables: set[Identifier]
+    referenced_tables: dict[Identifier, CodeTable]
     for_constructor: Optional[ConstructorData]
-
-    def __init__(self, g: GlobalScope, for_constructor: Optional[ConstructorData]) -> None:
+    invocations: Optional[dict[ObjectId, Identifier]]
+
+    def __init__(
+        self,
+        g: GlobalScope,
+        for_constructor: Optional[ConstructorData],
+        track_invocations: bool = False
+    ) -> None:
         self.__g = g
-        self.referenced_tables = set()
+        self.referenced_tables = {}
         self.for_constructor = for_constructor
+        # When tracked, macro expansions are delimited by start & end marks of an object ID
+        # mapped to the invoked macro
+        self.invocations = {} if track_invocations else None
 
     def reference_table(self, ident: Identifier) -> CodeTable:
         code_table = self.get_code_table(ident)
-        self.referenced_tables.add(ident)
+        self.referenced_tables[ident] = code_table
+        return code_table
+
+    def add_generated_table(self, name: str, data: tuple[Asm, ...], obj_id: ObjectId) -> CodeTable:
+        '''Registers a table generated by the built-in `name` to be appended to the code'''
+        code_table = CodeTable(data, obj_id)
+        self.referenced_tables[f'{name}#{len(self.referenced_tables)}'] = code_table
         return code_table
 
+    def unique_referenced_tables(self) -> list[CodeTable]:
+        '''Referenced code tables in order of first reference, tables with identical contents share an object ID'''
+        return list({
+            table.obj_id: table
+            for table in self.referenced_tables.values()
+        }.values())
+
     def get_macro(self, ident: Identifier) -> Macro:
         assert ident in self.__g.macros, f'Undefined macro "{ident}"'
         return self.__g.macros[ident]
 
-    def get_constant(self, ident: Identifier) -> Op:
+    def get_object_macro(self, ident: Identifier) -> Optional[ObjectMacro]:
+        return self.__g.object_macros.get(ident)
+
+    def get_constant(self, ident: Identifier) -> MacroArg:
         assert ident in self.__g.constants, f'Undefined constant "{ident}"'
         return self.__g.constants[ident]
 
@@ -75,6 +118,9 @@ class Scope:
         assert ident in self.__g.code_tables, f'Undefined code table "{ident}"'
         return self.__g.code_tables[ident]
 
+    def all_functions(self) -> dict[Identifier, ExNode]:
+        return self.__g.functions
+
     def get_function(self, ident: Identifier) -> ExNode:
         assert ident in self.__g.functions, f'Undefined function "{ident}"'
         return self.__g.functions[ident]
@@ -88,6 +134,12 @@ class Scope:
         return self.__g.errors[ident]
 
 
+def code_table_size(table: CodeTable) -> int:
+    if isinstance(table.data, tuple):
+        return sum(map(min_static_size, table.data))
+    return len(table.data)
+
+
 def not_implemented(fn_name, *_) -> list[Asm]:
     raise ValueError(f'Built-in {fn_name} not implemented yet')
 
@@ -105,7 +157,7 @@ def validate_params(name: str, args: list[InvokeValue], params: list[inspect.Par
 def builtin(f: Callable[..., list[Asm]]):
     params = list(inspect.signature(f).parameters.values())
 
-    def inner_builtin(name: str, scope: Scope, args: list[InvokeValue]) -> list[Asm]:
+    def inner_builtin(name: str, scope: Scope, args: list[InvokeValue], _env: BuiltinEnv) -> list[Asm]:
         validate_params(
             name,
             args,
@@ -115,6 +167,21 @@ def builtin(f: Callable[..., list[Asm]]):
     return inner_builtin
 
 
+def env_builtin(f: Callable[..., list[Asm]]):
+    '''Built-in receiving the `BuiltinEnv` of its invocation and a variable number of arguments'''
+    params = list(inspect.signature(f).parameters.values())
+    assert valid_annotation(params[1], BuiltinEnv), \
+        f'Environment built-in must accept `BuiltinEnv` as second input (found {params[1].annotation})'
+    arg_type = params[2].annotation
+
+    def inner_builtin(name: str, scope: Scope, args: list[InvokeValue], env: BuiltinEnv) -> list[Asm]:
+        for i, arg in enumerate(args, start=1):
+            assert isinstance(arg, arg_type), \
+                f'{name}: Invalid type {type(arg).__name__} found for arg {i}, expected {arg_type.__name__}'
+        return f(scope, env, *args)
+    return inner_builtin
+
+
 def valid_annotation(param: inspect.Parameter, expected: Any) -> bool:
     return param.annotation == expected or (
         param.name == '_' and param.annotation is inspect._empty
@@ -129,8 +196,7 @@ def constructor_builtin(f: Callable[..., list[Asm]]):
     assert valid_annotation(params[1], ConstructorData), \
         f'Constructor built-in must accept `ConstructorData` as second input (found {params[1].annotation})'
 
-    def inner_builtin(name: str, scope: Scope, args: list[InvokeValue]) -> list[Asm]:
-        print(f'args: {args}')
+    def inner_builtin(name: str, scope: Scope, args: list[InvokeValue], _env: BuiltinEnv) -> list[Asm]:
         validate_params(
             name,
             args,
@@ -142,6 +208,18 @@ def constructor_builtin(f: Callable[..., list[Asm]]):
     return inner_builtin
 
 
+def gen_code_tables(tables: Iterable[CodeTable]) -> list[Asm]:
+    asm: list[Asm] = []
+    for table in tables:
+        asm.append(to_start_mark(table.obj_id))
+        if isinstance(table.data, tuple):
+            asm.extend(table.data)
+        else:
+            asm.append(table.data)
+        asm.append(to_end_mark(table.obj_id))
+    return asm
+
+
 def gen_minimal_init(runtime: ObjectId, offset_op: Op) -> list[Asm]:
     return [
         to_size_mark_ref(runtime),   # [rsize]
@@ -161,33 +239,7 @@ def bytes_to_push(data: bytes, size: int | None = None, avoid_push0: bool = Fals
 
 
 def compile_literal(coptions: CompileOptions, literal: Literal) -> Op:
-    return bytes_to_push(literal.data, literal.size, coptions.avoid_push0)
-
-
-def num_to_push(num: int, alt: dict[int, Op] | None = None) -> Op:
-    alt_op = None if alt is None else alt.get(num)
-    if alt_op is not None:
-        return alt_op
-    return create_push(num.to_bytes(32, 'big'))
-
-
-def gen_tiny_init(runtime: bytes, zero_op: Op) -> list[Asm]:
-    assert len(runtime) <= 32, \
-        f'Runtime of size {len(runtime)} too large for "tiny" initializer'
-
-    if len(runtime) == 0:
-        return [op('stop')]
-
-    alts = {0: zero_op, 0x20: op('msize')}
-
-    return [
-        bytes_to_push(runtime),
-        zero_op,
-        op('mstore'),
-        num_to_push(len(runtime), alts),
-        num_to_push(0x20 - len(runtime), alts),
-        op('return')
-    ]
+    return bytes_to_push(literal.data, literal.size, not has_push0(coptions.evm_version))
 
 
 @builtin
@@ -216,7 +268,7 @@ def function_sig(scope: Scope, ref: GeneralRef) -> list[Asm]:
                 f'No error / function of name "{ref.ident}" found'
             )
     return [
-        create_push(keccak256(sig.encode())[:4])
+        create_push(sig_hash(sig)[:4])
     ]
 
 
@@ -225,10 +277,30 @@ def event_hash(scope: Scope, event_ref: GeneralRef) -> list[Asm]:
     event = scope.get_event(event_ref.ident)
     sig = event_to_sig(event)
     return [
-        create_push(keccak256(sig.encode()))
+        create_push(sig_hash(sig))
     ]
 
 
+@env_builtin
+def func_dispatch(scope: Scope, env: BuiltinEnv, *fn_refs: GeneralRef) -> list[Asm]:
+    '''Dispatches the selector on the stack to the labels named like the functions'''
+    fn_idents = [ref.ident for ref in fn_refs] or list(scope.all_functions())
+    assert fn_idents, '__FUNC_DISPATCH: No functions to dispatch'
+    entries: list[DispatchEntry] = []
+    for ident in fn_idents:
+        sig = function_to_sig(scope.get_function(ident))
+        assert ident in env.labels, \
+            f'__FUNC_DISPATCH: No label "{ident}" for function "{sig}" in {env.trace}'
+        entries.append(DispatchEntry(int.from_bytes(sig_hash(sig)[:4], 'big'), env.labels[ident]))
+    # `RETURNDATASIZE` isn't necessarily zero, the dispatcher may run after calls
+    zero = bytes_to_push(b'\x00', avoid_push0=not has_push0(env.coptions.evm_version))
+    asm, table, table_id = gen_dispatch(entries, env.ctx, zero)
+    if table is not None:
+        assert table_id is not None
+        scope.add_generated_table('__FUNC_DISPATCH', table, table_id)
+    return asm
+
+
 @constructor_builtin
 def runtime_start(_, cdata: ConstructorData) -> list[Asm]:
     return [to_start_mark_ref(cdata.runtime)]
@@ -244,28 +316,32 @@ def return_runtime(_, cdata: ConstructorData, offset_op: Op) -> list[Asm]:
     return gen_minimal_init(cdata.runtime, offset_op)
 
 
-BUILT_INS: dict[str, Callable[[str, Scope, list[InvokeValue]], list[Asm]]] = {
+# Read-only view, the registry is shared by all (possibly concurrent) compilations
+BUILT_INS: Mapping[str, Callable[[str, Scope, list[InvokeValue], BuiltinEnv], list[Asm]]] = MappingProxyType({
     '__codesize': not_implemented,
 
     '__EVENT_HASH': event_hash,
     '__FUNC_SIG': function_sig,
+    '__FUNC_DISPATCH': func_dispatch,
     '__tablestart': table_start,
     '__tablesize': table_size,
     '__RUNTIME_START': runtime_start,
     '__RUNTIME_SIZE': runtime_size,
     '__RETURN_RUNTIME': return_runtime
-}
+})
 
 
-def invoke_built_in(fn_name: str, scope: Scope, args: list[InvokeValue]) -> list[Asm]:
+def invoke_built_in(fn_name: str, scope: Scope, args: list[InvokeValue], env: BuiltinEnv) -> list[Asm]:
     assert fn_name in BUILT_INS, f'Unrecognized built-in "{fn_name}"'
-    return BUILT_INS[fn_name](fn_name, scope, args)
+    return BUILT_INS[fn_name](fn_name, scope, args, env)
 
 
 def gen_constants(
     raw_constants: Iterable[tuple[Identifier, Optional[bytes]]],
-    constant_overrides: dict[Identifier, bytes]
+    constant_overrides: dict[Identifier, bytes],
+    evm_version: EvmVersion
 ) -> dict[Identifier, Op]:
+    avoid_push0 = not has_push0(evm_version)
     constants: dict[Identifier, Op] = {}
     free_ptr: int = 0
     for ident, value in raw_constants:
@@ -278,15 +354,84 @@ def gen_constants(
         set_unique(
             constants,
             ident,
-            bytes_to_push(value),
+            bytes_to_push(value, avoid_push0=avoid_push0),
             on_dup=lambda ident: f'Duplicate constant "{ident}"'
         )
     for ident, value in constant_overrides.items():
         assert ident in constants, f'Override for nonexistent constant "{ident}"'
-        constants[ident] = bytes_to_push(value)
+        constants[ident] = bytes_to_push(value, avoid_push0=avoid_push0)
     return constants
 
 
+def relocate_object_macro(
+    macro: ObjectMacro,
+    scope: Scope,
+    args: list[MacroArg],
+    labels: dict[Identifier, MarkId],
+    ctx: ContextTracker,
+    trace: str
+) -> list[Asm]:
+    '''Instantiates a linked macro, binding its symbols within the fresh context `ctx`'''
+    assert len(args) == len(macro.params), \
+        f'macro "{macro.ident}" received {len(args)} args, expected {len(macro.params)}'
+    ident_to_arg = dict(zip(macro.params, args))
+
+    def bind(mid: SymbolicMarkId) -> MarkId:
+        kind, key = mid.symbol
+        if kind == 'local':
+            assert isinstance(key, int)
+            return MarkId(ObjectId(ctx.ctx, key), mid.purpose)
+        if kind == 'table':
+            assert isinstance(key, str)
+            return MarkId(scope.reference_table(key).obj_id, mid.purpose)
+        if kind == 'label':
+            assert key in labels, f'Label "{key}" not found in {trace}'
+            return labels[key]
+        assert scope.for_constructor is not None, \
+            f'{macro.ident} uses constructor built-ins and can only be used in constructor'
+        return MarkId(scope.for_constructor.runtime, mid.purpose)
+
+    asm: list[Asm] = []
+    for step in macro.asm:
+        if isinstance(step, MacroParam):
+            asm.append(ident_to_arg[step.ident])
+        elif isinstance(step, ConstRef):
+            asm.append(scope.get_constant(step.ident))
+        elif isinstance(step, SymbolicMark):
+            asm.append(Mark(bind(step.mid)))
+        elif isinstance(step, SymbolicMarkRef):
+            asm.append(MarkRef(bind(step.mid)))
+        elif isinstance(step, SymbolicMarkDeltaRef):
+            asm.append(MarkDeltaRef(bind(step.start), bind(step.end)))
+        else:
+            asm.append(step)
+    return asm
+
+
+class ExpansionFrame:
+    '''State of one macro expansion on the explicit expansion stack'''
+
+    def __init__(
+        self,
+        macro: Macro,
+        labels: dict[Identifier, MarkId],
+        ident_to_arg: dict[Identifier, MacroArg],
+        ctx: ContextTracker,
+        invocation_start: Optional[int]
+    ) -> None:
+        self.macro = macro
+        self.next_el = 0
+        self.labels = labels
+        self.ident_to_arg = ident_to_arg
+        self.ctx = ctx
+        # Output index of the placeholder to be replaced by the invocation's start mark
+        self.invocation_start = invocation_start
+
+
+# Stands in for an invocation's start mark until its object ID is allocated after the expansion
+INVOCATION_START_PLACEHOLDER = Mark(MarkId(ObjectId((), -1), MarkPurpose.Start))
+
+
 def expand_macro_to_asm(
     coptions: CompileOptions,
     macro_ident: Identifier,
@@ -296,53 +441,94 @@ def expand_macro_to_asm(
     ctx: ContextTracker,
     visited_macros: tuple[Identifier, ...]
 ) -> list[Asm]:
-    macro = scope.get_macro(macro_ident)
-    assert macro_ident not in visited_macros, f'Circular macro refrence in {macro_ident}'
-    assert len(args) == len(macro.params), \
-        f'macro "{macro_ident}" received {len(args)} args, expected {len(macro.params)}'
-    visited_macros += (macro_ident,)
-
-    ident_to_arg = {
-        ident: arg
-        for ident, arg in zip(macro.params, args)
-    }
-    if args is None:
-        args = []
-
+    '''
+    Expands `macro_ident` with an explicit stack of invocations instead of recursion, all
+    expansions write into a single output list.
+    '''
     asm: list[Asm] = []
+    stack: list[ExpansionFrame] = []
+    # Invocation chain, mirrors `stack` prefixed by `visited_macros`
+    chain: list[Identifier] = list(visited_macros)
+    active: set[Identifier] = set(visited_macros)
+
+    def macro_trace_repr() -> str:
+        return ' -> '.join(chain)
+
+    def enter(
+        ident: Identifier,
+        args: list[MacroArg],
+        labels: dict[Identifier, MarkId],
+        ctx: ContextTracker,
+        invocation_start: Optional[int]
+    ):
+        macro = scope.get_macro(ident)
+        assert ident not in active, f'Circular macro refrence in {ident}'
+        assert len(args) == len(macro.params), \
+            f'macro "{ident}" received {len(args)} args, expected {len(macro.params)}'
+        chain.append(ident)
+        active.add(ident)
+
+        for el in macro.body:
+            if not isinstance(el, LabelDef):
+                continue
+            label = el.ident
+            dest_id: MarkId = MarkId(ctx.next_obj_id(), MarkPurpose.Label)
+            # TODO: Add warning when invoked macro has label shadowing parent
+            assert label not in labels or labels[label].different_ctx(dest_id), \
+                f'Duplicate label "{label}" in macro "{macro_trace_repr()}"'
+            labels[label] = dest_id
+
+        ident_to_arg = {
+            ident: arg
+            for ident, arg in zip(macro.params, args)
+        }
+        stack.append(ExpansionFrame(macro, labels, ident_to_arg, ctx, invocation_start))
+
+    def lookup_label(frame: ExpansionFrame, ident: Identifier) -> MarkRef:
+        assert ident in frame.labels, f'Label "{ident}" not found in {macro_trace_repr()}'
+        return MarkRef(frame.labels[ident])
+
+    def lookup_arg(frame: ExpansionFrame, ident: Identifier) -> MacroArg:
+        assert ident in frame.ident_to_arg, f'Invalid macro argument "{ident}" in {macro_trace_repr()}'
+        return frame.ident_to_arg[ident]
+
+    def source_op(ident: Identifier) -> Op:
+        opcode = op(ident)
+        assert supports_opcode(coptions.evm_version, opcode.op), \
+            f'{unsupported_opcode_error(coptions.evm_version, ident)} in {macro_trace_repr()}'
+        return opcode
+
+    enter(macro_ident, args, labels, ctx, None)
+
+    while stack:
+        frame = stack[-1]
+        body = frame.macro.body
+        if frame.next_el == len(body):
+            stack.pop()
+            active.discard(chain.pop())
+            if frame.invocation_start is not None:
+                assert scope.invocations is not None
+                parent = stack[-1]
+                invocation_id = parent.ctx.next_obj_id()
+                scope.invocations[invocation_id] = frame.macro.ident
+                asm[frame.invocation_start] = to_start_mark(invocation_id)
+                asm.append(to_end_mark(invocation_id))
+            continue
 
-    macro_trace_repr = ' -> '.join(visited_macros)
+        el = body[frame.next_el]
+        frame.next_el += 1
 
-    for el in macro.body:
-        if not isinstance(el, LabelDef):
-            continue
-        label = el.ident
-        dest_id: MarkId = MarkId(ctx.next_obj_id(), MarkPurpose.Label)
-        # TODO: Add warning when invoked macro has label shadowing parent
-        assert label not in labels or labels[label].different_ctx(dest_id), \
-            f'Duplicate label "{label}" in macro "{macro_trace_repr}"'
-        labels[label] = dest_id
-
-    def lookup_label(ident: Identifier) -> MarkRef:
-        assert ident in labels, f'Label "{ident}" not found in {macro_trace_repr}'
-        return MarkRef(labels[ident])
-
-    def lookup_arg(ident: Identifier) -> MacroArg:
-        assert ident in ident_to_arg, f'Invalid macro argument "{ident}" in {macro_trace_repr}'
-        return ident_to_arg[ident]
-
-    for el in macro.body:
         if isinstance(el, Literal):
             asm.append(compile_literal(coptions, el))
         elif isinstance(el, LabelDef):
-            asm.extend([Mark(labels[el.ident]), Op(OP_MAP['jumpdest'], b'')])
+            asm.extend([Mark(frame.labels[el.ident]), Op(OP_MAP['jumpdest'], b'')])
         elif isinstance(el, GeneralRef):
             if el.ident in OP_MAP:
-                asm.append(op(el.ident))
+                asm.append(source_op(el.ident))
             else:
-                asm.append(lookup_label(el.ident))
+                asm.append(lookup_label(frame, el.ident))
         elif isinstance(el, MacroParam):
-            asm.append(lookup_arg(el.ident))
+            asm.append(lookup_arg(frame, el.ident))
         elif isinstance(el, ConstRef):
             asm.append(scope.get_constant(el.ident))
         elif isinstance(el, Invocation):
@@ -351,51 +537,61 @@ def expand_macro_to_asm(
                 for arg in el.args:
                     if isinstance(arg, GeneralRef):
                         if arg.ident in OP_MAP:
-                            invoke_values.append(op(arg.ident))
+                            invoke_values.append(source_op(arg.ident))
                         else:
                             invoke_values.append(arg)
                     elif isinstance(arg, MacroParam):
-                        invoke_values.append(lookup_arg(arg.ident))
+                        invoke_values.append(lookup_arg(frame, arg.ident))
                     elif isinstance(arg, Literal):
                         invoke_values.append(compile_literal(coptions, arg))
                     else:
                         raise TypeError(
                             f'Unrecognized built-in invocation argument {arg}'
                         )
+                env = BuiltinEnv(coptions, frame.labels, frame.ctx, macro_trace_repr())
                 asm.extend(
-                    invoke_built_in(el.ident, scope, invoke_values)
+                    invoke_built_in(el.ident, scope, invoke_values, env)
                 )
             else:
                 invoke_args: list[MacroArg] = []
                 for arg in el.args:
                     if isinstance(arg, GeneralRef):
                         if arg.ident in OP_MAP:
-                            invoke_args.append(op(arg.ident))
+                            invoke_args.append(source_op(arg.ident))
                         else:
-                            invoke_args.append(lookup_label(arg.ident))
+                            invoke_args.append(lookup_label(frame, arg.ident))
                     elif isinstance(arg, MacroParam):
-                        invoke_args.append(lookup_arg(arg.ident))
+                        invoke_args.append(lookup_arg(frame, arg.ident))
                     elif isinstance(arg, Literal):
                         invoke_args.append(compile_literal(coptions, arg))
                     else:
                         raise TypeError(
                             f'Unrecognized macro invocation argument {arg}'
                         )
-                asm.extend(
-                    expand_macro_to_asm(
-                        coptions,
-                        el.ident,
-                        scope,
-                        invoke_args,
-                        {
-                            label: mid
-                            for label, mid in labels.items()
-                            if label.startswith('global_')
-                        },
-                        ctx.next_sub_context(),
-                        visited_macros
+                sub_ctx = frame.ctx.next_sub_context()
+                global_labels = {
+                    label: mid
+                    for label, mid in frame.labels.items()
+                    if label.startswith('global_')
+                }
+                if (object_macro := scope.get_object_macro(el.ident)) is not None:
+                    chain.append(el.ident)
+                    relocated = relocate_object_macro(
+                        object_macro, scope, invoke_args, global_labels, sub_ctx, macro_trace_repr()
                     )
-                )
+                    chain.pop()
+                    if scope.invocations is None:
+                        asm.extend(relocated)
+                    else:
+                        invocation_id = frame.ctx.next_obj_id()
+                        scope.invocations[invocation_id] = el.ident
+                        asm.extend([to_start_mark(invocation_id), *relocated, to_end_mark(invocation_id)])
+                else:
+                    invocation_start: Optional[int] = None
+                    if scope.invocations is not None:
+                        invocation_start = len(asm)
+                        asm.append(INVOCATION_START_PLACEHOLDER)
+                    enter(el.ident, invoke_args, global_labels, sub_ctx, invocation_start)
         else:
             raise TypeError(f'Unrecognized macro element {el}')
 
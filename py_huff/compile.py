@@ -1,20 +1,42 @@
-from typing import NamedTuple, Iterable
+'''
+Compilation entry points. All of them are safe to call concurrently from multiple threads
+(including on free-threaded CPython builds): every compilation keeps its state local, module level
+registries are read-only and the shared caches (lexed sources, signature hashes) are
+`functools.lru_cache`s, which keep their bookkeeping consistent across threads, holding immutable
+values. A value may be computed twice by racing threads, both results are identical.
+'''
+from typing import NamedTuple, Iterable, Optional, Sequence
 from collections import defaultdict
-from .assembler import asm_to_bytecode, to_start_mark, to_end_mark
-from .context import ContextTracker
-from .utils import build_unique_dict
-from .opcodes import Op, op
+from .assembler import assemble, embed_with_marks, to_start_mark, to_end_mark
+from .context import ContextTracker, ObjectId
+from .utils import build_unique_dict, set_unique
+from .opcodes import Op
 from .node import ExNode
-from .lexer import lex_huff
+from .lexer import lex_huff_cached
 from .parser import (
-    Identifier, Macro, get_ident, parse_hex_literal, parse_macro, get_includes,
-    parse_constant, parse_to_abi, Abi
+    Identifier, Macro, get_ident, parse_table_literal, get_table_file, parse_macro, get_includes,
+    parse_constant, parse_to_abi, Abi, ConstRef, Invocation, GeneralRef, get_defs
 )
-from .assembler import Asm
-from .resolver import resolve
+from .assembler import Mark, Data, DATA_TYPES
+from .resolver import (
+    resolve, resolve_root, resolve_definitions, get_lazy_includes, Definition, LazyDef, ParsedDef,
+    to_node, is_free_storage_pointer
+)
+from .relocation import HuffObject, ObjectMacro
+from .sources import SourceProvider, DISK_SOURCE
+from .evm_version import EvmTarget, EvmVersion, validate_evm_version, has_push0, zero_op
+from .optimize import OptimizeMode, OptimizationNote, validate_optimize_mode
+from .outline import outline_fragments
+from .cfg import optimize_control_flow
+from .expansion import ExpansionLimits, DEFAULT_EXPANSION_LIMITS, check_expansion
+from .layout import optimize_layout
+from .constant_pool import pool_constants
+from .synthesis import SynthesisObjective, synthesize_constants, validate_objective
+from .initcode import select_init
+from .size_report import SizeReport, CodeSizeReport, attribute_sizes, table_sizes
 from .codegen import (
-    CompileOptions, GlobalScope, Scope, expand_macro_to_asm, CodeTable, ConstructorData,
-    gen_minimal_init, gen_constants, gen_tiny_init
+    BUILT_INS, CompileOptions, GlobalScope, Scope, expand_macro_to_asm, CodeTable,
+    ConstructorData, gen_constants, gen_code_tables, bytes_to_push
 )
 
 CompileResult = NamedTuple(
@@ -22,76 +44,276 @@ CompileResult = NamedTuple(
     [
         ('runtime', bytes),
         ('deploy', bytes),
-        ('abi', Abi)
+        ('abi', Abi),
+        ('optimizations', list[OptimizationNote]),
+        ('warnings', list[str]),
+        # Only generated if requested
+        ('size_report', Optional[SizeReport])
     ]
 )
 
+# Macros from which reachability of definitions is determined
+ENTRY_POINTS: tuple[Identifier, ...] = ('MAIN', 'CONSTRUCTOR')
+
 
-def idefs_to_defs(idefs: Iterable[ExNode]) -> dict[str, list[ExNode]]:
-    defs: dict[str, list[ExNode]] = defaultdict(list)
+def idefs_to_defs(idefs: Iterable[Definition]) -> dict[str, list[Definition]]:
+    defs: dict[str, list[Definition]] = defaultdict(list)
     for d in idefs:
         defs[d.name].append(d)
     return defs
 
 
-def compile(entry_fp: str, constant_overrides: dict[Identifier, bytes], avoid_push0: bool) -> CompileResult:
-    return compile_from_defs(idefs_to_defs(resolve(entry_fp)), constant_overrides, avoid_push0)
+def compile(
+    entry_fp: str,
+    constant_overrides: dict[Identifier, bytes],
+    evm_version: EvmTarget,
+    optimize: Optional[OptimizeMode] = None,
+    source: SourceProvider = DISK_SOURCE,
+    strict: bool = False,
+    synthesize: Optional[SynthesisObjective] = None,
+    objects: Sequence[HuffObject] = (),
+    size_report: bool = False,
+    expansion_limits: ExpansionLimits = DEFAULT_EXPANSION_LIMITS
+) -> CompileResult:
+    '''
+    Compiles the file at `entry_fp` for `evm_version`, linking the pre-compiled library `objects`.
+    Unless `strict` is set only definitions reachable from the entry macros are lexed, parsed and
+    validated. A bool `evm_version` is read as the former `avoid_push0` flag.
+    '''
+    idefs = resolve(entry_fp, source=source) if strict else resolve_definitions(entry_fp, source=source)
+    return compile_from_defs(
+        idefs_to_defs(idefs),
+        constant_overrides,
+        evm_version,
+        optimize,
+        source,
+        strict,
+        synthesize,
+        objects,
+        size_report,
+        expansion_limits
+    )
 
 
-def compile_src(src: str, constant_overrides: dict[Identifier, bytes], avoid_push0: bool) -> CompileResult:
-    root = lex_huff(src)
-    includes, idefs = get_includes(root)
-    assert not includes, f'Cannot compile directly from source if it contains includes'
-    return compile_from_defs(idefs_to_defs(idefs), constant_overrides, avoid_push0)
+def compile_src(
+    src: str,
+    constant_overrides: dict[Identifier, bytes],
+    evm_version: EvmTarget,
+    optimize: Optional[OptimizeMode] = None,
+    source: Optional[SourceProvider] = None,
+    src_path: str = 'main.huff',
+    strict: bool = False,
+    synthesize: Optional[SynthesisObjective] = None,
+    objects: Sequence[HuffObject] = (),
+    size_report: bool = False,
+    expansion_limits: ExpansionLimits = DEFAULT_EXPANSION_LIMITS
+) -> CompileResult:
+    '''
+    Compiles `src` directly. Includes are only supported if a `source` provider is given, they're
+    then resolved relative to `src_path` within that provider.
+    '''
+    provider = DISK_SOURCE if source is None else source
+    fp = provider.normalize(src_path)
+    if strict:
+        root = lex_huff_cached(src)
+        includes, idefs = get_includes(root)
+    else:
+        includes, idefs = get_lazy_includes(src, fp, provider)
+    if source is None:
+        assert not includes, f'Cannot compile directly from source if it contains includes'
+    elif strict:
+        idefs = list(resolve_root(root, fp, (fp,), {fp}, source))
+    else:
+        already_resolved = {fp}
+        idefs = [
+            *(
+                d
+                for include_fp in includes
+                for d in resolve_definitions(include_fp, (fp,), already_resolved, source)
+            ),
+            *idefs
+        ]
+    return compile_from_defs(
+        idefs_to_defs(idefs), constant_overrides, evm_version, optimize, provider, strict, synthesize,
+        objects, size_report, expansion_limits
+    )
 
 
-def compile_from_defs(
-    defs: dict[str, list[ExNode]],
+def def_ident(d: Definition) -> Identifier:
+    return d.ident if isinstance(d, (LazyDef, ParsedDef)) else get_ident(d)
+
+
+def def_macro(d: Definition, source: SourceProvider = DISK_SOURCE) -> Macro:
+    if isinstance(d, ParsedDef):
+        assert isinstance(d.value, Macro)
+        return d.value
+    return parse_macro(to_node(d, source))
+
+
+def def_constant(d: Definition, source: SourceProvider = DISK_SOURCE) -> Optional[bytes]:
+    if isinstance(d, ParsedDef):
+        assert not isinstance(d.value, (Macro, memoryview))
+        return d.value
+    return parse_constant(to_node(d, source))
+
+
+def def_table_data(d: Definition, source: SourceProvider = DISK_SOURCE) -> Data:
+    if isinstance(d, ParsedDef):
+        assert isinstance(d.value, DATA_TYPES)
+        return d.value
+    node = to_node(d, source)
+    table_fp = get_table_file(node)
+    return parse_table_literal(node) if table_fp is None else source.read_binary(table_fp)
+
+
+def find_reachable(
+    macro_defs: dict[Identifier, Definition],
+    entry_points: Iterable[Identifier],
+    source: SourceProvider = DISK_SOURCE
+) -> tuple[dict[Identifier, Macro], set[Identifier]]:
+    '''
+    Parses the macros reachable from `entry_points`, also returns all other identifiers referenced
+    by them (constants, code tables, labels, functions, ...)
+    '''
+    macros: dict[Identifier, Macro] = {}
+    referenced: set[Identifier] = set()
+    pending = [ident for ident in entry_points if ident in macro_defs]
+    while pending:
+        ident = pending.pop()
+        if ident in macros:
+            continue
+        macros[ident] = macro = def_macro(macro_defs[ident], source)
+        for el in macro.body:
+            if isinstance(el, ConstRef):
+                referenced.add(el.ident)
+            elif isinstance(el, Invocation):
+                referenced.update(arg.ident for arg in el.args if isinstance(arg, GeneralRef))
+                if el.ident not in BUILT_INS and el.ident in macro_defs:
+                    pending.append(el.ident)
+    return macros, referenced
+
+
+def build_global_scope(
+    defs: dict[str, list[Definition]],
     constant_overrides: dict[Identifier, bytes],
-    avoid_push0: bool
-) -> CompileResult:
+    context: ContextTracker,
+    evm_version: EvmVersion,
+    source: SourceProvider = DISK_SOURCE,
+    entry_points: Iterable[Identifier] = ENTRY_POINTS,
+    strict: bool = False,
+    objects: Sequence[HuffObject] = ()
+) -> tuple[GlobalScope, list[str]]:
+    '''
+    Parses and validates the definitions reachable from `entry_points` (all of them if `strict`),
+    code tables are assigned object IDs from `context`. Unreachable macros, constants and code
+    tables are reported as warnings. The definitions of linked `objects` precede those of `defs`
+    and are never reported as unused.
+    '''
+    macro_defs: dict[Identifier, Definition] = build_unique_dict(
+        ((def_ident(d), d) for d in defs['macro']),
+        on_dup='macro'
+    )
+    const_defs: dict[Identifier, Definition] = build_unique_dict(
+        ((def_ident(d), d) for d in defs['const']),
+        on_dup=lambda ident: f'Duplicate constant "{ident}"'
+    )
+    table_defs: dict[Identifier, Definition] = build_unique_dict(
+        ((def_ident(d), d) for d in defs['code_table']),
+        on_dup=lambda ident: f'Duplicate code table "{ident}"'
+    )
 
-    # TODO: Make sure constants, macros and code tables are unique
-    constants: dict[Identifier, Op] = gen_constants(
+    object_macros: dict[Identifier, ObjectMacro] = build_unique_dict(
         (
-            (get_ident(const), parse_constant(const))
-            for const in defs['const']
+            (ident, macro)
+            for obj in objects
+            for ident, macro in obj.macros.items()
         ),
-        constant_overrides
+        on_dup=lambda ident: f'Duplicate linked macro "{ident}"'
     )
-
-    macros: dict[Identifier, Macro] = build_unique_dict(
+    linked_constants: dict[Identifier, Optional[bytes]] = build_unique_dict(
         (
-            ((macro := parse_macro(node)).ident, macro)
-            for node in defs['macro']
+            (ident, value)
+            for obj in objects
+            for ident, value in obj.constants.items()
         ),
-        on_dup='macro'
+        on_dup=lambda ident: f'Duplicate constant "{ident}"'
+    )
+    linked_defs = idefs_to_defs(
+        d
+        for obj in objects
+        for d in get_defs(lex_huff_cached(obj.definitions))
     )
 
-    context = ContextTracker(tuple())
+    for ident in object_macros:
+        assert ident not in macro_defs, f'Macro "{ident}" defined in source and linked object'
+    for ctable in table_defs:
+        assert ctable not in macro_defs, f'Already defined macro with name "{ctable}"'
+    for ident in constant_overrides:
+        assert ident in const_defs or ident in linked_constants, \
+            f'Override for nonexistent constant "{ident}"'
 
-    # TODO: Warn when literal has odd digits
-    code_tables: dict[Identifier, CodeTable] = build_unique_dict(
-        (
-            (
-                get_ident(node),
-                CodeTable(
-                    parse_hex_literal(node.get('hex_literal')),
-                    context.next_obj_id()
-                )
+    macros, referenced = find_reachable(macro_defs, entry_points, source)
+    warnings: list[str] = [
+        *(f'Unused macro "{ident}"' for ident in macro_defs if ident not in macros),
+        *(f'Unused constant "{ident}"' for ident in const_defs if ident not in referenced),
+        *(f'Unused code table "{ident}"' for ident in table_defs if ident not in referenced)
+    ]
+    if strict:
+        for ident, d in macro_defs.items():
+            if ident not in macros:
+                macros[ident] = def_macro(d, source)
+        referenced.update(const_defs, table_defs)
+
+    # Unused constants are skipped but still count towards the free storage pointer numbering
+    constants: dict[Identifier, Op] = gen_constants(
+        [
+            *linked_constants.items(),
+            *(
+                (ident, def_constant(d, source) if ident in referenced else None)
+                for ident, d in const_defs.items()
+                if ident in referenced or is_free_storage_pointer(d)
             )
-            for node in defs['code_table']
-        ),
-        on_dup='code table'
+        ],
+        {
+            ident: value
+            for ident, value in constant_overrides.items()
+            if ident in referenced or ident in linked_constants
+        },
+        evm_version
     )
 
-    for ctable in code_tables:
-        assert ctable not in macros, f'Already defined macro with name "{ctable}"'
+    # Code tables are content addressed, tables with identical data share one object ID and are
+    # only ever emitted once.
+    # TODO: Warn when literal has odd digits
+    table_obj_ids: dict[Data, ObjectId] = {}
+    code_tables: dict[Identifier, CodeTable] = {}
+    for obj in objects:
+        for ident, data in obj.code_tables.items():
+            if data not in table_obj_ids:
+                table_obj_ids[data] = context.next_obj_id()
+            set_unique(
+                code_tables,
+                ident,
+                CodeTable(data, table_obj_ids[data]),
+                on_dup=lambda ident: f'Duplicate code table "{ident}"'
+            )
+    for ident, d in table_defs.items():
+        if ident not in referenced:
+            continue
+        data = def_table_data(d, source)
+        if data not in table_obj_ids:
+            table_obj_ids[data] = context.next_obj_id()
+        set_unique(
+            code_tables,
+            ident,
+            CodeTable(data, table_obj_ids[data]),
+            on_dup=lambda ident: f'Duplicate code table "{ident}"'
+        )
 
     functions: dict[Identifier, ExNode] = build_unique_dict(
         (
             (get_ident(fn), fn)
-            for fn in defs['function']
+            for fn in [*linked_defs['function'], *defs['function']]
         ),
         on_dup='function'
     )
@@ -99,7 +321,7 @@ def compile_from_defs(
     errors: dict[Identifier, ExNode] = build_unique_dict(
         (
             (get_ident(err), err)
-            for err in defs['error']
+            for err in [*linked_defs['error'], *defs['error']]
         ),
         on_dup='error'
     )
@@ -107,26 +329,68 @@ def compile_from_defs(
     events: dict[Identifier, ExNode] = build_unique_dict(
         (
             (get_ident(e), e)
-            for e in defs['event']
+            for e in [*linked_defs['event'], *defs['event']]
         ),
         on_dup='event'
     )
 
-    abi: Abi = parse_to_abi(functions, events)
-
-    assert 'MAIN' in macros, 'Program must contain MAIN macro entry point'
-
-    globals = GlobalScope(
+    return GlobalScope(
         macros,
         constants,
         code_tables,
         functions,
         events,
-        errors
+        errors,
+        object_macros
+    ), warnings
+
+
+def compile_from_defs(
+    defs: dict[str, list[Definition]],
+    constant_overrides: dict[Identifier, bytes],
+    evm_version: EvmTarget,
+    optimize: Optional[OptimizeMode] = None,
+    source: SourceProvider = DISK_SOURCE,
+    strict: bool = False,
+    synthesize: Optional[SynthesisObjective] = None,
+    objects: Sequence[HuffObject] = (),
+    size_report: bool = False,
+    expansion_limits: ExpansionLimits = DEFAULT_EXPANSION_LIMITS
+) -> CompileResult:
+    '''
+    Compiles already resolved definitions. With `size_report` the final code size is attributed
+    to the expanded macros (see `py_huff.size_report`). Entry points predicted to expand beyond
+    `expansion_limits` are rejected before expanding them.
+    '''
+    optimize = validate_optimize_mode(optimize)
+    synthesize = validate_objective(synthesize)
+    version = validate_evm_version(evm_version)
+    coptions = CompileOptions(version)
+    avoid_push0 = not has_push0(version)
+    # Zero for the constant pool's loads, which may run after calls (ruling out `RETURNDATASIZE`)
+    pool_zero = bytes_to_push(b'\x00', avoid_push0=avoid_push0)
+    optimizations: list[OptimizationNote] = []
+
+    for obj in objects:
+        assert obj.evm_version == version, \
+            f'Cannot link object compiled for EVM version {obj.evm_version} into program compiled for {version}'
+
+    context = ContextTracker(tuple())
+    globals, warnings = build_global_scope(
+        defs, constant_overrides, context, version, source, strict=strict, objects=objects
     )
-    main_scope = Scope(globals, None)
+    abi: Abi = parse_to_abi(globals.functions, globals.events)
+
+    assert 'MAIN' in globals.macros, 'Program must contain MAIN macro entry point'
+
+    for entry_point in ENTRY_POINTS:
+        if entry_point in globals.macros:
+            check_expansion(entry_point, globals.macros, globals.object_macros, expansion_limits)
+
+    track_invocations = optimize == 'size' or size_report
+    main_scope = Scope(globals, None, track_invocations)
     runtime_asm = expand_macro_to_asm(
-        CompileOptions(avoid_push0),
+        coptions,
         'MAIN',
         main_scope,
         [],
@@ -134,22 +398,48 @@ def compile_from_defs(
         context.next_sub_context(),
         tuple()
     )
+    if synthesize is not None:
+        runtime_asm, notes = synthesize_constants(runtime_asm, synthesize, avoid_push0)
+        optimizations.extend(notes)
+    if optimize == 'size':
+        assert main_scope.invocations is not None
+        runtime_asm, notes = outline_fragments(
+            runtime_asm, main_scope.invocations, context.next_sub_context(),
+            keep_invocation_marks=size_report
+        )
+        optimizations.extend(notes)
 
-    for table in main_scope.referenced_tables:
-        code_table = globals.code_tables[table]
-        runtime_asm.extend([
-            to_start_mark(code_table.obj_id),
-            code_table.data,
-            to_end_mark(code_table.obj_id)
-        ])
+    runtime_tables = main_scope.unique_referenced_tables()
+    if optimize is not None:
+        runtime_asm, notes = optimize_control_flow(runtime_asm, 'MAIN', gen_code_tables(runtime_tables))
+        optimizations.extend(notes)
+    runtime_asm.extend(gen_code_tables(runtime_tables))
+    if optimize == 'size':
+        runtime_asm, notes = pool_constants(runtime_asm, 'MAIN', context.next_sub_context(), pool_zero)
+        optimizations.extend(notes)
+    if optimize is not None:
+        runtime_asm, notes = optimize_layout(runtime_asm, 'MAIN')
+        optimizations.extend(notes)
 
-    runtime = asm_to_bytecode(runtime_asm)
+    runtime, runtime_offsets = assemble(runtime_asm)
+    runtime_report: Optional[CodeSizeReport] = None
+    init_report: Optional[CodeSizeReport] = None
+    if size_report:
+        assert main_scope.invocations is not None
+        tables = table_sizes(main_scope.referenced_tables)
+        code_size = len(runtime) - sum(table.size for table in tables)
+        runtime_report = CodeSizeReport(
+            len(runtime),
+            code_size,
+            attribute_sizes('MAIN', runtime_asm, main_scope.invocations, runtime_offsets, code_size),
+            tables
+        )
 
     runtime_obj_id = context.next_obj_id()
-    if 'CONSTRUCTOR' in macros:
-        init_scope = Scope(globals, ConstructorData(runtime_obj_id))
+    if 'CONSTRUCTOR' in globals.macros:
+        init_scope = Scope(globals, ConstructorData(runtime_obj_id), track_invocations)
         init_asm = expand_macro_to_asm(
-            CompileOptions(avoid_push0),
+            coptions,
             'CONSTRUCTOR',
             init_scope,
             [],
@@ -157,34 +447,67 @@ def compile_from_defs(
             context.next_sub_context(),
             tuple()
         )
-        for table in main_scope.referenced_tables:
-            code_table = globals.code_tables[table]
-            init_asm.extend([
-                to_start_mark(code_table.obj_id),
-                code_table.data,
-                to_end_mark(code_table.obj_id)
-            ])
+        if synthesize is not None:
+            init_asm, notes = synthesize_constants(init_asm, synthesize, avoid_push0)
+            optimizations.extend(notes)
+        if optimize == 'size':
+            assert init_scope.invocations is not None
+            init_asm, notes = outline_fragments(
+                init_asm, init_scope.invocations, context.next_sub_context(),
+                keep_invocation_marks=size_report
+            )
+            optimizations.extend(notes)
+        if optimize is not None:
+            init_asm, notes = optimize_control_flow(
+                init_asm, 'CONSTRUCTOR', gen_code_tables(init_scope.unique_referenced_tables())
+            )
+            optimizations.extend(notes)
+        # Tables already present in the runtime are referenced in place, only the remaining
+        # tables used by the constructor get appended to the initcode.
+        shared_table_marks: list[tuple[int, Mark]] = []
+        for code_table in init_scope.unique_referenced_tables():
+            start, end = to_start_mark(code_table.obj_id), to_end_mark(code_table.obj_id)
+            if start.mid in runtime_offsets:
+                shared_table_marks.append((runtime_offsets[start.mid], start))
+                shared_table_marks.append((runtime_offsets[end.mid], end))
+            else:
+                init_asm.extend(gen_code_tables([code_table]))
         init_asm.extend([
             to_start_mark(runtime_obj_id),
-            runtime,
+            *embed_with_marks(runtime, shared_table_marks),
             to_end_mark(runtime_obj_id)
         ])
-        deploy = asm_to_bytecode(init_asm)
+        if optimize == 'size':
+            init_asm, notes = pool_constants(init_asm, 'CONSTRUCTOR', context.next_sub_context(), pool_zero)
+            optimizations.extend(notes)
+        if optimize is not None:
+            init_asm, notes = optimize_layout(init_asm, 'CONSTRUCTOR', deposited=False)
+            optimizations.extend(notes)
+        deploy, init_offsets = assemble(init_asm)
+        if size_report:
+            assert init_scope.invocations is not None
+            # Shared tables are part of the runtime
+            tables = table_sizes({
+                ident: table
+                for ident, table in init_scope.referenced_tables.items()
+                if to_start_mark(table.obj_id).mid not in runtime_offsets
+            })
+            init_size = init_offsets[to_start_mark(runtime_obj_id).mid]
+            code_size = init_size - sum(table.size for table in tables)
+            init_report = CodeSizeReport(
+                init_size,
+                code_size,
+                attribute_sizes('CONSTRUCTOR', init_asm, init_scope.invocations, init_offsets, code_size),
+                tables
+            )
     else:
-        zero_op = op('returndatasize') if avoid_push0 else op('push0')
-        if len(runtime) <= 32:
-            init_asm: list[Asm] = gen_tiny_init(runtime, zero_op)
-        else:
-            init_asm: list[Asm] = [
-                *gen_minimal_init(runtime_obj_id, zero_op),
-                to_start_mark(runtime_obj_id),
-                runtime,
-                to_end_mark(runtime_obj_id)
-            ]
-        deploy = asm_to_bytecode(init_asm)
+        deploy = select_init(runtime, runtime_obj_id, zero_op(version)).deploy
 
     return CompileResult(
         runtime=runtime,
         deploy=deploy,
-        abi=abi
+        abi=abi,
+        optimizations=optimizations,
+        warnings=warnings,
+        size_report=None if runtime_report is None else SizeReport(runtime_report, init_report)
     )
@@ -0,0 +1,137 @@
+'''
+Size optimization pass moving wide literals that are pushed at many sites into a constant pool.
+Every selected value is stored once as a 32-byte word appended to the code and each of its pushes
+is replaced by a load copying the word through the first word of memory, restoring its previous
+contents afterwards:
+
+    PUSH0 MLOAD PUSH1 0x20 PUSH <word> PUSH0 CODECOPY PUSH0 MLOAD SWAP1 PUSH0 MSTORE
+
+Memory is left as it was, only its size can grow by the first word. Code using `MSIZE` (which
+could observe that), `PC` or literal jump destinations is therefore left untouched. A load is
+13 bytes and costs 29 gas more than a `PUSH` (17 bytes and 33 gas with `PUSH1 0` before Shanghai),
+memory is expanded by at most a single word once.
+'''
+from typing import NamedTuple
+from collections import defaultdict
+from .assembler import Asm, Mark, MarkId, MarkPurpose, MarkRef, assemble, get_min_static_size_bytes
+from .cfg import has_dynamic_offsets
+from .context import ContextTracker
+from .opcodes import Op, op, create_push, OP_MAP, BASE_GAS, TERMINATING_OPS
+from .optimize import OptimizationNote
+from .utils import s
+
+PoolCostModel = NamedTuple(
+    'PoolCostModel',
+    [
+        # Minimum amount of bytes pooling a single value has to save
+        ('min_bytes_saved', int),
+        # Maximum extra gas (summed over all load sites) accepted per byte saved
+        ('max_gas_per_byte', float)
+    ]
+)
+
+DEFAULT_POOL_COST_MODEL = PoolCostModel(min_bytes_saved=1, max_gas_per_byte=5.0)
+
+PUSH1, PUSH32 = OP_MAP['push1'], OP_MAP['push32']
+WORD = 32
+# Memory expansion by one word, paid by the first load only (if memory wasn't used before)
+EXPANSION_GAS = 3
+# Reveals memory having been expanded by the loads
+MSIZE = OP_MAP['msize']
+LOAD_OPS = ('push1', 'push1', 'codecopy', 'mload', 'mload', 'swap1', 'mstore')
+ZEROS_PER_LOAD = 4
+
+
+def load_sequence(mid: MarkId, zero: Op) -> list[Asm]:
+    return [
+        zero, op('mload'),                                  # [saved]
+        create_push(bytes([WORD])), MarkRef(mid), zero, op('codecopy'),
+        zero, op('mload'),                                  # [saved, value]
+        op('swap1'), zero, op('mstore')                     # [value]
+    ]
+
+
+def load_gas(zero: Op) -> int:
+    '''Gas of a load, excluding the one-time memory expansion'''
+    copy_gas = 3
+    return sum(BASE_GAS[OP_MAP[name]] for name in LOAD_OPS) + ZEROS_PER_LOAD * BASE_GAS[zero.op] + copy_gas
+
+
+def load_size(ref_size: int, zero: Op) -> int:
+    return len(LOAD_OPS) + 1 + ZEROS_PER_LOAD * (1 + len(zero.extra_data)) + ref_size
+
+
+def is_push(step: Asm) -> bool:
+    return isinstance(step, Op) and PUSH1 <= step.op <= PUSH32
+
+
+def falls_off_end(asm: list[Asm]) -> bool:
+    '''Whether execution can run off the end of `asm` (and into data appended after it)'''
+    for step in reversed(asm):
+        if isinstance(step, Op):
+            return step.op not in TERMINATING_OPS
+        if not isinstance(step, Mark):
+            # Ends with data (e.g. code tables)
+            return False
+    return False
+
+
+def pool_constants(
+    asm: list[Asm],
+    root: str,
+    ctx: ContextTracker,
+    zero: Op,
+    cost_model: PoolCostModel = DEFAULT_POOL_COST_MODEL
+) -> tuple[list[Asm], list[OptimizationNote]]:
+    '''
+    Replaces pushes of values worth pooling in the complete code `asm` (including appended tables)
+    with loads, appending the pool at the end (behind a `STOP` if execution could fall off the end).
+    `zero` pushes a zero (`PUSH0` or `PUSH1 0`, not `RETURNDATASIZE` as pooled code may make calls).
+    Returns the new asm and a note per pooled value.
+    '''
+    if has_dynamic_offsets(asm) or any(isinstance(step, Op) and step.op == MSIZE for step in asm):
+        return asm, []
+    sites: dict[int, list[int]] = defaultdict(list)
+    for i, step in enumerate(asm):
+        if is_push(step):
+            assert isinstance(step, Op)
+            sites[int.from_bytes(step.extra_data, 'big')].append(i)
+
+    ref_size = get_min_static_size_bytes(asm)
+    extra_gas_per_load = load_gas(zero) - BASE_GAS[PUSH1]
+    pooled: dict[int, MarkId] = {}
+    notes: list[OptimizationNote] = []
+    for value, indices in sites.items():
+        push_bytes = sum(1 + len(asm[i].extra_data) for i in indices)  # type: ignore
+        saved = push_bytes - len(indices) * load_size(ref_size, zero) - WORD
+        # Conservatively charges the one-time memory expansion to every pooled value
+        extra_gas = len(indices) * extra_gas_per_load + EXPANSION_GAS
+        if saved < cost_model.min_bytes_saved or extra_gas > cost_model.max_gas_per_byte * saved:
+            continue
+        pooled[value] = MarkId(ctx.next_obj_id(), MarkPurpose.Start)
+        notes.append(OptimizationNote(
+            'constant-pool',
+            root,
+            saved,
+            extra_gas,
+            f'0x{value:x} pushed at {len(indices)} site{s(len(indices))} loaded from a constant pool, '
+            f'saving ~{saved} byte{s(saved)} for +{extra_gas_per_load} gas per load'
+        ))
+    if not pooled:
+        return asm, []
+
+    new_asm: list[Asm] = []
+    for step in asm:
+        if is_push(step) and (mid := pooled.get(int.from_bytes(step.extra_data, 'big'))) is not None:  # type: ignore
+            new_asm.extend(load_sequence(mid, zero))
+        else:
+            new_asm.append(step)
+    if falls_off_end(asm):
+        new_asm.append(op('stop'))
+    for value, mid in pooled.items():
+        new_asm.extend([Mark(mid), value.to_bytes(WORD, 'big')])
+
+    # Label pushes may widen as the code grows, keep the pool only if it actually shrinks the code
+    if len(assemble(new_asm)[0]) >= len(assemble(asm)[0]):
+        return asm, []
+    return new_asm, notes
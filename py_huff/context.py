@@ -1,14 +1,17 @@
-from typing import NamedTuple
+from typing import NamedTuple, Optional
 
 ContextId = tuple[int, ...]
 ObjectId = NamedTuple('ObjectId', [('ctx_id', ContextId), ('sub_id', int)])
 
 
 class ContextTracker:
-    def __init__(self, ctx: ContextId):
+    def __init__(self, ctx: ContextId, next_ctx: Optional[list[int]] = None):
         self.ctx = ctx
         self.next_sub_id = 0
-        self.sub_context_offset = 0
+        # Counter shared by all trackers derived from the same root. Sub-contexts are numbered
+        # globally instead of extending their parent's ID so that IDs stay the same size no
+        # matter how deeply expansions are nested.
+        self.next_ctx = [0] if next_ctx is None else next_ctx
 
     def next_obj_id(self) -> ObjectId:
         sub_id = self.next_sub_id
@@ -16,6 +19,6 @@ class ContextTracker:
         return ObjectId(self.ctx, sub_id)
 
     def next_sub_context(self):
-        sub_ctx = self.ctx + (self.sub_context_offset,)
-        self.sub_context_offset += 1
-        return ContextTracker(sub_ctx)
+        sub_ctx = (self.next_ctx[0],)
+        self.next_ctx[0] += 1
+        return ContextTracker(sub_ctx, self.next_ctx)
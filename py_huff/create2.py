@@ -0,0 +1,302 @@
+'''
+CREATE2 address precomputation and salt mining (`huffy create2`).
+
+The address of a contract deployed via CREATE2 is the last 20 bytes of
+`keccak256(0xff ++ deployer ++ salt ++ keccak256(initcode))`. The initcode is hashed once, salts
+are then searched for addresses with a minimum number of leading zero bytes (cheaper to pass as
+calldata). Salts are `salt_prefix ++ counter` with the counter big-endian in the remaining bytes.
+Ranges of counters are distributed across a process pool, within a range every salt is hashed on
+its own in a plain loop that only rewrites the counter bytes of one reused preimage buffer. Progress
+(all counters below `next_counter` are searched) can be saved to and resumed from a JSON state file.
+'''
+from typing import Callable, NamedTuple, Optional, Sequence
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+import json
+import os
+import sys
+import time
+from .compile import compile, CompileResult
+from .evm_version import EVM_VERSIONS, DEFAULT_EVM_VERSION
+from .optimize import OPTIMIZE_MODES
+from .utils import keccak256, s
+
+DEFAULT_BATCH_SIZE = 50_000
+STATE_FORMAT_VERSION = 1
+
+Create2Match = NamedTuple(
+    'Create2Match',
+    [
+        ('salt', bytes),
+        ('address', bytes)
+    ]
+)
+
+MineParams = NamedTuple(
+    'MineParams',
+    [
+        ('deployer', bytes),
+        ('init_code_hash', bytes),
+        ('salt_prefix', bytes),
+        ('zero_bytes', int)
+    ]
+)
+
+MineReport = NamedTuple(
+    'MineReport',
+    [
+        ('matches', list[Create2Match]),
+        # Salts searched by this run
+        ('searched', int),
+        ('seconds', float),
+        # All counters below were searched, resume from here
+        ('next_counter', int)
+    ]
+)
+
+
+def init_code_hash(result: CompileResult) -> bytes:
+    return keccak256(result.deploy)
+
+
+def create2_address(deployer: bytes, salt: bytes, code_hash: bytes) -> bytes:
+    assert len(deployer) == 20, f'Deployer must be 20 bytes (found {len(deployer)})'
+    assert len(salt) == 32, f'Salt must be 32 bytes (found {len(salt)})'
+    assert len(code_hash) == 32, f'Init code hash must be 32 bytes (found {len(code_hash)})'
+    return keccak256(b'\xff' + deployer + salt + code_hash)[12:]
+
+
+def leading_zero_bytes(address: bytes) -> int:
+    return len(address) - len(address.lstrip(b'\x00'))
+
+
+def counter_size(params: MineParams) -> int:
+    return 32 - len(params.salt_prefix)
+
+
+def to_salt(params: MineParams, counter: int) -> bytes:
+    return params.salt_prefix + counter.to_bytes(counter_size(params), 'big')
+
+
+def to_counter(params: MineParams, salt: bytes) -> int:
+    return int.from_bytes(salt[len(params.salt_prefix):], 'big')
+
+
+def validate_params(params: MineParams):
+    assert len(params.deployer) == 20, f'Deployer must be 20 bytes (found {len(params.deployer)})'
+    assert len(params.init_code_hash) == 32, \
+        f'Init code hash must be 32 bytes (found {len(params.init_code_hash)})'
+    assert len(params.salt_prefix) <= 28, \
+        f'Salt prefix must leave at least 4 counter bytes (found {len(params.salt_prefix)} bytes)'
+    assert 1 <= params.zero_bytes <= 20, f'Zero bytes must be between 1 and 20 (found {params.zero_bytes})'
+
+
+def search_range(params: MineParams, start: int, end: int) -> list[Create2Match]:
+    '''Salts with counters in `[start, end)` whose address has `params.zero_bytes` leading zeros'''
+    size = counter_size(params)
+    buf = bytearray(b'\xff' + params.deployer + params.salt_prefix + bytes(size) + params.init_code_hash)
+    view = memoryview(buf)
+    counter_start = 21 + len(params.salt_prefix)
+    counter_end = counter_start + size
+    zeros = bytes(params.zero_bytes)
+    prefix_end = 12 + params.zero_bytes
+    matches: list[Create2Match] = []
+    for counter in range(start, end):
+        view[counter_start:counter_end] = counter.to_bytes(size, 'big')
+        digest = keccak256(buf)
+        if digest[12:prefix_end] == zeros:
+            matches.append(Create2Match(bytes(view[21:counter_end]), digest[12:]))
+    return matches
+
+
+def mine(
+    params: MineParams,
+    start: int = 0,
+    limit: Optional[int] = None,
+    max_matches: Optional[int] = 1,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_workers: Optional[int] = None,
+    on_progress: Optional[Callable[[MineReport], None]] = None
+) -> MineReport:
+    '''
+    Searches counters from `start` until `limit` salts were searched or at least `max_matches`
+    were found (`None` for no bound), in parallel unless `max_workers` is 1. `on_progress` is
+    called after every batch.
+    '''
+    validate_params(params)
+    assert limit is not None or max_matches is not None, 'Mining needs a limit or a number of matches'
+    end = 2 ** (8 * counter_size(params))
+    if limit is not None:
+        end = min(end, start + limit)
+    matches: dict[bytes, Create2Match] = {}
+    done: dict[int, int] = {}
+    next_counter = start
+    began = time.perf_counter()
+
+    def searched_matches() -> list[Create2Match]:
+        # Only matches below the frontier, results don't depend on the order batches finish in
+        return sorted(m for m in matches.values() if to_counter(params, m.salt) < next_counter)
+
+    def report() -> MineReport:
+        return MineReport(
+            searched_matches(), next_counter - start, time.perf_counter() - began, next_counter
+        )
+
+    def complete(batch_start: int, batch_end: int, found: list[Create2Match]):
+        nonlocal next_counter
+        for match in found:
+            matches[match.salt] = match
+        done[batch_start] = batch_end
+        while next_counter in done:
+            next_counter = done.pop(next_counter)
+        if on_progress is not None:
+            on_progress(report())
+
+    def finished() -> bool:
+        return next_counter >= end or (max_matches is not None and len(searched_matches()) >= max_matches)
+
+    batches = ((b, min(b + batch_size, end)) for b in range(start, end, batch_size))
+    if max_workers == 1:
+        for batch_start, batch_end in batches:
+            if finished():
+                break
+            complete(batch_start, batch_end, search_range(params, batch_start, batch_end))
+        return report()
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        in_flight = 2 * (max_workers or os.cpu_count() or 1)
+        pending: dict[Future, tuple[int, int]] = {}
+        while True:
+            while not finished() and len(pending) < in_flight and (batch := next(batches, None)) is not None:
+                pending[pool.submit(search_range, params, *batch)] = batch
+            if not pending:
+                break
+            completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in completed:
+                complete(*pending.pop(future), future.result())
+            if finished():
+                for future in pending:
+                    future.cancel()
+                break
+    return report()
+
+
+def save_state(fp: str, params: MineParams, result: MineReport, previous: Sequence[Create2Match] = ()):
+    matches = {match.salt: match for match in [*previous, *result.matches]}
+    with open(fp, 'w') as f:
+        json.dump({
+            'version': STATE_FORMAT_VERSION,
+            'deployer': f'0x{params.deployer.hex()}',
+            'initCodeHash': f'0x{params.init_code_hash.hex()}',
+            'saltPrefix': f'0x{params.salt_prefix.hex()}',
+            'zeroBytes': params.zero_bytes,
+            'nextCounter': result.next_counter,
+            'matches': [
+                {'salt': f'0x{m.salt.hex()}', 'address': f'0x{m.address.hex()}'}
+                for m in sorted(matches.values())
+            ]
+        }, f, indent=2)
+
+
+def load_state(fp: str, params: MineParams) -> tuple[int, list[Create2Match]]:
+    '''Counter to resume from and matches found so far, the state must be for the same search'''
+    with open(fp) as f:
+        state = json.load(f)
+    assert state.get('version') == STATE_FORMAT_VERSION, \
+        f'Unsupported create2 state version {state.get("version")} in {fp}'
+    saved = MineParams(
+        bytes.fromhex(state['deployer'][2:]),
+        bytes.fromhex(state['initCodeHash'][2:]),
+        bytes.fromhex(state['saltPrefix'][2:]),
+        state['zeroBytes']
+    )
+    assert saved == params, f'State {fp} is for a different search (deployer, init code hash, salt prefix or zero bytes)'
+    matches = [
+        Create2Match(bytes.fromhex(m['salt'][2:]), bytes.fromhex(m['address'][2:]))
+        for m in state['matches']
+    ]
+    return state['nextCounter'], matches
+
+
+def parse_hex(value: str, name: str, size: Optional[int] = None) -> bytes:
+    assert value.startswith('0x'), f'{name} must be a 0x prefixed hex string (found {value!r})'
+    data = bytes.fromhex(value[2:])
+    assert size is None or len(data) == size, f'{name} must be {size} bytes (found {len(data)})'
+    return data
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = ArgumentParser(prog='huffy create2', description='Compute or mine CREATE2 addresses')
+    parser.add_argument('path', nargs='?', help='contract whose deploy code is hashed')
+    parser.add_argument('--init-code-hash', type=str, default=None,
+                        help='hash of the initcode, instead of compiling a contract')
+    parser.add_argument('--deployer', type=str, required=True, help='address executing CREATE2')
+    parser.add_argument('--evm-version', choices=EVM_VERSIONS, default=None,
+                        help=f'target EVM version (default: {DEFAULT_EVM_VERSION})')
+    parser.add_argument('--optimize', '-O', choices=OPTIMIZE_MODES, default=None)
+    parser.add_argument('--salt', type=str, default=None, help='compute the address for this salt')
+    parser.add_argument('--zero-bytes', '-z', type=int, default=1,
+                        help='leading zero bytes the mined addresses must have (default: 1)')
+    parser.add_argument('--matches', '-m', type=int, default=1,
+                        help='stop after this many matches, 0 for no bound (default: 1)')
+    parser.add_argument('--limit', '-n', type=int, default=None, help='maximum number of salts to search')
+    parser.add_argument('--start', type=int, default=0, help='first salt counter')
+    parser.add_argument('--salt-prefix', type=str, default='0x',
+                        help='fixed leading salt bytes, e.g. the deployer for front-running protection')
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help='number of worker processes (default: CPU count)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--resume', type=str, default=None, metavar='STATE',
+                        help='JSON file progress is saved to and resumed from')
+    args = parser.parse_args(argv)
+
+    assert (args.path is None) != (args.init_code_hash is None), \
+        'Expected either a contract path or --init-code-hash'
+    if args.init_code_hash is not None:
+        code_hash = parse_hex(args.init_code_hash, 'Init code hash', 32)
+    else:
+        code_hash = init_code_hash(compile(args.path, {}, args.evm_version, args.optimize))
+    deployer = parse_hex(args.deployer, 'Deployer', 20)
+    print(f'init code hash: 0x{code_hash.hex()}', file=sys.stderr)
+
+    if args.salt is not None:
+        salt = parse_hex(args.salt, 'Salt', 32)
+        print(f'0x{create2_address(deployer, salt, code_hash).hex()}')
+        return
+
+    params = MineParams(deployer, code_hash, parse_hex(args.salt_prefix, 'Salt prefix'), args.zero_bytes)
+    validate_params(params)
+    start: int = args.start
+    previous: list[Create2Match] = []
+    if args.resume is not None and os.path.exists(args.resume):
+        start, previous = load_state(args.resume, params)
+        print(f'resuming at counter {start}, {len(previous)} found so far', file=sys.stderr)
+    if args.matches and len(previous) >= args.matches:
+        max_matches: Optional[int] = 0
+    else:
+        max_matches = args.matches - len(previous) if args.matches else None
+
+    last_print = time.perf_counter()
+
+    def on_progress(progress: MineReport):
+        nonlocal last_print
+        if args.resume is not None:
+            save_state(args.resume, params, progress, previous)
+        if (now := time.perf_counter()) - last_print >= 1:
+            last_print = now
+            rate = progress.searched / progress.seconds if progress.seconds else 0.0
+            print(f'searched {progress.searched} salts ({rate:,.0f} hashes/s), '
+                  f'{len(progress.matches)} found', file=sys.stderr)
+
+    result = MineReport([], 0, 0.0, start)
+    if max_matches != 0:
+        result = mine(params, start, args.limit, max_matches, args.batch_size, args.jobs, on_progress)
+    if args.resume is not None:
+        save_state(args.resume, params, result, previous)
+    rate = result.searched / result.seconds if result.seconds else 0.0
+    print(f'{result.searched} salt{s(result.searched)} in {result.seconds:.2f}s ({rate:,.0f} hashes/s), '
+          f'next counter {result.next_counter}', file=sys.stderr)
+    for match in sorted({m.salt: m for m in [*previous, *result.matches]}.values()):
+        print(f'0x{match.salt.hex()} 0x{match.address.hex()}')
+    if not previous and not result.matches:
+        sys.exit(1)
@@ -0,0 +1,226 @@
+'''
+Function dispatcher generation for the `__FUNC_DISPATCH` built-in. Expects the selector on top of
+the stack, jumps to the label of the matching function with the selector still on the stack and
+falls through (selector on the stack) if none matches. Strategies:
+
+- `linear`: `DUP1 PUSH4 <selector> EQ PUSH <label> JUMPI` per function
+- `binary`: binary search over the sorted selectors (`GT` comparisons), linear checks in the leaves
+- `jump_table`: a bit window of the selector picks a bucket from a jump table appended to the code,
+  each bucket linearly checks the few selectors hashing to it. With one selector per bucket this is
+  a perfect hash. Uses memory `0x00..0x02` as scratch space.
+
+The strategy with the lowest average gas to reach a function's label is chosen.
+'''
+from typing import NamedTuple, Optional
+import typing
+from math import ceil, log2
+from .assembler import Asm, Mark, MarkRef, MarkId, MarkPurpose, MarkOffset
+from .context import ContextTracker, ObjectId
+from .opcodes import Op, op, create_push, BASE_GAS
+
+DispatchStrategy = typing.Literal['linear', 'binary', 'jump_table']
+DISPATCH_STRATEGIES: tuple[DispatchStrategy, ...] = ('linear', 'binary', 'jump_table')
+
+DispatchEntry = NamedTuple('DispatchEntry', [('selector', int), ('dest', MarkId)])
+
+# Buckets are chosen as `(selector >> shift) & ((1 << bits) - 1)`
+HashPlan = NamedTuple('HashPlan', [('shift', int), ('bits', int)])
+
+# Leaves are lists of entries, inner nodes split at `pivot`: `left` < pivot <= `right`
+SearchTree = NamedTuple(
+    'SearchTree',
+    [('pivot', int), ('left', 'SearchNode'), ('right', 'SearchNode')]
+)
+SearchNode = SearchTree | list[DispatchEntry]
+
+# Jump tables hold 2 byte code offsets
+JUMP_TABLE_ENTRY_SIZE = 2
+MAX_JUMP_TABLE_BITS = 8
+EXTRA_JUMP_TABLE_BITS = 2
+
+SCRATCH_MEMORY_GAS = 3
+
+
+def gas(ops: list[Op]) -> int:
+    return sum(BASE_GAS[step.op] for step in ops)
+
+
+def push_selector(selector: int) -> Op:
+    return create_push(selector.to_bytes(4, 'big'))
+
+
+# DUP1 PUSH4 EQ PUSH JUMPI, jump destinations are pushed like any other value
+CHECK_GAS = gas([op('dup1'), push_selector(1), op('eq'), push_selector(1), op('jumpi')])
+BRANCH_GAS = gas([op('dup1'), push_selector(1), op('gt'), push_selector(1), op('jumpi')])
+JUMPDEST_GAS = BASE_GAS[op('jumpdest').op]
+
+
+def linear_gas(n: int) -> float:
+    '''Average gas to reach one of `n` linearly checked labels'''
+    return CHECK_GAS * (n + 1) / 2
+
+
+def search_tree(entries: list[DispatchEntry]) -> tuple[float, SearchNode]:
+    '''Cheapest binary search over `entries` (sorted by selector) and its average gas'''
+    n = len(entries)
+    leaf_gas = linear_gas(n)
+    if n < 4:
+        return leaf_gas, entries
+    mid = n // 2
+    left_gas, left = search_tree(entries[:mid])
+    right_gas, right = search_tree(entries[mid:])
+    split_gas = BRANCH_GAS + (mid * (left_gas + JUMPDEST_GAS) + (n - mid) * right_gas) / n
+    if split_gas >= leaf_gas:
+        return leaf_gas, entries
+    return split_gas, SearchTree(entries[mid].selector, left, right)
+
+
+def bucket_of(selector: int, plan: HashPlan) -> int:
+    return (selector >> plan.shift) & ((1 << plan.bits) - 1)
+
+
+def jump_table_prefix(plan: HashPlan, table_start: Asm, zero_op: Op) -> list[Asm]:
+    '''Computes the bucket's jump table entry and jumps to it, `table_start` pushes the table offset'''
+    mask = (1 << plan.bits) - 1
+    if plan.shift > 0:
+        # Shift one less and widen the mask to get the offset of the 2 byte entry directly
+        index: list[Asm] = [
+            create_push(bytes([plan.shift - 1])), op('shr'), create_push((mask << 1).to_bytes(4, 'big')),
+            op('and')
+        ]
+    else:
+        index = [create_push(mask.to_bytes(4, 'big')), op('and'), create_push(b'\x01'), op('shl')]
+    return [
+        op('dup1'),                                 # [sel, sel]
+        *index,                                     # [sel, 2 * bucket]
+        table_start, op('add'),                     # [sel, entry]
+        create_push(bytes([JUMP_TABLE_ENTRY_SIZE])),
+        op('swap1'),                                # [sel, 2, entry]
+        zero_op, op('codecopy'),                    # [sel]
+        zero_op, op('mload'),
+        create_push(bytes([256 - 8 * JUMP_TABLE_ENTRY_SIZE])),
+        op('shr'),                                  # [sel, dest]
+        op('jump')
+    ]
+
+
+def jump_table_prefix_gas(plan: HashPlan, zero_op: Op) -> int:
+    ops: list[Op] = []
+    for step in jump_table_prefix(plan, push_selector(0), zero_op):
+        assert isinstance(step, Op), f'Unexpected {step!r} in jump table prefix'
+        ops.append(step)
+    # CODECOPY copies one word, potentially expanding memory
+    return gas(ops) + 3 + SCRATCH_MEMORY_GAS + JUMPDEST_GAS
+
+
+def buckets(entries: list[DispatchEntry], plan: HashPlan) -> list[list[DispatchEntry]]:
+    result: list[list[DispatchEntry]] = [[] for _ in range(1 << plan.bits)]
+    for entry in entries:
+        result[bucket_of(entry.selector, plan)].append(entry)
+    return result
+
+
+def jump_table_gas(entries: list[DispatchEntry], plan: HashPlan, zero_op: Op) -> float:
+    checks = sum(
+        len(bucket) * (len(bucket) + 1) / 2
+        for bucket in buckets(entries, plan)
+    )
+    return jump_table_prefix_gas(plan, zero_op) + CHECK_GAS * checks / len(entries)
+
+
+def find_hash_plan(entries: list[DispatchEntry], zero_op: Op) -> tuple[float, Optional[HashPlan]]:
+    '''Bit window minimizing the average gas, fewer bits (smaller tables) break ties'''
+    if len(entries) < 2:
+        return float('inf'), None
+    min_bits = max(1, ceil(log2(len(entries))))
+    best: tuple[float, Optional[HashPlan]] = (float('inf'), None)
+    for bits in range(min_bits, min(min_bits + EXTRA_JUMP_TABLE_BITS, MAX_JUMP_TABLE_BITS) + 1):
+        for shift in range(0, 32 - bits + 1):
+            plan = HashPlan(shift, bits)
+            cost = jump_table_gas(entries, plan, zero_op)
+            if cost < best[0]:
+                best = (cost, plan)
+    return best
+
+
+def dispatch_costs(entries: list[DispatchEntry], zero_op: Op) -> dict[DispatchStrategy, float]:
+    '''Average gas from the dispatcher's start to a function's label for every strategy'''
+    sorted_entries = sorted(entries)
+    return {
+        'linear': linear_gas(len(entries)),
+        'binary': search_tree(sorted_entries)[0],
+        'jump_table': find_hash_plan(sorted_entries, zero_op)[0]
+    }
+
+
+def select_strategy(entries: list[DispatchEntry], zero_op: Op) -> DispatchStrategy:
+    costs = dispatch_costs(entries, zero_op)
+    # Ties favour the earlier, smaller strategies
+    return min(DISPATCH_STRATEGIES, key=lambda strategy: costs[strategy])
+
+
+def gen_checks(entries: list[DispatchEntry]) -> list[Asm]:
+    asm: list[Asm] = []
+    for entry in entries:
+        asm.extend([op('dup1'), push_selector(entry.selector), op('eq'), MarkRef(entry.dest), op('jumpi')])
+    return asm
+
+
+def gen_search(node: SearchNode, end: MarkId, ctx: ContextTracker) -> list[Asm]:
+    if isinstance(node, list):
+        return [*gen_checks(node), MarkRef(end), op('jump')]
+    left = MarkId(ctx.next_obj_id(), MarkPurpose.Label)
+    return [
+        # pivot > selector
+        op('dup1'), push_selector(node.pivot), op('gt'), MarkRef(left), op('jumpi'),
+        *gen_search(node.right, end, ctx),
+        Mark(left), op('jumpdest'),
+        *gen_search(node.left, end, ctx)
+    ]
+
+
+def end_dispatch(asm: list[Asm], end: MarkId) -> list[Asm]:
+    '''Terminates the dispatcher at `end`, the last jump to it can fall through instead'''
+    if asm[-2:] == [MarkRef(end), op('jump')]:
+        asm = asm[:-2]
+    return [*asm, Mark(end), op('jumpdest')]
+
+
+def gen_dispatch(
+    entries: list[DispatchEntry],
+    ctx: ContextTracker,
+    zero_op: Op,
+    strategy: Optional[DispatchStrategy] = None
+) -> tuple[list[Asm], Optional[tuple[Asm, ...]], Optional[ObjectId]]:
+    '''
+    Generates the dispatcher over `entries`, returns its code and for `jump_table` dispatchers the
+    table to be appended to the code together with the object ID its start mark has to use.
+    `zero_op` pushes a zero, it must not be `RETURNDATASIZE` as the dispatcher may run after calls.
+    '''
+    selectors = [entry.selector for entry in entries]
+    assert len(set(selectors)) == len(selectors), 'Duplicate function selectors in dispatcher'
+    if strategy is None:
+        strategy = select_strategy(entries, zero_op)
+    entries = sorted(entries)
+
+    if strategy == 'linear':
+        return gen_checks(entries), None, None
+
+    end = MarkId(ctx.next_obj_id(), MarkPurpose.Label)
+    if strategy == 'binary':
+        _, tree = search_tree(entries)
+        return end_dispatch(gen_search(tree, end, ctx), end), None, None
+
+    _, plan = find_hash_plan(entries, zero_op)
+    assert plan is not None, 'Jump table dispatch requires at least 2 functions'
+    table_id = ctx.next_obj_id()
+    asm = jump_table_prefix(plan, MarkRef(MarkId(table_id, MarkPurpose.Start)), zero_op)
+    table: list[Asm] = []
+    for bucket in buckets(entries, plan):
+        if not bucket:
+            table.append(MarkOffset(end, JUMP_TABLE_ENTRY_SIZE))
+            continue
+        block = MarkId(ctx.next_obj_id(), MarkPurpose.Label)
+        table.append(MarkOffset(block, JUMP_TABLE_ENTRY_SIZE))
+        asm.extend([Mark(block), op('jumpdest'), *gen_checks(bucket), MarkRef(end), op('jump')])
+    return end_dispatch(asm, end), tuple(table), table_id
@@ -0,0 +1,64 @@
+'''
+EVM versions (hard forks) code can be compiled for. The target decides which opcodes source code
+may use and which instructions generated code (built-ins, initcode, synthesized constants) picks,
+e.g. `PUSH0` rather than `RETURNDATASIZE` for zeros from Shanghai onwards.
+'''
+from typing import Optional
+import typing
+from .opcodes import Op, op, OP_MAP
+
+EvmVersion = typing.Literal['london', 'paris', 'shanghai', 'cancun', 'prague']
+# Oldest first
+EVM_VERSIONS: tuple[EvmVersion, ...] = ('london', 'paris', 'shanghai', 'cancun', 'prague')
+DEFAULT_EVM_VERSION: EvmVersion = 'prague'
+# Version targeted by the former `avoid_push0=True` flag
+PRE_PUSH0_EVM_VERSION: EvmVersion = 'paris'
+
+# `EvmVersion` or the legacy `avoid_push0` flag (`False` targets the default version)
+EvmTarget = EvmVersion | bool
+
+# Opcodes introduced after the oldest supported version
+OPCODE_VERSIONS: dict[str, EvmVersion] = {
+    'push0': 'shanghai',
+    'tload': 'cancun',
+    'tstore': 'cancun',
+    'mcopy': 'cancun',
+    'blobhash': 'cancun',
+    'blobbasefee': 'cancun'
+}
+OPCODE_BYTE_VERSIONS: dict[int, EvmVersion] = {
+    OP_MAP[name]: version for name, version in OPCODE_VERSIONS.items()
+}
+
+
+def validate_evm_version(target: Optional[EvmTarget]) -> EvmVersion:
+    '''Resolves `None` and the legacy `avoid_push0` flag to an `EvmVersion`'''
+    if target is None or target is False:
+        return DEFAULT_EVM_VERSION
+    if target is True:
+        return PRE_PUSH0_EVM_VERSION
+    assert target in EVM_VERSIONS, \
+        f'Unknown EVM version "{target}", expected one of {", ".join(EVM_VERSIONS)}'
+    return target
+
+
+def is_at_least(version: EvmVersion, minimum: EvmVersion) -> bool:
+    return EVM_VERSIONS.index(version) >= EVM_VERSIONS.index(minimum)
+
+
+def supports_opcode(version: EvmVersion, opcode: int) -> bool:
+    introduced = OPCODE_BYTE_VERSIONS.get(opcode)
+    return introduced is None or is_at_least(version, introduced)
+
+
+def unsupported_opcode_error(version: EvmVersion, name: str) -> str:
+    return f'Opcode "{name}" requires EVM version {OPCODE_VERSIONS[name]} or later (target: {version})'
+
+
+def has_push0(version: EvmVersion) -> bool:
+    return supports_opcode(version, OP_MAP['push0'])
+
+
+def zero_op(version: EvmVersion) -> Op:
+    '''Cheapest instruction pushing a zero, `RETURNDATASIZE` is zero until the first call'''
+    return op('push0') if has_push0(version) else op('returndatasize')
@@ -0,0 +1,129 @@
+'''
+Expansion size prediction. Every invocation inlines the invoked macro, a macro invoking another
+macro several times which does the same grows the output exponentially. Before expanding an entry
+point the number of assembly steps and the nesting depth of every reachable macro are computed
+bottom-up from the macro bodies (linear in the number of macros) and checked against limits, so
+that such programs fail immediately with the invocation chain responsible for the blow-up.
+
+Built-in invocations are counted as a single step, the prediction is a lower bound.
+'''
+from typing import NamedTuple, Optional
+from .parser import Identifier, Invocation, LabelDef, Macro
+from .relocation import ObjectMacro
+
+ExpansionLimits = NamedTuple(
+    'ExpansionLimits',
+    [
+        # Maximum assembly steps (roughly instructions) an entry point may expand to
+        ('max_steps', int),
+        # Maximum macro nesting depth, `None` for no limit (expansion is iterative)
+        ('max_depth', Optional[int])
+    ]
+)
+
+# Far above what fits into deployable code (EIP-170 / EIP-3860) yet expands in well under a second.
+# The step limit already bounds the depth, deeper nesting is not rejected by default.
+DEFAULT_EXPANSION_LIMITS = ExpansionLimits(max_steps=1_000_000, max_depth=None)
+
+MacroCost = NamedTuple(
+    'MacroCost',
+    [
+        ('steps', int),
+        ('depth', int)
+    ]
+)
+
+
+def invocation_counts(macro: Macro) -> dict[Identifier, int]:
+    counts: dict[Identifier, int] = {}
+    for el in macro.body:
+        if isinstance(el, Invocation):
+            counts[el.ident] = counts.get(el.ident, 0) + 1
+    return counts
+
+
+def predict_expansion(
+    root: Identifier,
+    macros: dict[Identifier, Macro],
+    object_macros: dict[Identifier, ObjectMacro]
+) -> Optional[dict[Identifier, MacroCost]]:
+    '''
+    Cost of every macro reachable from `root`, `None` if the invocations are circular (reported by
+    the expansion itself). Unknown invocations (built-ins, undefined macros) cost a single step.
+    '''
+    costs: dict[Identifier, MacroCost] = {}
+    active: set[Identifier] = set()
+    # Post-order traversal with an explicit stack, `True` once the invoked macros are done
+    stack: list[tuple[Identifier, bool]] = [(root, False)]
+    while stack:
+        ident, children_done = stack.pop()
+        if ident in costs:
+            continue
+        if (object_macro := object_macros.get(ident)) is not None:
+            costs[ident] = MacroCost(len(object_macro.asm), 1)
+            continue
+        if ident not in macros:
+            costs[ident] = MacroCost(1, 0)
+            continue
+        macro = macros[ident]
+        if not children_done:
+            if ident in active:
+                return None
+            active.add(ident)
+            stack.append((ident, True))
+            stack.extend((callee, False) for callee in invocation_counts(macro))
+            continue
+        active.discard(ident)
+        steps = 0
+        depth = 0
+        for el in macro.body:
+            if isinstance(el, Invocation):
+                callee = costs[el.ident]
+                steps += callee.steps
+                depth = max(depth, callee.depth)
+            else:
+                # Labels are a mark and a `JUMPDEST`
+                steps += 2 if isinstance(el, LabelDef) else 1
+        costs[ident] = MacroCost(steps, depth + 1)
+    return costs
+
+
+def largest_chain(root: Identifier, macros: dict[Identifier, Macro], costs: dict[Identifier, MacroCost]) -> str:
+    '''Follows the invocations contributing the most steps, e.g. `MAIN (..) -> A (4x 1024 steps) -> ..`'''
+    parts = [f'{root} ({costs[root].steps} steps)']
+    ident = root
+    while ident in macros and (counts := invocation_counts(macros[ident])):
+        ident, count = max(counts.items(), key=lambda item: item[1] * costs[item[0]].steps)
+        parts.append(f'{ident} ({count}x {costs[ident].steps} steps)')
+    return ' -> '.join(parts)
+
+
+def deepest_chain(root: Identifier, macros: dict[Identifier, Macro], costs: dict[Identifier, MacroCost]) -> str:
+    '''Path to the deepest nested macro, shortened in the middle'''
+    chain = [root]
+    ident = root
+    while ident in macros and (counts := invocation_counts(macros[ident])):
+        ident = max(counts, key=lambda callee: costs[callee].depth)
+        chain.append(ident)
+    if len(chain) > 8:
+        chain = [*chain[:4], '...', *chain[-3:]]
+    return ' -> '.join(chain)
+
+
+def check_expansion(
+    root: Identifier,
+    macros: dict[Identifier, Macro],
+    object_macros: dict[Identifier, ObjectMacro],
+    limits: ExpansionLimits = DEFAULT_EXPANSION_LIMITS
+):
+    '''Asserts that expanding `root` stays within `limits`'''
+    costs = predict_expansion(root, macros, object_macros)
+    if costs is None:
+        return
+    cost = costs[root]
+    assert limits.max_depth is None or cost.depth <= limits.max_depth, \
+        f'Macro nesting depth {cost.depth} of {root} exceeds the limit of {limits.max_depth}: ' \
+        f'{deepest_chain(root, macros, costs)}'
+    assert cost.steps <= limits.max_steps, \
+        f'{root} is predicted to expand to {cost.steps} steps, exceeding the limit of ' \
+        f'{limits.max_steps}: {largest_chain(root, macros, costs)}'
@@ -0,0 +1,473 @@
+'''
+Grammar based fuzzing harness for the compiler pipeline (lexer, parser, macro expansion and
+assembler). Generates random valid and near-valid Huff programs, measures compile throughput,
+flags crashes, hangs and super-linear slowdowns and shrinks failing inputs to minimal reproducers.
+
+Usage: `huffy fuzz --iterations 2000 --seed 1 --out findings/`
+'''
+from typing import NamedTuple, Callable, Optional, Iterator
+from argparse import ArgumentParser
+from contextlib import contextmanager
+import math
+import os
+import random
+import signal
+import sys
+import threading
+import time
+from parsimonious.exceptions import ParseError
+from .compile import compile_src
+from .opcodes import OP_MAP
+
+# Exceptions the compiler raises to report invalid input, anything else is considered a crash
+EXPECTED_ERRORS: tuple[type[BaseException], ...] = (AssertionError, ParseError)
+
+SAFE_OPS: list[str] = [
+    name
+    for name in OP_MAP
+    if not name.startswith('push') and name not in ('jump', 'jumpi', 'jumpdest')
+] + ['push0']
+
+Failure = NamedTuple(
+    'Failure',
+    [
+        ('kind', str),
+        ('error', str),
+        ('source', str),
+        ('minimized', str)
+    ]
+)
+
+ScalingResult = NamedTuple(
+    'ScalingResult',
+    [
+        ('family', str),
+        ('sizes', list[int]),
+        ('seconds', list[float]),
+        ('exponent', float)
+    ]
+)
+
+FuzzReport = NamedTuple(
+    'FuzzReport',
+    [
+        ('compiles', int),
+        ('seconds', float),
+        ('rejected', int),
+        ('failures', list[Failure]),
+        ('scaling', list[ScalingResult])
+    ]
+)
+
+
+class Hang(Exception):
+    pass
+
+
+@contextmanager
+def time_limit(seconds: Optional[float]):
+    '''Interrupts the block after `seconds`, only supported on the main thread of Unix systems'''
+    if seconds is None or not hasattr(signal, 'setitimer') \
+            or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def on_alarm(*_):
+        raise Hang(f'Exceeded {seconds}s')
+
+    previous = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def run_case(src: str, timeout: Optional[float]) -> Optional[tuple[str, str]]:
+    '''
+    Compiles `src`, returning the kind (`rejected` as invalid, `hang` or `crash`) and description
+    of the error if it did not compile
+    '''
+    try:
+        with time_limit(timeout):
+            compile_src(src, {}, False, strict=True)
+    except Hang as err:
+        return 'hang', str(err)
+    except EXPECTED_ERRORS as err:
+        return 'rejected', f'{type(err).__name__}: {err}'
+    except Exception as err:
+        return 'crash', f'{type(err).__name__}: {err}'
+    return None
+
+
+def hex_literal(rng: random.Random, max_bytes: int = 32) -> str:
+    size = rng.randint(1, max_bytes)
+    return '0x' + rng.randbytes(size).hex()
+
+
+def comment(rng: random.Random) -> str:
+    kind = rng.randrange(4)
+    if kind == 0:
+        return '// ' + 'x' * rng.randrange(40) + '\n'
+    elif kind == 1:
+        return '/* ' + '* ' * rng.randrange(20) + '*/'
+    elif kind == 2:
+        return '/*' + '*' * rng.randint(1, 40) + '/'
+    return '/* #define macro X() = takes(0) returns(0) {} */'
+
+
+class ProgramGenerator:
+    '''Generates random programs following the Huff grammar that are expected to compile'''
+
+    def __init__(self, rng: random.Random, max_macros: int = 8, max_body: int = 24):
+        self.rng = rng
+        self.max_macros = max_macros
+        self.max_body = max_body
+
+    def program(self) -> str:
+        rng = self.rng
+        self.constants = [f'C{i}' for i in range(rng.randrange(4))]
+        self.tables = [f'T{i}' for i in range(rng.randrange(3))]
+        self.functions = [f'fn{i}' for i in range(rng.randrange(4))]
+        self.events = [f'Ev{i}' for i in range(rng.randrange(3))]
+        self.errors = [f'Err{i}' for i in range(rng.randrange(3))]
+        self.macro_params: list[list[str]] = [
+            [f'p{j}' for j in range(rng.randrange(3))]
+            for _ in range(rng.randrange(1, self.max_macros + 1))
+        ]
+
+        defs: list[str] = []
+        for const in self.constants:
+            value = hex_literal(rng) if rng.random() < 0.7 else 'FREE_STORAGE_POINTER()'
+            defs.append(f'#define constant {const} = {value}')
+        for table in self.tables:
+            defs.append(f'#define table {table} {{ {hex_literal(rng, 64)} }}')
+        for fn in self.functions:
+            args = ','.join(rng.choice(['uint256', 'address', 'bytes32', 'uint8[]', 'string'])
+                            for _ in range(rng.randrange(3)))
+            mutability = rng.choice(['view', 'nonpayable', 'payable'])
+            defs.append(f'#define function {fn}({args}) {mutability} returns (uint256)')
+        for ev in self.events:
+            defs.append(f'#define event {ev}(address indexed, uint256)')
+        for err in self.errors:
+            defs.append(f'#define error {err}(uint256)')
+        for i, params in enumerate(self.macro_params):
+            defs.append(self.macro(f'M{i}', i, params))
+        callees = [self.invocation(i, []) for i in range(len(self.macro_params)) if rng.random() < 0.6]
+        defs.append(f'#define macro MAIN() = takes(0) returns(0) {{ {" ".join(callees)} stop }}')
+        if rng.random() < 0.3:
+            defs.append('#define macro CONSTRUCTOR() = takes(0) returns(0) { __RETURN_RUNTIME(push0) }')
+
+        rng.shuffle(defs)
+        return '\n'.join(
+            (comment(rng) + '\n' if rng.random() < 0.2 else '') + d
+            for d in defs
+        ) + '\n'
+
+    def invocation(self, macro_index: int, labels: list[str], params: tuple[str, ...] = ()) -> str:
+        rng = self.rng
+        args: list[str] = []
+        for _ in self.macro_params[macro_index]:
+            choices = [hex_literal(rng), rng.choice(SAFE_OPS)]
+            choices.extend(labels)
+            choices.extend(f'<{p}>' for p in params)
+            args.append(rng.choice(choices))
+        return f'M{macro_index}({", ".join(args)})'
+
+    def macro(self, name: str, index: int, params: list[str]) -> str:
+        rng = self.rng
+        labels = [f'{name.lower()}_l{j}' for j in range(rng.randrange(3))]
+        body: list[str] = []
+        for _ in range(rng.randrange(self.max_body)):
+            body.append(self.body_el(index, labels, tuple(params)))
+        for label in labels:
+            body.insert(rng.randrange(len(body) + 1), f'{label}:')
+        return f'#define macro {name}({", ".join(params)}) = takes(0) returns(0) {{\n    ' \
+            + '\n    '.join(body) + '\n}'
+
+    def body_el(self, index: int, labels: list[str], params: tuple[str, ...]) -> str:
+        rng = self.rng
+        kind = rng.randrange(10)
+        if kind == 0 and labels:
+            return f'{rng.choice(labels)} {rng.choice(["jump", "jumpi"])}'
+        elif kind == 1 and params:
+            return f'<{rng.choice(params)}>'
+        elif kind == 2 and self.constants:
+            return f'[{rng.choice(self.constants)}]'
+        elif kind == 3 and index + 1 < len(self.macro_params):
+            return self.invocation(rng.randrange(index + 1, len(self.macro_params)), labels, params)
+        elif kind == 4:
+            return self.builtin()
+        elif kind == 5:
+            return f'push{rng.randint(1, 32)} {hex_literal(rng, 1)}'
+        elif kind == 6:
+            return comment(rng)
+        elif kind < 8:
+            return hex_literal(rng)
+        return rng.choice(SAFE_OPS)
+
+    def builtin(self) -> str:
+        rng = self.rng
+        options: list[str] = []
+        options.extend(f'__FUNC_SIG({f})' for f in self.functions + self.errors)
+        options.extend(f'__EVENT_HASH({e})' for e in self.events)
+        options.extend(f'__tablestart({t}) __tablesize({t})' for t in self.tables)
+        return rng.choice(options) if options else 'caller'
+
+
+def mutate(rng: random.Random, src: str) -> str:
+    '''Turns a valid program into a near-valid one with a small, random edit'''
+    tokens = src.split(' ')
+    kind = rng.randrange(6)
+    i = rng.randrange(len(tokens))
+    if kind == 0:
+        del tokens[i]
+    elif kind == 1:
+        tokens.insert(i, tokens[rng.randrange(len(tokens))])
+    elif kind == 2:
+        tokens[i] = rng.choice(['(', ')', '{', '}', '<', '>', ':', '0x', '#define', '[', ']'])
+    elif kind == 3:
+        j = rng.randrange(len(tokens))
+        tokens[i], tokens[j] = tokens[j], tokens[i]
+    elif kind == 4:
+        pos = rng.randrange(len(src) + 1)
+        return src[:pos] + rng.choice('/*x0(){}<>:#\n') + src[pos:]
+    else:
+        pos = rng.randrange(len(src))
+        return src[:pos] + src[pos + 1:]
+    return ' '.join(tokens)
+
+
+def stress_nested_invocations(n: int) -> str:
+    macros = [f'#define macro M{n}() = takes(0) returns(0) {{ caller }}']
+    for i in range(n):
+        macros.append(f'#define macro M{i}() = takes(0) returns(0) {{ caller M{i + 1}() }}')
+    macros.append('#define macro MAIN() = takes(0) returns(0) { M0() }')
+    return '\n'.join(macros)
+
+
+def stress_labels(n: int) -> str:
+    body = ' '.join(f'l{i} jump l{i}:' for i in range(n))
+    return f'#define macro MAIN() = takes(0) returns(0) {{ {body} }}'
+
+
+def stress_literals(n: int) -> str:
+    body = ' '.join('0x' + 'ab' * 32 for _ in range(n))
+    return f'#define macro MAIN() = takes(0) returns(0) {{ {body} }}'
+
+
+def stress_comments(n: int) -> str:
+    return '/*' + '* ' * n + '*/\n' + '// ' + '/' * n + '\n' \
+        + '#define macro MAIN() = takes(0) returns(0) { stop }'
+
+
+def stress_macros(n: int) -> str:
+    macros = [f'#define macro M{i}() = takes(0) returns(0) {{ 0x{i:x} pop }}' for i in range(n)]
+    invocations = ' '.join(f'M{i}()' for i in range(n))
+    macros.append(f'#define macro MAIN() = takes(0) returns(0) {{ {invocations} }}')
+    return '\n'.join(macros)
+
+
+STRESS_FAMILIES: dict[str, Callable[[int], str]] = {
+    'nested_invocations': stress_nested_invocations,
+    'labels': stress_labels,
+    'literals': stress_literals,
+    'comments': stress_comments,
+    'macros': stress_macros
+}
+
+
+def ddmin(items: list[str], joiner: str, still_fails: Callable[[str], bool], budget: int) -> list[str]:
+    '''Delta debugging: removes chunks of `items` as long as the failure reproduces'''
+    chunks = 2
+    while len(items) >= 2 and budget > 0:
+        size = math.ceil(len(items) / chunks)
+        reduced = False
+        for start in range(0, len(items), size):
+            budget -= 1
+            candidate = items[:start] + items[start + size:]
+            if candidate and still_fails(joiner.join(candidate)):
+                items = candidate
+                chunks = max(chunks - 1, 2)
+                reduced = True
+                break
+            if budget <= 0:
+                break
+        if not reduced:
+            if chunks >= len(items):
+                break
+            chunks = min(chunks * 2, len(items))
+    return items
+
+
+def shrink(src: str, still_fails: Callable[[str], bool], budget: int = 400) -> str:
+    '''Minimizes `src` first by lines then by whitespace separated tokens'''
+    lines = ddmin(src.split('\n'), '\n', still_fails, budget // 2)
+    tokens = ddmin('\n'.join(lines).split(' '), ' ', still_fails, budget // 2)
+    return ' '.join(tokens)
+
+
+def signature_matcher(kind: str, error: str, timeout: Optional[float]) -> Callable[[str], bool]:
+    error_type = error.split(':', 1)[0]
+
+    def still_fails(src: str) -> bool:
+        result = run_case(src, timeout)
+        return result is not None and result[0] == kind and result[1].split(':', 1)[0] == error_type
+    return still_fails
+
+
+def measure_scaling(
+    family: str,
+    gen: Callable[[int], str],
+    start: int = 64,
+    max_seconds: float = 1.0,
+    timeout: Optional[float] = 10.0
+) -> tuple[ScalingResult, Optional[Failure]]:
+    '''
+    Compiles increasingly large inputs of a stress family, doubling the size each step. The
+    exponent is estimated from the last two measurements (1.0 = linear).
+    '''
+    sizes: list[int] = []
+    seconds: list[float] = []
+    n = start
+    failure: Optional[Failure] = None
+    while True:
+        src = gen(n)
+        t0 = time.perf_counter()
+        result = run_case(src, timeout)
+        elapsed = time.perf_counter() - t0
+        if result is not None:
+            failure = Failure(result[0], f'{family} (n={n}): {result[1]}', src, '')
+            break
+        sizes.append(n)
+        seconds.append(elapsed)
+        if elapsed > max_seconds or n >= 1 << 20:
+            break
+        n *= 2
+    exponent = 0.0
+    if len(seconds) >= 2 and seconds[-2] > 0:
+        exponent = math.log(seconds[-1] / seconds[-2], sizes[-1] / sizes[-2])
+    return ScalingResult(family, sizes, seconds, exponent), failure
+
+
+def iter_cases(rng: random.Random, iterations: int, mutate_ratio: float) -> Iterator[tuple[str, bool]]:
+    '''Yields generated programs and whether they are meant to be valid (not mutated)'''
+    gen = ProgramGenerator(rng)
+    for _ in range(iterations):
+        src = gen.program()
+        if rng.random() < mutate_ratio:
+            yield mutate(rng, src), False
+        else:
+            yield src, True
+
+
+def fuzz(
+    iterations: int,
+    seed: int = 0,
+    mutate_ratio: float = 0.3,
+    timeout: Optional[float] = 5.0,
+    scaling: bool = True,
+    max_scaling_seconds: float = 1.0,
+    superlinear_threshold: float = 1.5,
+    shrink_budget: int = 400
+) -> FuzzReport:
+    rng = random.Random(seed)
+    failures: list[Failure] = []
+    seen_signatures: set[tuple[str, str]] = set()
+    rejected = 0
+    compiles = 0
+
+    start = time.perf_counter()
+    for src, valid in iter_cases(rng, iterations, mutate_ratio):
+        compiles += 1
+        if (result := run_case(src, timeout)) is None:
+            continue
+        kind, error = result
+        # Only mutated programs may be invalid, rejecting a generated one is a finding
+        if kind == 'rejected' and not valid:
+            rejected += 1
+            continue
+        signature = (kind, error.split(':', 1)[0])
+        if signature in seen_signatures:
+            continue
+        seen_signatures.add(signature)
+        failures.append(Failure(kind, error, src, ''))
+    elapsed = time.perf_counter() - start
+
+    # Shrinking is excluded from the throughput measurement
+    failures = [
+        f._replace(minimized=shrink(f.source, signature_matcher(f.kind, f.error, timeout), shrink_budget))
+        for f in failures
+    ]
+
+    scaling_results: list[ScalingResult] = []
+    if scaling:
+        for family, gen in STRESS_FAMILIES.items():
+            measured, failure = measure_scaling(family, gen, max_seconds=max_scaling_seconds, timeout=timeout)
+            scaling_results.append(measured)
+            if failure is not None:
+                failures.append(failure)
+            elif measured.exponent > superlinear_threshold:
+                failures.append(Failure(
+                    'superlinear',
+                    f'{family}: time grows with exponent {measured.exponent:.2f} '
+                    f'({measured.sizes[-2]} -> {measured.sizes[-1]}: '
+                    f'{measured.seconds[-2]:.3f}s -> {measured.seconds[-1]:.3f}s)',
+                    '',
+                    ''
+                ))
+
+    return FuzzReport(compiles, elapsed, rejected, failures, scaling_results)
+
+
+def write_findings(out_dir: str, report: FuzzReport):
+    os.makedirs(out_dir, exist_ok=True)
+    for i, failure in enumerate(report.failures):
+        if not failure.source:
+            continue
+        with open(os.path.join(out_dir, f'{i:03d}_{failure.kind}.huff'), 'w') as f:
+            f.write(f'// {failure.error}\n{failure.source}')
+        if failure.minimized:
+            with open(os.path.join(out_dir, f'{i:03d}_{failure.kind}.min.huff'), 'w') as f:
+                f.write(f'// {failure.error}\n{failure.minimized}\n')
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = ArgumentParser(prog='huffy fuzz', description='Fuzz the Huff compiler with generated programs')
+    parser.add_argument('--iterations', '-n', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mutate-ratio', type=float, default=0.3)
+    parser.add_argument('--timeout', type=float, default=5.0)
+    parser.add_argument('--no-scaling', action='store_true')
+    parser.add_argument('--max-scaling-seconds', type=float, default=1.0)
+    parser.add_argument('--out', type=str, default=None, help='directory to write reproducers to')
+    args = parser.parse_args(argv)
+
+    report = fuzz(
+        args.iterations,
+        seed=args.seed,
+        mutate_ratio=args.mutate_ratio,
+        timeout=args.timeout,
+        scaling=not args.no_scaling,
+        max_scaling_seconds=args.max_scaling_seconds
+    )
+
+    rate = report.compiles / report.seconds if report.seconds else 0.0
+    print(f'{report.compiles} compiles in {report.seconds:.2f}s ({rate:.1f}/s), '
+          f'{report.rejected} rejected as invalid')
+    for result in report.scaling:
+        timings = ', '.join(f'{n}: {t * 1000:.1f}ms' for n, t in zip(result.sizes, result.seconds))
+        print(f'scaling {result.family}: exponent {result.exponent:.2f} ({timings})')
+    for failure in report.failures:
+        print(f'{failure.kind.upper()}: {failure.error}')
+        if failure.minimized:
+            print(f'  minimized: {failure.minimized!r}')
+    if args.out is not None:
+        write_findings(args.out, report)
+    if report.failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
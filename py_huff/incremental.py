@@ -0,0 +1,175 @@
+'''
+Definition-level incremental re-parsing for editor integrations.
+
+Applying an edit only re-lexes the region between the closest untouched top-level definitions
+around it. Definitions outside of that region are kept as is, including their parsed `Macro`,
+their offsets are shifted lazily (see `IncrementalDef`) and only materialized when requested.
+'''
+from typing import NamedTuple, Optional
+from bisect import bisect_left, bisect_right
+import argparse
+import random
+import time
+from parsimonious.exceptions import ParseError
+from .lexer import lex_huff
+from .node import ExNode
+from .parser import Macro, parse_macro
+
+TextEdit = NamedTuple(
+    'TextEdit',
+    [
+        ('start', int),
+        ('end', int),
+        ('text', str)
+    ]
+)
+
+# `node` holds offsets relative to the text it was lexed from, adding `shift` converts them into
+# offsets of the current text.
+IncrementalDef = NamedTuple(
+    'IncrementalDef',
+    [
+        ('node', ExNode),
+        ('shift', int),
+        ('macro', Optional[Macro])
+    ]
+)
+
+IncrementalTree = NamedTuple(
+    'IncrementalTree',
+    [
+        ('src', str),
+        ('defs', tuple[IncrementalDef, ...]),
+        # Definitions lexed by the last parse / edit
+        ('relexed', int)
+    ]
+)
+
+
+def def_start(d: IncrementalDef) -> int:
+    return d.node.start + d.shift
+
+
+def def_end(d: IncrementalDef) -> int:
+    return d.node.end + d.shift
+
+
+def shift_node(node: ExNode, delta: int) -> ExNode:
+    if delta == 0:
+        return node
+    content = node.content
+    if isinstance(content, list):
+        content = [shift_node(child, delta) for child in content]
+    return ExNode(node.name, content, node.start + delta, node.end + delta)
+
+
+def materialize_def(d: IncrementalDef) -> ExNode:
+    return shift_node(d.node, d.shift)
+
+
+def tree_root(tree: IncrementalTree) -> ExNode:
+    '''Builds the root node, identical to what `lex_huff(tree.src)` returns'''
+    return ExNode(
+        'program',
+        [materialize_def(d) for d in tree.defs] or '',
+        0,
+        len(tree.src)
+    )
+
+
+def tree_macros(tree: IncrementalTree) -> list[Macro]:
+    return [d.macro for d in tree.defs if d.macro is not None]
+
+
+def lex_defs(src: str, offset: int) -> list[IncrementalDef]:
+    root = lex_huff(src)
+    if isinstance(root.content, str):
+        return []
+    defs: list[IncrementalDef] = []
+    for node in root.children():
+        inner = node.get_idx(0)
+        defs.append(IncrementalDef(node, offset, parse_macro(inner) if inner.name == 'macro' else None))
+    return defs
+
+
+def parse_incremental(src: str) -> IncrementalTree:
+    defs = tuple(lex_defs(src, 0))
+    return IncrementalTree(src, defs, len(defs))
+
+
+def apply_edit(tree: IncrementalTree, edit: TextEdit) -> IncrementalTree:
+    '''
+    Replaces `tree.src[edit.start:edit.end]` with `edit.text`. Definitions overlapping or touching
+    the edit are re-lexed, together with the gaps around them.
+    '''
+    start, end, text = edit
+    assert 0 <= start <= end <= len(tree.src), \
+        f'Edit {start}..{end} out of bounds for source of length {len(tree.src)}'
+    src = tree.src[:start] + text + tree.src[end:]
+    delta = len(text) - (end - start)
+    defs = tree.defs
+
+    # Untouched definitions: those ending before the edit and those starting after it
+    lo = bisect_left([def_end(d) for d in defs], start)
+    hi = bisect_right([def_start(d) for d in defs], end)
+    # A line comment in the re-lexed region must not be able to run into the next kept definition
+    while hi < len(defs) and tree.src[def_start(defs[hi]) - 1] != '\n':
+        hi += 1
+
+    region_start = def_end(defs[lo - 1]) if lo > 0 else 0
+    region_end = (def_start(defs[hi]) if hi < len(defs) else len(tree.src)) + delta
+    try:
+        relexed = lex_defs(src[region_start:region_end], region_start)
+    except ParseError:
+        # Edit may affect text beyond the region (e.g. an opened block comment)
+        return parse_incremental(src)
+
+    kept_after = tuple(d._replace(shift=d.shift + delta) for d in defs[hi:])
+    return IncrementalTree(src, defs[:lo] + tuple(relexed) + kept_after, len(relexed))
+
+
+def gen_library(macros: int) -> str:
+    return '\n'.join(
+        f'#define macro M{i}(a) = takes(1) returns(1) {{\n'
+        f'    // macro {i}\n'
+        f'    <a> 0x{i:04x} add dup1 label_{i} jumpi\n'
+        f'    label_{i}:\n'
+        f'        0x20 mstore\n'
+        f'}}\n'
+        for i in range(macros)
+    )
+
+
+def benchmark(macros: int, edits: int, seed: int = 0) -> tuple[float, float]:
+    '''Returns the average time per keystroke of full `lex_huff` and of `apply_edit`'''
+    rng = random.Random(seed)
+    tree = parse_incremental(gen_library(macros))
+    full_total, incremental_total = 0.0, 0.0
+    for _ in range(edits):
+        # Type a digit into one of the macro literals
+        d = tree.defs[rng.randrange(len(tree.defs))]
+        pos = tree.src.index('0x', def_start(d)) + 2
+        edit = TextEdit(pos, pos, str(rng.randrange(10)))
+
+        t0 = time.perf_counter()
+        tree = apply_edit(tree, edit)
+        t1 = time.perf_counter()
+        lex_huff(tree.src)
+        t2 = time.perf_counter()
+        incremental_total += t1 - t0
+        full_total += t2 - t1
+    return full_total / edits, incremental_total / edits
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description='Benchmark incremental re-parsing vs. full lexing')
+    parser.add_argument('--macros', type=int, default=2000, help='Macros in generated library')
+    parser.add_argument('--edits', type=int, default=20, help='Edits to apply')
+    args = parser.parse_args(argv)
+    full, incremental = benchmark(args.macros, args.edits)
+    print(f'full lex_huff: {full * 1e3:.2f} ms/edit')
+    print(f'incremental:   {incremental * 1e3:.2f} ms/edit ({full / incremental:.1f}x faster)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+'''
+Selection of the default initcode, used when a program does not define a `CONSTRUCTOR`.
+
+Every strategy is priced with the following deploy gas model, the cheapest one is chosen:
+
+    total = calldata gas     (4 per zero byte, 16 per non-zero byte of the initcode)
+          + initcode gas     (2 per 32-byte word of initcode, EIP-3860)
+          + execution gas    (static opcode gas + memory expansion + 3 per word copied)
+
+The 21000 transaction, 32000 creation and 200 gas per byte code deposit costs are identical for
+all strategies and therefore left out.
+'''
+from typing import NamedTuple
+from .assembler import (
+    Asm, MarkRef, MarkDeltaRef, asm_to_bytecode, to_start_mark, to_end_mark, to_size_mark_ref,
+    to_start_mark_ref
+)
+from .context import ObjectId
+from .codegen import bytes_to_push, gen_minimal_init
+from .opcodes import Op, op, BASE_GAS, create_push
+
+# Maximum runtime size in 32-byte words for which `mstore` based initcode is considered
+MAX_MSTORE_WORDS = 16
+
+InitStrategy = NamedTuple(
+    'InitStrategy',
+    [
+        ('name', str),
+        ('asm', list[Asm]),
+        ('exec_gas', int)
+    ]
+)
+
+InitChoice = NamedTuple(
+    'InitChoice',
+    [
+        ('name', str),
+        ('deploy', bytes),
+        ('exec_gas', int),
+        ('total_gas', int)
+    ]
+)
+
+
+def words(size: int) -> int:
+    return (size + 31) // 32
+
+
+def memory_gas(size: int) -> int:
+    w = words(size)
+    return 3 * w + w * w // 512
+
+
+def static_gas(asm: list[Asm]) -> int:
+    return sum(
+        BASE_GAS[step.op] if isinstance(step, Op) else 3
+        for step in asm
+        if isinstance(step, (Op, MarkRef, MarkDeltaRef))
+    )
+
+
+def calldata_gas(data: bytes) -> int:
+    zeros = data.count(0)
+    return 4 * zeros + 16 * (len(data) - zeros)
+
+
+def deploy_gas(deploy: bytes, exec_gas: int) -> int:
+    return calldata_gas(deploy) + 2 * words(len(deploy)) + exec_gas
+
+
+def push_or_zero(value: int, zero_op: Op) -> Op:
+    if value == 0:
+        return zero_op
+    return create_push(value.to_bytes(32, 'big'))
+
+
+def gen_mstore_init(runtime: bytes, zero_op: Op) -> InitStrategy:
+    '''
+    Writes the runtime into memory with one `PUSH` + `MSTORE` per word, right aligned so that the
+    first word can omit leading zeros. Zero words are skipped as fresh memory is already zeroed,
+    `MSIZE` yields the offset of a word directly following the previous store.
+    '''
+    total_words = words(len(runtime))
+    start = 32 * total_words - len(runtime)
+    padded = bytes(start) + runtime
+    asm: list[Asm] = []
+    mem_size = 0
+    for i in range(total_words):
+        word = padded[32 * i: 32 * (i + 1)]
+        if not any(word):
+            continue
+        offset = 32 * i
+        asm.extend([
+            bytes_to_push(word, avoid_push0=True),
+            op('msize') if 0 < offset == mem_size else push_or_zero(offset, zero_op),
+            op('mstore')
+        ])
+        mem_size = offset + 32
+    asm.extend([
+        op('msize') if 0 < len(runtime) == mem_size else push_or_zero(len(runtime), zero_op),
+        push_or_zero(start, zero_op),
+        op('return')
+    ])
+    # `RETURN` expands memory to the full runtime even if trailing words were skipped
+    return InitStrategy('mstore', asm, static_gas(asm) + memory_gas(32 * total_words))
+
+
+def gen_codecopy_inits(runtime: bytes, runtime_id: ObjectId, zero_op: Op) -> list[InitStrategy]:
+    '''Strategies that append the runtime to the initcode and copy it into memory via `CODECOPY`'''
+    embedded: list[Asm] = [to_start_mark(runtime_id), runtime, to_end_mark(runtime_id)]
+    copy_gas = memory_gas(len(runtime)) + 3 * words(len(runtime))
+
+    minimal = gen_minimal_init(runtime_id, zero_op)
+    strategies = [InitStrategy('codecopy', minimal + embedded, static_gas(minimal) + copy_gas)]
+
+    if len(runtime) % 32 == 0:
+        # Memory size matches the runtime exactly after the copy, `MSIZE` replaces the `DUP1`
+        msize_init: list[Asm] = [
+            to_size_mark_ref(runtime_id),
+            to_start_mark_ref(runtime_id),
+            zero_op,
+            op('codecopy'),
+            op('msize'),
+            zero_op,
+            op('return')
+        ]
+        strategies.append(
+            InitStrategy('codecopy_msize', msize_init + embedded, static_gas(msize_init) + copy_gas)
+        )
+
+    return strategies
+
+
+def gen_init_candidates(runtime: bytes, runtime_id: ObjectId, zero_op: Op) -> list[InitStrategy]:
+    if len(runtime) == 0:
+        return [InitStrategy('empty', [op('stop')], 0)]
+    candidates: list[InitStrategy] = []
+    if words(len(runtime)) <= MAX_MSTORE_WORDS:
+        candidates.append(gen_mstore_init(runtime, zero_op))
+    candidates.extend(gen_codecopy_inits(runtime, runtime_id, zero_op))
+    return candidates
+
+
+def select_init(runtime: bytes, runtime_id: ObjectId, zero_op: Op) -> InitChoice:
+    '''Assembles all initcode candidates for `runtime`, returning the one with the lowest deploy gas'''
+    best: InitChoice | None = None
+    for strategy in gen_init_candidates(runtime, runtime_id, zero_op):
+        deploy = asm_to_bytecode(strategy.asm)
+        total = deploy_gas(deploy, strategy.exec_gas)
+        if best is None or total < best.total_gas:
+            best = InitChoice(strategy.name, deploy, strategy.exec_gas, total)
+    assert best is not None
+    return best
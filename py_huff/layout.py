@@ -0,0 +1,138 @@
+'''
+Code layout pass reordering relocatable code so that more label pushes fit into fewer bytes.
+
+Label pushes are sized for wherever their label ends up, code just over 255 bytes pays a `PUSH2`
+for every reference to a label placed late. The code is split into chains: runs of steps ending in
+an unconditional terminator (`JUMP`, `STOP`, `RETURN`, ...), execution never falls through from
+one chain into the next so chains can be placed in any order. Chains spanning the start and end
+mark of an object (tracked macro invocations, embedded code) are kept together. The entry chain
+stays first and a final chain execution can fall off of (or that holds appended tables) stays
+last, the others are sorted by label references per byte so that frequently referenced, small
+chains land at low offsets. The new layout is only kept if it assembles to fewer bytes.
+'''
+from typing import NamedTuple
+from .assembler import Asm, Mark, MarkId, MarkPurpose, MarkRef, assemble, get_min_static_size_bytes
+from .cfg import has_dynamic_offsets, step_bytes
+from .opcodes import Op, TERMINATING_OPS
+from .optimize import OptimizationNote
+from .synthesis import CODE_DEPOSIT_GAS
+from .utils import s
+
+LayoutUnit = NamedTuple(
+    'LayoutUnit',
+    [
+        ('steps', list[Asm]),
+        # Whether the unit ends in a terminator, only closed units may be moved
+        ('closed', bool)
+    ]
+)
+
+
+def is_terminator(step: Asm) -> bool:
+    return isinstance(step, Op) and step.op in TERMINATING_OPS
+
+
+def split_chains(asm: list[Asm]) -> list[tuple[int, int]]:
+    '''Index ranges of the chains of `asm`, end marks directly after a terminator stay with it'''
+    chains: list[tuple[int, int]] = []
+    start = 0
+    i = 0
+    while i < len(asm):
+        step = asm[i]
+        i += 1
+        if not is_terminator(step):
+            continue
+        while i < len(asm) and isinstance(mark := asm[i], Mark) and mark.mid.purpose == MarkPurpose.End:
+            i += 1
+        chains.append((start, i))
+        start = i
+    if start < len(asm):
+        chains.append((start, len(asm)))
+    return chains
+
+
+def layout_units(asm: list[Asm]) -> list[LayoutUnit]:
+    '''Chains merged such that the start and end mark of every object stay in one unit'''
+    chains = split_chains(asm)
+    chain_of_step: list[int] = []
+    for c, (start, end) in enumerate(chains):
+        chain_of_step.extend([c] * (end - start))
+    # Last chain that has to be kept together with each chain
+    merge_until = list(range(len(chains)))
+    starts: dict[MarkId, int] = {}
+    for i, step in enumerate(asm):
+        if not isinstance(step, Mark):
+            continue
+        if step.mid.purpose == MarkPurpose.Start:
+            starts[step.mid] = chain_of_step[i]
+        elif step.mid.purpose == MarkPurpose.End:
+            first = starts.get(MarkId(step.mid.obj_id, MarkPurpose.Start))
+            if first is not None:
+                merge_until[first] = max(merge_until[first], chain_of_step[i])
+
+    units: list[LayoutUnit] = []
+    c = 0
+    while c < len(chains):
+        last = merge_until[c]
+        k = c
+        while k <= last:
+            last = max(last, merge_until[k])
+            k += 1
+        steps = asm[chains[c][0]:chains[last][1]]
+        ops = [step for step in steps if not isinstance(step, Mark)]
+        units.append(LayoutUnit(steps, bool(ops) and is_terminator(ops[-1])))
+        c = last + 1
+    return units
+
+
+def reorder_units(units: list[LayoutUnit], ref_size: int) -> list[LayoutUnit]:
+    '''Sorts the movable units by label references per byte, most referenced first'''
+    if len(units) < 3:
+        return units
+    first, *middle = units
+    last: list[LayoutUnit] = []
+    if not middle[-1].closed:
+        last.append(middle.pop())
+
+    refs: dict[MarkId, int] = {}
+    for unit in units:
+        for step in unit.steps:
+            if isinstance(step, MarkRef):
+                refs[step.mid] = refs.get(step.mid, 0) + 1
+
+    def density(unit: LayoutUnit) -> float:
+        count = sum(refs.get(step.mid, 0) for step in unit.steps if isinstance(step, Mark))
+        return count / max(sum(step_bytes(step, ref_size) for step in unit.steps), 1)
+
+    # Stable sort, units that are never referenced keep their relative order
+    return [first, *sorted(middle, key=density, reverse=True), *last]
+
+
+def optimize_layout(
+    asm: list[Asm],
+    root: str,
+    deposited: bool = True
+) -> tuple[list[Asm], list[OptimizationNote]]:
+    '''
+    Reorders the chains of the complete code `asm` (including appended tables) to shrink label
+    pushes, `deposited` if it is runtime code. Returns the new asm and a note if it is smaller.
+    '''
+    if has_dynamic_offsets(asm):
+        return asm, []
+    units = layout_units(asm)
+    # Execution starts in the first unit, it must not fall through into a moved unit
+    if not units or not units[0].closed:
+        return asm, []
+    new_units = reorder_units(units, get_min_static_size_bytes(asm))
+    moved = sum(old is not new for old, new in zip(units, new_units))
+    if not moved:
+        return asm, []
+    new_asm = [step for unit in new_units for step in unit.steps]
+    saved = len(assemble(asm)[0]) - len(assemble(new_asm)[0])
+    if saved <= 0:
+        return asm, []
+    reason = f'{moved} block{s(moved)} reordered to place frequently referenced labels at low ' \
+        f'offsets, shortening label pushes by {saved} byte{s(saved)}'
+    if deposited:
+        reason += f' (~{CODE_DEPOSIT_GAS * saved} gas code deposit)'
+    return new_asm, [OptimizationNote('layout', root, saved, 0, reason)]
@@ -1,8 +1,14 @@
+from typing import NamedTuple, Optional
+from functools import lru_cache
+import re
 from parsimonious.grammar import Grammar
 from parsimonious.nodes import Node
 from .node import ExNode, Content
 
+# Maximum number of distinct sources whose lexed tree is kept by `lex_huff_cached`
+LEX_CACHE_SIZE = 256
 
+# Compiled once and never modified, parsing keeps all of its state local to the `parse` call
 HUFF_GRAMMAR = Grammar(
     fr'''
     program = gap (definition gap)*
@@ -16,7 +22,9 @@ HUFF_GRAMMAR = Grammar(
 
     const = "#define" ws "constant" ws identifier ws "=" ws (hex_literal / "FREE_STORAGE_POINTER()")
 
-    code_table = "#define" ws "table" ws identifier ws "{{" gap hex_literal gap "}}"
+    code_table = "#define" ws "table" ws identifier ws (table_file / ("{{" gap hex_literal gap "}}"))
+    table_file = "=" ws "file" ws "(" ws "\"" table_path "\"" ws ")"
+    table_path = ~"([a-zA-Z0-9_-]|/|[.])+"
 
     function = "#define" ws "function" ws identifier ws tuple ws mutability ws "returns" ws tuple
     mutability = "view" / "nonpayable" / "payable"
@@ -33,7 +41,8 @@ HUFF_GRAMMAR = Grammar(
     macro_returns_takes = "takes" ws "(" num ")" ws "returns" ws "(" num ")"
     macro_body = ws (macro_body_el ws) *
     macro_body_el = dest_definition / hex_literal / push_op / macro_arg / const_ref / invocation / identifier / comment
-    push_op = "push" num ws hex_literal
+    push_op = "push" push_size ws hex_literal
+    push_size = ~"[1-9][0-9]*"
     dest_definition = identifier ":"
     invocation = identifier ws "(" ws (call_arg ws "," ws)* call_arg? ws ")"
     call_arg = macro_arg / identifier / hex_literal / push_op
@@ -84,3 +93,65 @@ def to_ex_node(node: Node, prune: frozenset[str] = frozenset()) -> ExNode:
 def lex_huff(s: str) -> ExNode:
     node = HUFF_GRAMMAR.parse(s)
     return to_ex_node(node, prune=frozenset({'ws', 'gap', 'comment'}))
+
+
+@lru_cache(maxsize=LEX_CACHE_SIZE)
+def lex_huff_cached(s: str) -> ExNode:
+    '''
+    Memoized `lex_huff`, keyed by source text. The returned tree is shared between callers and
+    threads and must therefore never be mutated.
+    '''
+    return lex_huff(s)
+
+
+# Tokens relevant for finding top-level definitions without lexing: comments and strings are
+# skipped, an unterminated block comment is matched on its own.
+DEF_BOUNDARY = re.compile(r'//[^\n]*|/\*.*?\*/|/\*|"[^"\n]*"|#define\b|#include\b', re.S)
+DEF_HEADER = re.compile(
+    r'#define\s+(macro|fn|constant|table|function|event|error|jumptable(?:__packed)?)\s+([a-zA-Z_][a-zA-Z0-9_]*)'
+)
+FREE_STORAGE_POINTER_CONST = re.compile(r'#define\s+constant\s+[a-zA-Z_][a-zA-Z0-9_]*\s*=\s*FREE_STORAGE_POINTER\(\)')
+HEADER_KINDS = {
+    'macro': 'macro',
+    'fn': 'macro',
+    'constant': 'const',
+    'table': 'code_table',
+    'function': 'function',
+    'event': 'event',
+    'error': 'error',
+    'jumptable': 'jump_table',
+    'jumptable__packed': 'jump_table'
+}
+
+DefChunk = NamedTuple(
+    'DefChunk',
+    [
+        # Grammar rule of the definition, `None` for includes and unrecognized headers
+        ('name', Optional[str]),
+        ('ident', Optional[str]),
+        ('start', int),
+        ('end', int)
+    ]
+)
+
+
+def split_definitions(s: str) -> Optional[tuple[int, list[DefChunk]]]:
+    '''
+    Splits `s` into its top-level definitions (each including its trailing gap) without lexing
+    them, also returning where the first definition starts. Returns `None` if `s` contains an
+    unterminated block comment, in which case it has to be lexed as a whole.
+    '''
+    starts: list[int] = []
+    for m in DEF_BOUNDARY.finditer(s):
+        token = m.group()
+        if token == '/*':
+            return None
+        if token[0] == '#':
+            starts.append(m.start())
+    chunks: list[DefChunk] = []
+    for start, end in zip(starts, starts[1:] + [len(s)]):
+        if (header := DEF_HEADER.match(s, start)) is not None:
+            chunks.append(DefChunk(HEADER_KINDS[header.group(1)], header.group(2), start, end))
+        else:
+            chunks.append(DefChunk(None, None, start, end))
+    return (starts[0] if starts else len(s)), chunks
@@ -0,0 +1,597 @@
+'''
+Language server (`huffy lsp`) speaking JSON-RPC over stdio.
+
+The server keeps a symbol index over every file reachable through includes from the opened
+documents. Each file is parsed with `py_huff.incremental`, so an edit only re-lexes the touched
+definitions; symbols and references are extracted per definition and cached by node, so only the
+re-lexed definitions are rescanned. Queries are dictionary lookups plus a binary search over the
+sorted symbol positions of a file.
+
+Offsets are counted in code points, editors sending UTF-16 positions only differ for non-ASCII text.
+'''
+from typing import NamedTuple, Optional, BinaryIO, Any
+from bisect import bisect_right
+from urllib.parse import urlparse, unquote, quote
+import json
+import sys
+from parsimonious.exceptions import ParseError
+from .assembler import assemble, to_start_mark, to_end_mark
+from .evm_version import DEFAULT_EVM_VERSION
+from .codegen import (
+    BUILT_INS, CompileOptions, ConstructorData, Scope, expand_macro_to_asm, gen_code_tables
+)
+from .compile import build_global_scope, idefs_to_defs
+from .context import ContextTracker
+from .incremental import IncrementalDef, IncrementalTree, TextEdit, apply_edit, parse_incremental
+from .node import ExNode
+from .opcodes import OP_MAP, op
+from .parser import function_to_sig, error_to_sig, event_to_sig, get_ident
+from .resolver import resolve_definitions, include_paths
+from .sources import SourceProvider, OverlaySource, DISK_SOURCE
+from .utils import sig_hash
+
+Json = Any
+
+DEF_KINDS = {
+    'macro': 'macro',
+    'const': 'constant',
+    'code_table': 'table',
+    'function': 'function',
+    'event': 'event',
+    'error': 'error',
+    'jump_table': 'table'
+}
+
+# Kinds a reference may resolve to, depending on where it appears
+REF_KINDS = {
+    'invocation': ('macro',),
+    'constant': ('constant',),
+    'label': ('label',),
+    'builtin_arg': ('label', 'function', 'event', 'error', 'table')
+}
+
+ENTRY_MACROS = ('MAIN', 'CONSTRUCTOR')
+
+# LSP diagnostic severities
+ERROR = 1
+WARNING = 2
+
+Symbol = NamedTuple(
+    'Symbol',
+    [
+        ('name', str),
+        ('kind', str),
+        ('path', str),
+        ('start', int),
+        ('end', int),
+        # Macro a label is defined in
+        ('container', Optional[str]),
+        ('detail', str)
+    ]
+)
+
+Reference = NamedTuple(
+    'Reference',
+    [
+        ('name', str),
+        ('ref_kind', str),
+        ('path', str),
+        ('start', int),
+        ('end', int),
+        ('container', Optional[str])
+    ]
+)
+
+Diagnostic = NamedTuple(
+    'Diagnostic',
+    [
+        ('start', int),
+        ('end', int),
+        ('severity', int),
+        ('message', str)
+    ]
+)
+
+
+def def_detail(node: ExNode) -> str:
+    kind = node.name
+    if kind == 'macro':
+        params = ', '.join(
+            ident.text()
+            for ident in node.get('params').get_all_deep('identifier')
+        )
+        takes, returns = (num.text() for num in node.get('macro_returns_takes').get_all('num'))
+        return f'#define macro {get_ident(node)}({params}) = takes({takes}) returns({returns})'
+    if kind == 'function':
+        sig = function_to_sig(node)
+        return f'function {sig}\nselector: 0x{sig_hash(sig)[:4].hex()}'
+    if kind == 'error':
+        sig = error_to_sig(node)
+        return f'error {sig}\nselector: 0x{sig_hash(sig)[:4].hex()}'
+    if kind == 'event':
+        sig = event_to_sig(node)
+        return f'event {sig}\ntopic: 0x{sig_hash(sig).hex()}'
+    if kind == 'const':
+        value = node.children()[-1]
+        return f'#define constant {get_ident(node)} = {node_text(value)}'
+    return f'#define table {get_ident(node)}'
+
+
+def node_text(node: ExNode) -> str:
+    if isinstance(node.content, str):
+        return node.content
+    return ''.join(node_text(child) for child in node.children())
+
+
+def scan_body(
+    node: ExNode,
+    macro: str,
+    parent: str,
+    labels: list[Symbol],
+    refs: list[Reference]
+):
+    '''Collects label definitions and references in a macro body, paths are filled in later'''
+    if isinstance(node.content, str):
+        if node.name != 'identifier':
+            return
+        name = node.content
+        if parent == 'dest_definition':
+            labels.append(Symbol(name, 'label', '', node.start, node.end, macro, f'label in {macro}'))
+        elif parent == 'invocation':
+            if name not in BUILT_INS:
+                refs.append(Reference(name, 'invocation', '', node.start, node.end, macro))
+        elif parent == 'const_ref':
+            refs.append(Reference(name, 'constant', '', node.start, node.end, macro))
+        elif parent == 'call_arg':
+            if name not in OP_MAP:
+                refs.append(Reference(name, 'builtin_arg', '', node.start, node.end, macro))
+        elif parent == 'macro_body_el' and name not in OP_MAP:
+            refs.append(Reference(name, 'label', '', node.start, node.end, macro))
+        return
+    if node.name == 'macro_arg':
+        return
+    for i, child in enumerate(node.children()):
+        # Only the first identifier of an invocation names the invoked macro
+        child_parent = node.name if node.name != 'invocation' or i == 0 else ''
+        scan_body(child, macro, child_parent, labels, refs)
+
+
+def scan_def(node: ExNode) -> tuple[list[Symbol], list[Reference]]:
+    '''Symbols and references of a top-level definition, offsets relative to the lexed text'''
+    inner = node.get_idx(0)
+    if (kind := DEF_KINDS.get(inner.name)) is None:
+        return [], []
+    ident_node = inner.get('identifier')
+    name = ident_node.text()
+    symbols = [Symbol(name, kind, '', ident_node.start, ident_node.end, None, def_detail(inner))]
+    refs: list[Reference] = []
+    if inner.name == 'macro' and (body := inner.maybe_get('macro_body')) is not None:
+        scan_body(body, name, 'macro_body', symbols, refs)
+    return symbols, refs
+
+
+FileIndex = NamedTuple(
+    'FileIndex',
+    [
+        ('path', str),
+        ('text', str),
+        # `None` if the latest text failed to parse, symbols are then kept from the last good parse
+        ('tree', Optional[IncrementalTree]),
+        ('line_starts', list[int]),
+        # Sorted by start offset
+        ('symbols', list[Symbol]),
+        ('refs', list[Reference]),
+        ('symbol_starts', list[int]),
+        ('ref_starts', list[int]),
+        ('includes', list[str]),
+        ('error', Optional[Diagnostic])
+    ]
+)
+
+
+def get_line_starts(text: str) -> list[int]:
+    starts = [0]
+    i = text.find('\n')
+    while i != -1:
+        starts.append(i + 1)
+        i = text.find('\n', i + 1)
+    return starts
+
+
+def to_offset(f: FileIndex, pos: Json) -> int:
+    line = min(pos['line'], len(f.line_starts) - 1)
+    return min(f.line_starts[line] + pos['character'], len(f.text))
+
+
+def to_position(f: FileIndex, offset: int) -> Json:
+    line = bisect_right(f.line_starts, offset) - 1
+    return {'line': line, 'character': offset - f.line_starts[line]}
+
+
+def path_to_uri(path: str) -> str:
+    return f'file://{quote(path)}'
+
+
+def uri_to_path(uri: str) -> str:
+    return unquote(urlparse(uri).path)
+
+
+class ProjectIndex:
+    '''Cross-file symbol index, updated one file at a time'''
+
+    def __init__(self, source: SourceProvider = DISK_SOURCE):
+        self.source = OverlaySource(source)
+        self.files: dict[str, FileIndex] = {}
+        self.definitions: dict[str, list[Symbol]] = {}
+        self.references: dict[str, list[Reference]] = {}
+        # Per definition node scan results, reused while the node is kept by incremental parsing
+        self.scans: dict[int, tuple[ExNode, list[Symbol], list[Reference]]] = {}
+        self.version = 0
+        self.size_cache: dict[tuple[str, str], int] = {}
+
+    def scan(self, d: IncrementalDef) -> tuple[list[Symbol], list[Reference]]:
+        key = id(d.node)
+        if (cached := self.scans.get(key)) is None or cached[0] is not d.node:
+            cached = (d.node, *scan_def(d.node))
+            self.scans[key] = cached
+        return cached[1], cached[2]
+
+    def set_text(self, path: str, text: str, edits: Optional[list[TextEdit]] = None):
+        '''Updates a file from its full new `text`, `edits` (if given) lead from the old to the new text'''
+        path = self.source.normalize(path)
+        self.source.files[path] = text
+        old = self.files.get(path)
+        tree: Optional[IncrementalTree] = None
+        error: Optional[Diagnostic] = None
+        try:
+            if old is not None and old.tree is not None and edits is not None:
+                tree = old.tree
+                for edit in edits:
+                    tree = apply_edit(tree, edit)
+            else:
+                tree = parse_incremental(text)
+        except ParseError as err:
+            error = Diagnostic(err.pos, err.pos, ERROR, f'Parse error: {err}')
+        except AssertionError as err:
+            error = Diagnostic(0, 0, ERROR, str(err))
+        self.update(path, text, tree, error)
+
+    def update(self, path: str, text: str, tree: Optional[IncrementalTree], error: Optional[Diagnostic]):
+        old = self.files.get(path)
+        if tree is None:
+            symbols = [] if old is None else old.symbols
+            refs = [] if old is None else old.refs
+            includes = [] if old is None else old.includes
+        else:
+            symbols, refs = [], []
+            for d in tree.defs:
+                def_symbols, def_refs = self.scan(d)
+                symbols.extend(s._replace(path=path, start=s.start + d.shift, end=s.end + d.shift) for s in def_symbols)
+                refs.extend(r._replace(path=path, start=r.start + d.shift, end=r.end + d.shift) for r in def_refs)
+            # Only the include definitions are needed to resolve the included paths
+            includes = include_paths(
+                ExNode('program', [d.node for d in tree.defs if d.node.get_idx(0).name == 'include'], 0, 0),
+                path,
+                self.source
+            )
+        if old is not None:
+            self.unregister(old)
+        new = FileIndex(
+            path, text, tree, get_line_starts(text), symbols, refs,
+            [s.start for s in symbols], [r.start for r in refs], includes, error
+        )
+        self.files[path] = new
+        self.register(new)
+        self.version += 1
+        self.size_cache.clear()
+        for include in includes:
+            if include not in self.files:
+                self.load(include)
+        if tree is not None:
+            live = {id(d.node) for f in self.files.values() if f.tree is not None for d in f.tree.defs}
+            if len(self.scans) > 2 * len(live):
+                self.scans = {key: value for key, value in self.scans.items() if key in live}
+
+    def load(self, path: str):
+        try:
+            text = self.source.read_text(path)
+        except OSError as err:
+            self.files[path] = FileIndex(path, '', None, [0], [], [], [], [], [], Diagnostic(0, 0, ERROR, str(err)))
+            return
+        self.set_text(path, text)
+
+    def register(self, f: FileIndex):
+        for s in f.symbols:
+            self.definitions.setdefault(s.name, []).append(s)
+        for r in f.refs:
+            self.references.setdefault(r.name, []).append(r)
+
+    def unregister(self, f: FileIndex):
+        for name in {s.name for s in f.symbols}:
+            remaining = [s for s in self.definitions[name] if s.path != f.path]
+            if remaining:
+                self.definitions[name] = remaining
+            else:
+                del self.definitions[name]
+        for name in {r.name for r in f.refs}:
+            remaining_refs = [r for r in self.references[name] if r.path != f.path]
+            if remaining_refs:
+                self.references[name] = remaining_refs
+            else:
+                del self.references[name]
+
+    def resolve_ref(self, ref: Reference) -> list[Symbol]:
+        kinds = REF_KINDS[ref.ref_kind]
+        candidates = [s for s in self.definitions.get(ref.name, []) if s.kind in kinds]
+        labels = [
+            s for s in candidates
+            if s.kind == 'label' and s.path == ref.path and s.container == ref.container
+        ]
+        if labels:
+            return labels
+        if ref.name.startswith('global_'):
+            return [s for s in candidates if s.kind == 'label'] or \
+                [s for s in candidates if s.kind != 'label']
+        return [s for s in candidates if s.kind != 'label']
+
+    def symbol_at(self, path: str, offset: int) -> Optional[Symbol | Reference]:
+        '''The symbol definition or reference covering `offset` in the file at `path`'''
+        f = self.files.get(self.source.normalize(path))
+        if f is None:
+            return None
+        for entries, starts in ((f.refs, f.ref_starts), (f.symbols, f.symbol_starts)):
+            i = bisect_right(starts, offset) - 1
+            if i >= 0 and offset <= entries[i].end:
+                return entries[i]
+        return None
+
+    def definitions_of(self, entry: Symbol | Reference) -> list[Symbol]:
+        if isinstance(entry, Symbol):
+            return [entry]
+        return self.resolve_ref(entry)
+
+    def references_to(self, symbol: Symbol) -> list[Reference]:
+        return [r for r in self.references.get(symbol.name, []) if symbol in self.resolve_ref(r)]
+
+    def expanded_size(self, symbol: Symbol) -> int:
+        '''Byte size of the macro's expansion (tables excluded), parameters are taken to be `PUSH0`'''
+        key = (symbol.path, symbol.name)
+        if (cached := self.size_cache.get(key)) is not None:
+            return cached
+        context = ContextTracker(tuple())
+        g, _ = build_global_scope(
+            idefs_to_defs(resolve_definitions(symbol.path, source=self.source)),
+            {},
+            context,
+            DEFAULT_EVM_VERSION,
+            self.source,
+            entry_points=(symbol.name,)
+        )
+        runtime = context.next_obj_id()
+        scope = Scope(g, ConstructorData(runtime))
+        macro = scope.get_macro(symbol.name)
+        asm = expand_macro_to_asm(
+            CompileOptions(DEFAULT_EVM_VERSION),
+            symbol.name,
+            scope,
+            [op('push0')] * len(macro.params),
+            {},
+            context.next_sub_context(),
+            tuple()
+        )
+        asm.extend([to_start_mark(runtime), to_end_mark(runtime)])
+        asm.extend(gen_code_tables(scope.unique_referenced_tables()))
+        _, offsets = assemble(asm)
+        self.size_cache[key] = size = offsets[to_start_mark(runtime).mid]
+        return size
+
+    def diagnostics(self, path: str) -> list[Diagnostic]:
+        f = self.files[self.source.normalize(path)]
+        diags: list[Diagnostic] = [] if f.error is None else [f.error]
+        for s in f.symbols:
+            duplicates = [
+                other for other in self.definitions[s.name]
+                if other.kind == s.kind and (s.kind != 'label' or
+                                             (other.path, other.container) == (s.path, s.container))
+            ]
+            if len(duplicates) > 1:
+                diags.append(Diagnostic(s.start, s.end, ERROR, f'Duplicate {s.kind} "{s.name}"'))
+            elif s.kind == 'macro' and s.name not in ENTRY_MACROS and not self.references_to(s):
+                diags.append(Diagnostic(s.start, s.end, WARNING, f'Unused macro "{s.name}"'))
+        for r in f.refs:
+            if not self.resolve_ref(r):
+                kinds = ' / '.join(REF_KINDS[r.ref_kind])
+                diags.append(Diagnostic(r.start, r.end, ERROR, f'Undefined {kinds} "{r.name}"'))
+        return diags
+
+
+class LanguageServer:
+    def __init__(self, source: SourceProvider = DISK_SOURCE):
+        self.index = ProjectIndex(source)
+        self.open_docs: set[str] = set()
+        self.shutdown_requested = False
+        self.exited = False
+
+    def handle(self, msg: Json) -> list[Json]:
+        '''Handles one incoming message, returning the messages to send back'''
+        method = msg.get('method')
+        params = msg.get('params', {})
+        handler = getattr(self, 'on_' + (method or '').replace('/', '_').replace('$', ''), None)
+        if handler is None:
+            if 'id' in msg and method is not None:
+                return [{'jsonrpc': '2.0', 'id': msg['id'], 'error': {'code': -32601, 'message': f'Unknown method {method}'}}]
+            return []
+        try:
+            result, notifications = handler(params)
+        except Exception as err:
+            if 'id' not in msg:
+                return []
+            return [{'jsonrpc': '2.0', 'id': msg['id'], 'error': {'code': -32603, 'message': f'{type(err).__name__}: {err}'}}]
+        if 'id' in msg:
+            return [{'jsonrpc': '2.0', 'id': msg['id'], 'result': result}, *notifications]
+        return notifications
+
+    def on_initialize(self, _):
+        return {
+            'capabilities': {
+                # Incremental text document sync
+                'textDocumentSync': {'openClose': True, 'change': 2},
+                'definitionProvider': True,
+                'referencesProvider': True,
+                'hoverProvider': True
+            },
+            'serverInfo': {'name': 'huffy'}
+        }, []
+
+    def on_initialized(self, _):
+        return None, []
+
+    def on_shutdown(self, _):
+        self.shutdown_requested = True
+        return None, []
+
+    def on_exit(self, _):
+        self.exited = True
+        return None, []
+
+    def on_textDocument_didOpen(self, params):
+        doc = params['textDocument']
+        path = self.index.source.normalize(uri_to_path(doc['uri']))
+        self.open_docs.add(path)
+        self.index.set_text(path, doc['text'])
+        return None, self.publish_diagnostics()
+
+    def on_textDocument_didChange(self, params):
+        path = self.index.source.normalize(uri_to_path(params['textDocument']['uri']))
+        f = self.index.files[path]
+        text = f.text
+        edits: Optional[list[TextEdit]] = []
+        for change in params['contentChanges']:
+            if 'range' not in change:
+                text, edits = change['text'], None
+                continue
+            # Positions refer to the text with all previous changes applied
+            current = f._replace(text=text, line_starts=get_line_starts(text))
+            start = to_offset(current, change['range']['start'])
+            end = to_offset(current, change['range']['end'])
+            if edits is not None:
+                edits.append(TextEdit(start, end, change['text']))
+            text = text[:start] + change['text'] + text[end:]
+        self.index.set_text(path, text, edits)
+        return None, self.publish_diagnostics()
+
+    def on_textDocument_didClose(self, params):
+        path = self.index.source.normalize(uri_to_path(params['textDocument']['uri']))
+        self.open_docs.discard(path)
+        return None, []
+
+    def on_textDocument_definition(self, params):
+        entry, _ = self.entry_at(params)
+        if entry is None:
+            return [], []
+        return [self.location(s.path, s.start, s.end) for s in self.index.definitions_of(entry)], []
+
+    def on_textDocument_references(self, params):
+        entry, _ = self.entry_at(params)
+        if entry is None:
+            return [], []
+        include_decl = params.get('context', {}).get('includeDeclaration', False)
+        locations = []
+        for symbol in self.index.definitions_of(entry):
+            if include_decl:
+                locations.append(self.location(symbol.path, symbol.start, symbol.end))
+            locations.extend(
+                self.location(r.path, r.start, r.end)
+                for r in self.index.references_to(symbol)
+            )
+        return locations, []
+
+    def on_textDocument_hover(self, params):
+        entry, _ = self.entry_at(params)
+        if entry is None:
+            return None, []
+        symbols = self.index.definitions_of(entry)
+        if not symbols:
+            return None, []
+        symbol = symbols[0]
+        text = symbol.detail
+        if symbol.kind == 'macro':
+            try:
+                size = self.index.expanded_size(symbol)
+                text += f'\nexpanded size: {size} bytes'
+            except (AssertionError, ValueError, KeyError, ParseError) as err:
+                text += f'\nexpanded size: unavailable ({err})'
+        return {'contents': {'kind': 'plaintext', 'value': text}}, []
+
+    def entry_at(self, params) -> tuple[Optional[Symbol | Reference], str]:
+        path = self.index.source.normalize(uri_to_path(params['textDocument']['uri']))
+        f = self.index.files.get(path)
+        if f is None:
+            return None, path
+        return self.index.symbol_at(path, to_offset(f, params['position'])), path
+
+    def location(self, path: str, start: int, end: int) -> Json:
+        f = self.index.files[path]
+        return {
+            'uri': path_to_uri(path),
+            'range': {'start': to_position(f, start), 'end': to_position(f, end)}
+        }
+
+    def publish_diagnostics(self) -> list[Json]:
+        notifications = []
+        for path in sorted(self.open_docs):
+            f = self.index.files[path]
+            notifications.append({
+                'jsonrpc': '2.0',
+                'method': 'textDocument/publishDiagnostics',
+                'params': {
+                    'uri': path_to_uri(path),
+                    'diagnostics': [
+                        {
+                            'range': {'start': to_position(f, d.start), 'end': to_position(f, d.end)},
+                            'severity': d.severity,
+                            'source': 'huffy',
+                            'message': d.message
+                        }
+                        for d in self.index.diagnostics(path)
+                    ]
+                }
+            })
+        return notifications
+
+
+def read_message(stream: BinaryIO) -> Optional[Json]:
+    '''Reads one `Content-Length` framed JSON-RPC message, `None` at the end of the stream'''
+    length: Optional[int] = None
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            break
+        name, _, value = line.decode('ascii').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value.strip())
+    assert length is not None, 'Message without Content-Length header'
+    return json.loads(stream.read(length).decode('utf-8'))
+
+
+def write_message(stream: BinaryIO, msg: Json):
+    body = json.dumps(msg, separators=(',', ':')).encode('utf-8')
+    stream.write(f'Content-Length: {len(body)}\r\n\r\n'.encode('ascii'))
+    stream.write(body)
+    stream.flush()
+
+
+def serve(stdin: BinaryIO, stdout: BinaryIO, source: SourceProvider = DISK_SOURCE) -> int:
+    server = LanguageServer(source)
+    while not server.exited and (msg := read_message(stdin)) is not None:
+        for out in server.handle(msg):
+            write_message(stdout, out)
+    return 0 if server.shutdown_requested else 1
+
+
+def main(argv: Optional[list[str]] = None):
+    assert not argv, f'Unexpected arguments for lsp: {argv}'
+    sys.exit(serve(sys.stdin.buffer, sys.stdout.buffer))
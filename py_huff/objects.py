@@ -0,0 +1,298 @@
+'''
+Relocatable object files for Huff libraries.
+
+`compile_object` parses a library once and expands each of its macros into relocatable asm (see
+`py_huff.relocation`): labels, macro arguments, constants, code tables and `global_` labels of the
+invoking macro stay symbolic. Programs link objects by passing them to `compile(objects=...)`,
+invocations of object macros are then instantiated directly from the pre-expanded asm, skipping
+lexing, parsing and expansion of the library.
+
+Object macros must be self-contained: they can only invoke macros and reference constants, code
+tables, functions, events and errors defined within the library.
+'''
+from typing import Generator, Optional
+import json
+from .assembler import Asm, Mark, MarkRef, MarkDeltaRef, MarkOffset, MarkId, MarkPurpose, DATA_TYPES
+from .codegen import CodeTable, CompileOptions, ConstructorData, GlobalScope, MacroArg, Scope, expand_macro_to_asm
+from .compile import build_global_scope, def_constant, def_ident, idefs_to_defs
+from .context import ContextTracker, ObjectId
+from .evm_version import EvmTarget, validate_evm_version
+from .expansion import check_expansion
+from .lexer import lex_huff_cached
+from .node import ExNode
+from .opcodes import Op
+from .parser import Identifier, Json, Macro, MacroParam, ConstRef, GeneralRef, Invocation, get_includes
+from .relocation import (
+    HuffObject, ObjectMacro, ObjectAsm, Symbol, SymbolicMarkId, SymbolicMark, SymbolicMarkRef,
+    SymbolicMarkDeltaRef, SYMBOL_KINDS
+)
+from .resolver import include_paths, with_absolute_table_path
+from .sources import SourceProvider, DISK_SOURCE
+from .utils import keccak256
+
+OBJECT_FORMAT = 'py-huff-object'
+OBJECT_FORMAT_VERSION = 2
+
+# Definitions stored as source in the object
+SOURCE_DEFINITIONS = frozenset({'function', 'event', 'error'})
+
+
+class ObjectScope(Scope):
+    '''
+    Scope for pre-expanding library macros, constants are referenced by placeholder marks that
+    `to_relocatable` turns back into `ConstRef`s
+    '''
+
+    def __init__(self, g: GlobalScope, for_constructor: ConstructorData, constants: dict[Identifier, MarkRef]):
+        super().__init__(g, for_constructor)
+        self.constants = constants
+
+    def get_constant(self, ident: Identifier) -> MacroArg:
+        super().get_constant(ident)
+        return self.constants[ident]
+
+    def add_generated_table(self, name: str, data: tuple[Asm, ...], obj_id: ObjectId) -> CodeTable:
+        assert False, f'{name}: Generated tables are not supported in library objects'
+
+
+def library_files(
+    fp: str,
+    source: SourceProvider = DISK_SOURCE,
+    visited_paths: tuple[str, ...] = tuple(),
+    already_resolved: Optional[set[str]] = None
+) -> Generator[tuple[str, str, ExNode], None, None]:
+    '''Path, text and lexed root of `fp` and the files it includes, included files first'''
+    if already_resolved is None:
+        already_resolved = set()
+    fp = source.normalize(fp)
+    if fp in already_resolved:
+        return
+    already_resolved.add(fp)
+    assert fp not in visited_paths, f'Circular include in {fp}'
+    text = source.read_text(fp)
+    root = lex_huff_cached(text)
+    for include_fp in include_paths(root, fp, source):
+        yield from library_files(include_fp, source, visited_paths + (fp,), already_resolved)
+    yield fp, text, root
+
+
+def referenced_global_labels(macros: dict[Identifier, Macro]) -> list[Identifier]:
+    labels: dict[Identifier, None] = {}
+    for macro in macros.values():
+        for el in macro.body:
+            refs = el.args if isinstance(el, Invocation) else [el]
+            for ref in refs:
+                if isinstance(ref, GeneralRef) and ref.ident.startswith('global_'):
+                    labels[ref.ident] = None
+    return list(labels)
+
+
+def compile_object(
+    entry_fp: str,
+    evm_version: EvmTarget,
+    source: SourceProvider = DISK_SOURCE
+) -> HuffObject:
+    '''Compiles the library at `entry_fp` and its includes into a relocatable object'''
+    version = validate_evm_version(evm_version)
+    nodes: list[ExNode] = []
+    definitions: list[str] = []
+    hashed_sources: list[bytes] = []
+    for fp, text, root in library_files(entry_fp, source):
+        hashed_sources.append(keccak256(text.encode()))
+        for d in get_includes(root)[1]:
+            nodes.append(with_absolute_table_path(d, fp, source))
+            if d.name in SOURCE_DEFINITIONS:
+                definitions.append(text[d.start:d.end])
+    defs = idefs_to_defs(nodes)
+
+    context = ContextTracker(tuple())
+    g, _ = build_global_scope(defs, {}, context, version, source, entry_points=(), strict=True)
+
+    # Symbols are bound to object IDs of the root context, expansions only use sub-contexts
+    symbols: dict[ObjectId, Symbol] = {
+        table.obj_id: Symbol('table', ident)
+        for ident, table in reversed(g.code_tables.items())
+    }
+    external_labels: dict[Identifier, MarkId] = {}
+    for label in referenced_global_labels(g.macros):
+        obj_id = context.next_obj_id()
+        symbols[obj_id] = Symbol('label', label)
+        external_labels[label] = MarkId(obj_id, MarkPurpose.Label)
+    runtime_id = context.next_obj_id()
+    symbols[runtime_id] = Symbol('runtime', 0)
+    # Parameters and constants are expanded as references to placeholder marks
+    placeholders: dict[ObjectId, MacroParam | ConstRef] = {}
+
+    def placeholder(unbound: MacroParam | ConstRef) -> MarkRef:
+        obj_id = context.next_obj_id()
+        placeholders[obj_id] = unbound
+        return MarkRef(MarkId(obj_id, MarkPurpose.Start))
+    constants = {ident: placeholder(ConstRef(ident)) for ident in g.constants}
+
+    coptions = CompileOptions(version)
+    macros: dict[Identifier, ObjectMacro] = {}
+    for ident, macro in g.macros.items():
+        check_expansion(ident, g.macros, g.object_macros)
+        scope = ObjectScope(g, ConstructorData(runtime_id), constants)
+        asm = expand_macro_to_asm(
+            coptions,
+            ident,
+            scope,
+            [placeholder(MacroParam(param)) for param in macro.params],
+            dict(external_labels),
+            context.next_sub_context(),
+            tuple()
+        )
+        macros[ident] = ObjectMacro(ident, macro.params, to_relocatable(asm, symbols, placeholders))
+
+    return HuffObject(
+        evm_version=version,
+        macros=macros,
+        constants={def_ident(d): def_constant(d, source) for d in defs['const']},
+        code_tables={ident: bytes(table.data) for ident, table in g.code_tables.items()},
+        definitions='\n'.join(definitions),
+        source_hash=keccak256(b''.join(hashed_sources))
+    )
+
+
+def to_relocatable(
+    asm: list[Asm],
+    symbols: dict[ObjectId, Symbol],
+    placeholders: dict[ObjectId, MacroParam | ConstRef]
+) -> list[ObjectAsm]:
+    '''
+    Replaces the object IDs of an expansion by symbols, unknown IDs become numbered locals.
+    References to `placeholders` are replaced by the parameter or constant they stand for.
+    '''
+    local_symbols: dict[ObjectId, Symbol] = {}
+
+    def to_symbolic(mid: MarkId) -> SymbolicMarkId:
+        if (symbol := symbols.get(mid.obj_id)) is None:
+            if (symbol := local_symbols.get(mid.obj_id)) is None:
+                local_symbols[mid.obj_id] = symbol = Symbol('local', len(local_symbols))
+        return SymbolicMarkId(symbol, mid.purpose)
+
+    relocatable: list[ObjectAsm] = []
+    for step in asm:
+        if isinstance(step, Mark):
+            relocatable.append(SymbolicMark(to_symbolic(step.mid)))
+        elif isinstance(step, MarkRef):
+            if (unbound := placeholders.get(step.mid.obj_id)) is not None:
+                relocatable.append(unbound)
+            else:
+                relocatable.append(SymbolicMarkRef(to_symbolic(step.mid)))
+        elif isinstance(step, MarkDeltaRef):
+            relocatable.append(SymbolicMarkDeltaRef(to_symbolic(step.start), to_symbolic(step.end)))
+        elif isinstance(step, MarkOffset):
+            raise TypeError(f'Unexpected mark offset {step} in library object')
+        else:
+            relocatable.append(step)
+    return relocatable
+
+
+def symbolic_mark_id_to_json(mid: SymbolicMarkId) -> Json:
+    return [mid.symbol.kind, mid.symbol.key, mid.purpose.value]
+
+
+def symbolic_mark_id_from_json(data: Json) -> SymbolicMarkId:
+    assert isinstance(data, list) and len(data) == 3, f'Invalid symbol {data}'
+    kind_name, key, purpose = data
+    kinds = [kind for kind in SYMBOL_KINDS if kind == kind_name]
+    assert kinds and isinstance(key, (str, int)) and isinstance(purpose, str), f'Invalid symbol {data}'
+    return SymbolicMarkId(Symbol(kinds[0], key), MarkPurpose(purpose))
+
+
+def step_to_json(step: ObjectAsm) -> Json:
+    if isinstance(step, Op):
+        return bytes(step.get_bytes()).hex()
+    if isinstance(step, MacroParam):
+        return ['param', step.ident]
+    if isinstance(step, ConstRef):
+        return ['const', step.ident]
+    if isinstance(step, SymbolicMark):
+        return ['mark', symbolic_mark_id_to_json(step.mid)]
+    if isinstance(step, SymbolicMarkRef):
+        return ['ref', symbolic_mark_id_to_json(step.mid)]
+    if isinstance(step, SymbolicMarkDeltaRef):
+        return ['delta', symbolic_mark_id_to_json(step.start), symbolic_mark_id_to_json(step.end)]
+    if isinstance(step, DATA_TYPES):
+        return ['data', bytes(step).hex()]
+    raise TypeError(f'Unrecognized relocatable asm {step}')
+
+
+def step_from_json(data: Json) -> ObjectAsm:
+    if isinstance(data, str):
+        code = bytes.fromhex(data)
+        return Op(code[0], code[1:])
+    assert isinstance(data, list) and data, f'Invalid relocatable asm {data}'
+    kind, *args = data
+    if kind == 'mark':
+        return SymbolicMark(symbolic_mark_id_from_json(args[0]))
+    if kind == 'ref':
+        return SymbolicMarkRef(symbolic_mark_id_from_json(args[0]))
+    if kind == 'delta':
+        return SymbolicMarkDeltaRef(
+            symbolic_mark_id_from_json(args[0]),
+            symbolic_mark_id_from_json(args[1])
+        )
+    value = args[0]
+    assert isinstance(value, str), f'Invalid relocatable asm {data}'
+    if kind == 'param':
+        return MacroParam(value)
+    if kind == 'const':
+        return ConstRef(value)
+    if kind == 'data':
+        return bytes.fromhex(value)
+    raise ValueError(f'Unrecognized relocatable asm kind "{kind}"')
+
+
+def object_to_json(obj: HuffObject) -> dict[str, Json]:
+    return {
+        'format': OBJECT_FORMAT,
+        'version': OBJECT_FORMAT_VERSION,
+        'evmVersion': obj.evm_version,
+        'sourceHash': f'0x{obj.source_hash.hex()}',
+        'constants': {
+            ident: None if value is None else f'0x{value.hex()}'
+            for ident, value in obj.constants.items()
+        },
+        'codeTables': {ident: f'0x{data.hex()}' for ident, data in obj.code_tables.items()},
+        'definitions': obj.definitions,
+        'macros': {
+            ident: {
+                'params': macro.params,
+                'asm': [step_to_json(step) for step in macro.asm]
+            }
+            for ident, macro in obj.macros.items()
+        }
+    }
+
+
+def object_from_json(data: dict) -> HuffObject:
+    assert data.get('format') == OBJECT_FORMAT, 'Not a py-huff object'
+    assert data.get('version') == OBJECT_FORMAT_VERSION, \
+        f'Unsupported object format version {data.get("version")}, expected {OBJECT_FORMAT_VERSION}'
+    return HuffObject(
+        evm_version=validate_evm_version(data['evmVersion']),
+        macros={
+            ident: ObjectMacro(ident, macro['params'], [step_from_json(step) for step in macro['asm']])
+            for ident, macro in data['macros'].items()
+        },
+        constants={
+            ident: None if value is None else bytes.fromhex(value[2:])
+            for ident, value in data['constants'].items()
+        },
+        code_tables={ident: bytes.fromhex(value[2:]) for ident, value in data['codeTables'].items()},
+        definitions=data['definitions'],
+        source_hash=bytes.fromhex(data['sourceHash'][2:])
+    )
+
+
+def save_object(obj: HuffObject, fp: str):
+    with open(fp, 'w') as f:
+        json.dump(object_to_json(obj), f, separators=(',', ':'))
+
+
+def load_object(fp: str) -> HuffObject:
+    with open(fp) as f:
+        return object_from_json(json.load(f))
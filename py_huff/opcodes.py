@@ -54,6 +54,8 @@ OP_MAP = {
     'chainid': 0x46,
     'selfbalance': 0x47,
     'basefee': 0x48,
+    'blobhash': 0x49,
+    'blobbasefee': 0x4a,
     'pop': 0x50,
     'mload': 0x51,
     'mstore': 0x52,
@@ -68,6 +70,7 @@ OP_MAP = {
     'jumpdest': 0x5b,
     'tload': 0x5c,
     'tstore': 0x5d,
+    'mcopy': 0x5e,
     'push0': 0x5f,
     'push1': 0x60,
     'push2': 0x61,
@@ -151,6 +154,78 @@ OP_MAP = {
 }
 
 
+def _stack_io() -> dict[int, tuple[int, int]]:
+    io: dict[str, tuple[int, int]] = {
+        'stop': (0, 0), 'add': (2, 1), 'mul': (2, 1), 'sub': (2, 1), 'div': (2, 1), 'sdiv': (2, 1),
+        'mod': (2, 1), 'smod': (2, 1), 'addmod': (3, 1), 'mulmod': (3, 1), 'exp': (2, 1),
+        'signextend': (2, 1), 'lt': (2, 1), 'gt': (2, 1), 'slt': (2, 1), 'sgt': (2, 1), 'eq': (2, 1),
+        'iszero': (1, 1), 'and': (2, 1), 'or': (2, 1), 'xor': (2, 1), 'not': (1, 1), 'byte': (2, 1),
+        'shl': (2, 1), 'shr': (2, 1), 'sar': (2, 1), 'sha3': (2, 1), 'address': (0, 1),
+        'balance': (1, 1), 'origin': (0, 1), 'caller': (0, 1), 'callvalue': (0, 1),
+        'calldataload': (1, 1), 'calldatasize': (0, 1), 'calldatacopy': (3, 0), 'codesize': (0, 1),
+        'codecopy': (3, 0), 'gasprice': (0, 1), 'extcodesize': (1, 1), 'extcodecopy': (4, 0),
+        'returndatasize': (0, 1), 'returndatacopy': (3, 0), 'extcodehash': (1, 1),
+        'blockhash': (1, 1), 'coinbase': (0, 1), 'timestamp': (0, 1), 'number': (0, 1),
+        'prevrandao': (0, 1), 'gaslimit': (0, 1), 'chainid': (0, 1), 'selfbalance': (0, 1),
+        'basefee': (0, 1), 'blobhash': (1, 1), 'blobbasefee': (0, 1), 'pop': (1, 0),
+        'mload': (1, 1), 'mstore': (2, 0), 'mstore8': (2, 0),
+        'sload': (1, 1), 'sstore': (2, 0), 'jump': (1, 0), 'jumpi': (2, 0), 'pc': (0, 1),
+        'msize': (0, 1), 'gas': (0, 1), 'jumpdest': (0, 0), 'tload': (1, 1), 'tstore': (2, 0),
+        'mcopy': (3, 0), 'push0': (0, 1), 'create': (3, 1), 'call': (7, 1), 'callcode': (7, 1),
+        'return': (2, 0),
+        'delegatecall': (6, 1), 'create2': (4, 1), 'staticcall': (6, 1), 'revert': (2, 0),
+        'invalid': (0, 0), 'selfdestruct': (1, 0)
+    }
+    for n in range(1, 32 + 1):
+        io[f'push{n}'] = (0, 1)
+    for n in range(1, 16 + 1):
+        io[f'dup{n}'] = (n, n + 1)
+        io[f'swap{n}'] = (n + 1, n + 1)
+    for n in range(4 + 1):
+        io[f'log{n}'] = (n + 2, 0)
+    return {OP_MAP[name]: ins_outs for name, ins_outs in io.items()}
+
+
+def _base_gas() -> dict[int, int]:
+    '''Static gas of every opcode, dynamic costs (memory expansion, cold access, etc.) excluded'''
+    gas: dict[int, int] = {op: 3 for op in OP_MAP.values()}
+    for name in ('stop', 'return', 'revert', 'invalid'):
+        gas[OP_MAP[name]] = 0
+    for name in ('address', 'origin', 'caller', 'callvalue', 'calldatasize', 'codesize', 'gasprice',
+                 'returndatasize', 'coinbase', 'timestamp', 'number', 'prevrandao', 'gaslimit',
+                 'chainid', 'basefee', 'blobbasefee', 'pop', 'pc', 'msize', 'gas', 'push0'):
+        gas[OP_MAP[name]] = 2
+    for name in ('mul', 'div', 'sdiv', 'mod', 'smod', 'signextend', 'selfbalance'):
+        gas[OP_MAP[name]] = 5
+    for name in ('addmod', 'mulmod', 'jump'):
+        gas[OP_MAP[name]] = 8
+    for name in ('exp', 'jumpi'):
+        gas[OP_MAP[name]] = 10
+    for name in ('balance', 'extcodesize', 'extcodecopy', 'extcodehash', 'sload', 'sstore', 'tload',
+                 'tstore', 'call', 'callcode', 'delegatecall', 'staticcall'):
+        gas[OP_MAP[name]] = 100
+    for n in range(4 + 1):
+        gas[OP_MAP[f'log{n}']] = 375 * (n + 1)
+    gas[OP_MAP['sha3']] = 30
+    gas[OP_MAP['blockhash']] = 20
+    gas[OP_MAP['jumpdest']] = 1
+    gas[OP_MAP['create']] = 32000
+    gas[OP_MAP['create2']] = 32000
+    gas[OP_MAP['selfdestruct']] = 5000
+    return gas
+
+
+# Stack items consumed and produced by each opcode
+STACK_IO: dict[int, tuple[int, int]] = _stack_io()
+BASE_GAS: dict[int, int] = _base_gas()
+
+# Opcodes after which execution never continues with the next instruction
+TERMINATING_OPS: frozenset[int] = frozenset(
+    OP_MAP[name]
+    for name in ('stop', 'return', 'revert', 'invalid', 'selfdestruct', 'jump')
+)
+
+
 class Op(NamedTuple('Op', [('op', int), ('extra_data', bytes)])):
     def get_bytes(self) -> Generator[int, None, None]:
         yield self.op
@@ -0,0 +1,26 @@
+from typing import NamedTuple, Optional
+import typing
+
+OptimizeMode = typing.Literal['size', 'gas']
+OPTIMIZE_MODES: tuple[OptimizeMode, ...] = ('size', 'gas')
+
+OptimizationNote = NamedTuple(
+    'OptimizationNote',
+    [
+        ('pass_name', str),
+        ('target', str),
+        ('bytes_saved', int),
+        ('extra_gas', int),
+        ('reason', str)
+    ]
+)
+
+
+def validate_optimize_mode(mode: Optional[str]) -> Optional[OptimizeMode]:
+    assert mode is None or mode in OPTIMIZE_MODES, \
+        f'Unknown optimization mode "{mode}", expected one of {", ".join(OPTIMIZE_MODES)}'
+    return mode  # type: ignore
+
+
+def format_note(note: OptimizationNote) -> str:
+    return f'[{note.pass_name}] {note.target}: {note.reason}'
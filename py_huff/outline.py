@@ -0,0 +1,247 @@
+'''
+Size optimization pass that moves repeated, identical macro expansions into a single shared
+subroutine. Every outlined call site is replaced by:
+
+    PUSH <return> PUSH <subroutine> JUMP <return>: JUMPDEST
+
+while the subroutine rotates the return address below its `t` inputs, executes the original
+instructions, rotates the return address above its `r` outputs and jumps back:
+
+    <subroutine>: JUMPDEST SWAPt .. SWAP1 <body> SWAP1 .. SWAPr JUMP
+'''
+from typing import NamedTuple, Optional
+from collections import defaultdict
+from .assembler import (
+    Asm, Mark, MarkId, MarkPurpose, MarkRef, MarkDeltaRef, min_static_size,
+    get_min_static_size_bytes
+)
+from .context import ContextTracker, ObjectId
+from .opcodes import Op, op, STACK_IO, TERMINATING_OPS, OP_MAP
+from .optimize import OptimizationNote
+from .parser import Identifier
+from .utils import s
+
+OutlineCostModel = NamedTuple(
+    'OutlineCostModel',
+    [
+        # Minimum amount of bytes a single outlined fragment has to save
+        ('min_bytes_saved', int),
+        # Maximum extra gas (summed over all call sites) accepted per byte saved
+        ('max_gas_per_byte', float)
+    ]
+)
+
+DEFAULT_OUTLINE_COST_MODEL = OutlineCostModel(min_bytes_saved=1, max_gas_per_byte=5.0)
+
+Fragment = NamedTuple(
+    'Fragment',
+    [
+        ('macro', Identifier),
+        ('start', int),
+        ('end', int),
+        ('body', tuple[Asm, ...])
+    ]
+)
+
+Candidate = NamedTuple(
+    'Candidate',
+    [
+        ('macro', Identifier),
+        ('occurrences', list[Fragment]),
+        ('takes', int),
+        ('returns', int),
+        ('bytes_saved', int),
+        ('extra_gas', int)
+    ]
+)
+
+OUTLINE_BLOCKLIST: frozenset[int] = TERMINATING_OPS | {
+    OP_MAP['jumpi'],
+    OP_MAP['jumpdest'],
+    OP_MAP['pc']
+}
+
+# PUSH ret + PUSH sub + JUMP + JUMPDEST at the call site, JUMPDEST + JUMP in the subroutine
+CALL_GAS = 3 + 3 + 8 + 1 + 1 + 8
+SWAP_GAS = 3
+
+
+def stack_effect(body: tuple[Asm, ...]) -> Optional[tuple[int, int]]:
+    '''Returns the stack inputs & outputs of a straight-line fragment, `None` if it can't be outlined'''
+    height = 0
+    lowest = 0
+    for step in body:
+        if isinstance(step, Op):
+            if step.op in OUTLINE_BLOCKLIST or step.op not in STACK_IO:
+                return None
+            ins, outs = STACK_IO[step.op]
+        elif isinstance(step, (MarkRef, MarkDeltaRef)):
+            ins, outs = 0, 1
+        else:
+            return None
+        lowest = min(lowest, height - ins)
+        height += outs - ins
+    takes = -lowest
+    return takes, height + takes
+
+
+def find_fragments(asm: list[Asm], invocations: dict[ObjectId, Identifier]) -> list[Fragment]:
+    '''Finds all invocation fragments delimited by their start & end marks'''
+    fragments: list[Fragment] = []
+    open_starts: list[tuple[ObjectId, int]] = []
+    for i, step in enumerate(asm):
+        if not isinstance(step, Mark) or step.mid.obj_id not in invocations:
+            continue
+        if step.mid.purpose == MarkPurpose.Start:
+            open_starts.append((step.mid.obj_id, i))
+        elif step.mid.purpose == MarkPurpose.End:
+            obj_id, start = open_starts.pop()
+            assert obj_id == step.mid.obj_id, f'Unbalanced invocation marks at step #{i}'
+            body = tuple(strip_invocation_marks(asm[start + 1:i], invocations))
+            fragments.append(Fragment(invocations[obj_id], start, i, body))
+    assert not open_starts, 'Unbalanced invocation marks'
+    return fragments
+
+
+def strip_invocation_marks(asm: list[Asm], invocations: dict[ObjectId, Identifier]) -> list[Asm]:
+    return [
+        step
+        for step in asm
+        if not (isinstance(step, Mark) and step.mid.obj_id in invocations)
+    ]
+
+
+def evaluate(
+    macro: Identifier,
+    occurrences: list[Fragment],
+    ref_size: int,
+    takes: int,
+    returns: int
+) -> Candidate:
+    body_size = sum(
+        1 + ref_size if isinstance(step, (MarkRef, MarkDeltaRef)) else min_static_size(step)
+        for step in occurrences[0].body
+    )
+    n = len(occurrences)
+    call_site_size = 4 + 2 * ref_size
+    subroutine_size = 2 + takes + body_size + returns
+    bytes_saved = n * body_size - n * call_site_size - subroutine_size
+    extra_gas = CALL_GAS + SWAP_GAS * (takes + returns)
+    return Candidate(macro, occurrences, takes, returns, bytes_saved, extra_gas)
+
+
+def non_overlapping(fragments: list[Fragment], taken: list[int]) -> list[Fragment]:
+    '''Selects fragments that don't overlap already outlined fragments or each other'''
+    selected: list[Fragment] = []
+    last_end = -1
+    for frag in sorted(fragments, key=lambda f: f.start):
+        if frag.start <= last_end:
+            continue
+        if taken[frag.end + 1] - taken[frag.start] > 0:
+            continue
+        selected.append(frag)
+        last_end = frag.end
+    return selected
+
+
+def outline_fragments(
+    asm: list[Asm],
+    invocations: dict[ObjectId, Identifier],
+    ctx: ContextTracker,
+    cost_model: OutlineCostModel = DEFAULT_OUTLINE_COST_MODEL,
+    keep_invocation_marks: bool = False
+) -> tuple[list[Asm], list[OptimizationNote]]:
+    '''
+    Replaces profitable repeated fragments with calls to shared subroutines, returns the new
+    assembly along with a note for every outlined fragment. Invocation marks are removed unless
+    `keep_invocation_marks` is set, outlined call sites then keep the marks of their fragment.
+    '''
+    groups: dict[tuple[Asm, ...], list[Fragment]] = defaultdict(list)
+    effects: dict[tuple[Asm, ...], tuple[int, int]] = {}
+    for frag in find_fragments(asm, invocations):
+        if not frag.body:
+            continue
+        if frag.body not in effects:
+            effect = stack_effect(frag.body)
+            if effect is None or max(effect) > 16:
+                continue
+            effects[frag.body] = effect
+        groups[frag.body].append(frag)
+
+    ref_size = get_min_static_size_bytes(asm)
+    # Prefix sum over outlined steps to cheaply check overlap with already chosen fragments
+    taken_mask = [0] * len(asm)
+    chosen: list[Candidate] = []
+    while True:
+        taken = [0]
+        for t in taken_mask:
+            taken.append(taken[-1] + t)
+        best: Optional[Candidate] = None
+        for body, frags in groups.items():
+            occurrences = non_overlapping(frags, taken)
+            if len(occurrences) < 2:
+                continue
+            cand = evaluate(frags[0].macro, occurrences, ref_size, *effects[body])
+            if cand.bytes_saved < cost_model.min_bytes_saved:
+                continue
+            if cand.extra_gas * len(occurrences) > cost_model.max_gas_per_byte * cand.bytes_saved:
+                continue
+            if best is None or cand.bytes_saved > best.bytes_saved:
+                best = cand
+        if best is None:
+            break
+        chosen.append(best)
+        groups.pop(best.occurrences[0].body)
+        for frag in best.occurrences:
+            for i in range(frag.start, frag.end + 1):
+                taken_mask[i] = 1
+
+    if not chosen:
+        return (asm if keep_invocation_marks else strip_invocation_marks(asm, invocations)), []
+
+    call_sites: dict[int, tuple[int, MarkId]] = {}
+    subroutines: list[Asm] = []
+    notes: list[OptimizationNote] = []
+    for cand in chosen:
+        sub_mid = MarkId(ctx.next_obj_id(), MarkPurpose.Label)
+        for frag in cand.occurrences:
+            call_sites[frag.start] = (frag.end, sub_mid)
+        subroutines.extend([
+            Mark(sub_mid),
+            op('jumpdest'),
+            *(op(f'swap{i}') for i in range(cand.takes, 0, -1)),
+            *cand.occurrences[0].body,
+            *(op(f'swap{i}') for i in range(1, cand.returns + 1)),
+            op('jump')
+        ])
+        n = len(cand.occurrences)
+        notes.append(OptimizationNote(
+            'outline',
+            cand.macro,
+            cand.bytes_saved,
+            cand.extra_gas,
+            f'{n} identical expansion{s(n)} (takes {cand.takes}, returns {cand.returns}) moved into '
+            f'shared subroutine, saving ~{cand.bytes_saved} bytes for +{cand.extra_gas} gas per call'
+        ))
+
+    new_asm: list[Asm] = []
+    i = 0
+    while i < len(asm):
+        if i in call_sites:
+            end, sub_mid = call_sites[i]
+            ret_mid = MarkId(ctx.next_obj_id(), MarkPurpose.Label)
+            call = [MarkRef(ret_mid), MarkRef(sub_mid), op('jump'), Mark(ret_mid), op('jumpdest')]
+            new_asm.extend([asm[i], *call, asm[end]] if keep_invocation_marks else call)
+            i = end + 1
+            continue
+        step = asm[i]
+        if keep_invocation_marks or not (isinstance(step, Mark) and step.mid.obj_id in invocations):
+            new_asm.append(step)
+        i += 1
+
+    last_op = next((step for step in reversed(new_asm) if not isinstance(step, Mark)), None)
+    if not (isinstance(last_op, Op) and last_op.op in TERMINATING_OPS):
+        # Prevent execution from falling through into the subroutines
+        new_asm.append(op('stop'))
+
+    return new_asm + subroutines, notes
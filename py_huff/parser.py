@@ -103,6 +103,19 @@ def parse_hex_literal(el: ExNode) -> bytes:
     return literal_to_bytes(lit)
 
 
+def get_table_file(node: ExNode) -> Optional[str]:
+    '''Returns the path of the binary file backing a code table, `None` for hex literal tables'''
+    assert node.name == 'code_table'
+    if (table_file := node.maybe_get('table_file')) is None:
+        return None
+    return table_file.get('table_path').text()
+
+
+def parse_table_literal(node: ExNode) -> bytes:
+    assert node.name == 'code_table'
+    return parse_hex_literal(next(node.get_all_deep('hex_literal')))
+
+
 def parse_call_arg(arg: ExNode) -> InvokeArg:
     el = parse_el(arg)
     assert isinstance(el, InvokeArg), f'Invalid call argument {el}'
@@ -129,7 +142,7 @@ def parse_el(el: ExNode) -> MacroElement:
     elif name == 'const_ref':
         return ConstRef(get_ident(el))
     elif name == 'push_op':
-        num = int(el.get('num').text())
+        num = int(el.get('push_size').text())
         data = parse_hex_literal(el.get('hex_literal'))
         return Literal(data, num)
 
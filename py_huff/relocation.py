@@ -0,0 +1,54 @@
+'''
+Relocatable asm of pre-expanded macros (see `py_huff.objects`). Instead of concrete object IDs the
+marks of relocatable asm refer to symbols that are only bound once the macro is instantiated at
+link time.
+'''
+from typing import NamedTuple, Optional
+import typing
+from .assembler import MarkPurpose, Data
+from .opcodes import Op
+from .evm_version import EvmVersion
+from .parser import Identifier, MacroParam, ConstRef
+
+# - `local`: label or mark defined within the expansion, `key` numbers it within the macro
+# - `table`: start / end of the code table named `key`
+# - `label`: `global_` label defined outside of the macro, named `key`
+# - `runtime`: start / end of the runtime code (constructor built-ins)
+SymbolKind = typing.Literal['local', 'table', 'label', 'runtime']
+SYMBOL_KINDS: tuple[SymbolKind, ...] = ('local', 'table', 'label', 'runtime')
+
+Symbol = NamedTuple('Symbol', [('kind', SymbolKind), ('key', Identifier | int)])
+SymbolicMarkId = NamedTuple('SymbolicMarkId', [('symbol', Symbol), ('purpose', MarkPurpose)])
+
+# Counterparts of `Mark`, `MarkRef` and `MarkDeltaRef` referring to symbols
+SymbolicMark = NamedTuple('SymbolicMark', [('mid', SymbolicMarkId)])
+SymbolicMarkRef = NamedTuple('SymbolicMarkRef', [('mid', SymbolicMarkId)])
+SymbolicMarkDeltaRef = NamedTuple('SymbolicMarkDeltaRef', [('start', SymbolicMarkId), ('end', SymbolicMarkId)])
+
+# Macro parameters and constants are left as `MacroParam` and `ConstRef` to be substituted when linking
+ObjectAsm = Op | Data | MacroParam | ConstRef | SymbolicMark | SymbolicMarkRef | SymbolicMarkDeltaRef
+
+ObjectMacro = NamedTuple(
+    'ObjectMacro',
+    [
+        ('ident', Identifier),
+        ('params', list[Identifier]),
+        ('asm', list[ObjectAsm])
+    ]
+)
+
+HuffObject = NamedTuple(
+    'HuffObject',
+    [
+        # Literals are pushed with the same `PUSH0` setting the object was compiled with
+        ('evm_version', EvmVersion),
+        ('macros', dict[Identifier, ObjectMacro]),
+        # `None` for `FREE_STORAGE_POINTER()` constants, numbered when linking
+        ('constants', dict[Identifier, Optional[bytes]]),
+        ('code_tables', dict[Identifier, bytes]),
+        # Source of the function, event and error definitions
+        ('definitions', str),
+        # keccak256 of the library's source files
+        ('source_hash', bytes)
+    ]
+)
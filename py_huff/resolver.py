@@ -1,23 +1,162 @@
-import os
-from typing import Generator
-from .lexer import lex_huff
+from typing import Generator, NamedTuple
+from .lexer import lex_huff_cached, split_definitions, FREE_STORAGE_POINTER_CONST
 from .node import ExNode
-from .parser import get_includes
+from .parser import get_includes, get_defs, Macro
+from .sources import SourceProvider, DISK_SOURCE
 
+# Definitions that are only lexed once they're found to be reachable
+LAZY_DEFINITIONS = frozenset({'macro', 'const', 'code_table'})
 
-def resolve(fp: str, visited_paths: tuple[str, ...] = tuple(), already_resolved: set[str] | None = None) -> Generator[ExNode, None, None]:
+# Not yet lexed top-level definition, `name` is its grammar rule like `ExNode.name`
+LazyDef = NamedTuple(
+    'LazyDef',
+    [
+        ('name', str),
+        ('ident', str),
+        ('text', str),
+        ('fp', str)
+    ]
+)
+
+# Definition constructed without source text (see `py_huff.builder`), `value` is the `Macro` of
+# a macro, the value of a constant (`None` for `FREE_STORAGE_POINTER()`) or the data of a code table
+ParsedDef = NamedTuple(
+    'ParsedDef',
+    [
+        ('name', str),
+        ('ident', str),
+        ('value', Macro | bytes | memoryview | None)
+    ]
+)
+
+Definition = ExNode | LazyDef | ParsedDef
+
+
+def with_absolute_table_path(node: ExNode, fp: str, source: SourceProvider = DISK_SOURCE) -> ExNode:
+    '''Resolves the path of file backed code tables relative to the file `fp` defining them'''
+    if node.name != 'code_table' or (table_file := node.maybe_get('table_file')) is None:
+        return node
+    path_node = table_file.get('table_path')
+    abs_path = source.join(fp, path_node.text())
+    new_table_file = table_file._replace(content=[
+        path_node._replace(content=abs_path) if child is path_node else child
+        for child in table_file.children()
+    ])
+    return node._replace(content=[
+        new_table_file if child is table_file else child
+        for child in node.children()
+    ])
+
+
+def include_paths(file_root: ExNode, fp: str, source: SourceProvider = DISK_SOURCE) -> list[str]:
+    '''Normalized paths of the files directly included by the already lexed file at `fp`'''
+    includes, _ = get_includes(file_root)
+    return [source.join(fp, include) for include in includes]
+
+
+def resolve(
+    fp: str,
+    visited_paths: tuple[str, ...] = tuple(),
+    already_resolved: set[str] | None = None,
+    source: SourceProvider = DISK_SOURCE
+) -> Generator[ExNode, None, None]:
     if already_resolved is None:
         already_resolved = set()
-    fp = os.path.abspath(fp)
+    fp = source.normalize(fp)
     if fp in already_resolved:
         return
     already_resolved.add(fp)
     assert fp not in visited_paths, f'Circular include in {fp}'
     visited_paths += (fp,)
-    with open(fp, 'r') as f:
-        file_root = lex_huff(f.read())
+    file_root = lex_huff_cached(source.read_text(fp))
+    yield from resolve_root(file_root, fp, visited_paths, already_resolved, source)
+
+
+def resolve_root(
+    file_root: ExNode,
+    fp: str,
+    visited_paths: tuple[str, ...],
+    already_resolved: set[str],
+    source: SourceProvider = DISK_SOURCE
+) -> Generator[ExNode, None, None]:
+    '''Resolves the includes of an already lexed file located at `fp`'''
+    _, file_defs = get_includes(file_root)
+    for include_fp in include_paths(file_root, fp, source):
+        yield from resolve(include_fp, visited_paths, already_resolved, source)
+    for d in file_defs:
+        yield with_absolute_table_path(d, fp, source)
+
+
+def lex_definition(text: str, fp: str, source: SourceProvider = DISK_SOURCE) -> ExNode:
+    '''Lexes the text of a single definition (with trailing gap) located in the file `fp`'''
+    defs = list(get_defs(lex_huff_cached(text)))
+    assert len(defs) == 1, f'Expected a single definition in {fp}, found {len(defs)}'
+    return with_absolute_table_path(defs[0], fp, source)
+
 
-    includes, file_defs = get_includes(file_root)
-    for include in includes:
-        yield from resolve(os.path.join(os.path.dirname(fp), include), visited_paths, already_resolved)
+def to_node(d: Definition, source: SourceProvider = DISK_SOURCE) -> ExNode:
+    assert not isinstance(d, ParsedDef), f'Built definition "{d.ident}" has no syntax tree'
+    if isinstance(d, LazyDef):
+        return lex_definition(d.text, d.fp, source)
+    return d
+
+
+def is_free_storage_pointer(d: Definition) -> bool:
+    if isinstance(d, ParsedDef):
+        return d.value is None
+    if isinstance(d, LazyDef):
+        return FREE_STORAGE_POINTER_CONST.match(d.text) is not None
+    return d.get_idx(4).name != 'hex_literal'
+
+
+def get_lazy_includes(
+    text: str,
+    fp: str,
+    source: SourceProvider = DISK_SOURCE
+) -> tuple[list[str], list[Definition]]:
+    '''
+    Like `get_includes` but macros, constants and code tables are split off without being lexed.
+    Included paths are returned already resolved relative to `fp`.
+    '''
+    split = split_definitions(text)
+    if split is None:
+        root = lex_huff_cached(text)
+        return include_paths(root, fp, source), [
+            with_absolute_table_path(d, fp, source)
+            for d in get_includes(root)[1]
+        ]
+    first_start, chunks = split
+    # Everything before the first definition must be a gap
+    lex_huff_cached(text[:first_start])
+    includes: list[str] = []
+    defs: list[Definition] = []
+    for chunk in chunks:
+        chunk_text = text[chunk.start:chunk.end]
+        if chunk.name in LAZY_DEFINITIONS and chunk.ident is not None:
+            defs.append(LazyDef(chunk.name, chunk.ident, chunk_text, fp))
+        else:
+            root = lex_huff_cached(chunk_text)
+            includes.extend(include_paths(root, fp, source))
+            defs.extend(with_absolute_table_path(d, fp, source) for d in get_includes(root)[1])
+    return includes, defs
+
+
+def resolve_definitions(
+    fp: str,
+    visited_paths: tuple[str, ...] = tuple(),
+    already_resolved: set[str] | None = None,
+    source: SourceProvider = DISK_SOURCE
+) -> Generator[Definition, None, None]:
+    '''Lazy variant of `resolve`, macros, constants and code tables are yielded as `LazyDef`'''
+    if already_resolved is None:
+        already_resolved = set()
+    fp = source.normalize(fp)
+    if fp in already_resolved:
+        return
+    already_resolved.add(fp)
+    assert fp not in visited_paths, f'Circular include in {fp}'
+    visited_paths += (fp,)
+    includes, file_defs = get_lazy_includes(source.read_text(fp), fp, source)
+    for include_fp in includes:
+        yield from resolve_definitions(include_fp, visited_paths, already_resolved, source)
     yield from file_defs
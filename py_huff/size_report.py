@@ -0,0 +1,150 @@
+'''
+Attribution of final (post-relaxation) code size to macros. Expansions are delimited by the
+invocation marks of `Scope(track_invocations=True)`, a macro's inclusive size covers everything
+it expands to while its exclusive size excludes the expansions of the macros it invokes. Macros
+invoked multiple times are summed over all of their invocations.
+'''
+from typing import NamedTuple, Optional
+from .assembler import Asm, Mark, MarkId, MarkPurpose
+from .codegen import CodeTable, code_table_size
+from .context import ObjectId
+from .parser import Identifier, Json
+from .utils import s
+
+# EIP-170 runtime code size limit
+MAX_CODE_SIZE = 0x6000
+
+MacroSize = NamedTuple(
+    'MacroSize',
+    [
+        ('macro', Identifier),
+        ('invocations', int),
+        ('inclusive', int),
+        ('exclusive', int)
+    ]
+)
+
+# Tables with identical contents are only emitted once and therefore listed together
+TableSize = NamedTuple('TableSize', [('names', list[Identifier]), ('size', int)])
+
+CodeSizeReport = NamedTuple(
+    'CodeSizeReport',
+    [
+        ('total', int),
+        # Bytes of code generated by macros, i.e. excluding code tables
+        ('code', int),
+        # Sorted by inclusive size, largest first
+        ('macros', list[MacroSize]),
+        ('tables', list[TableSize])
+    ]
+)
+
+SizeReport = NamedTuple(
+    'SizeReport',
+    [
+        ('runtime', CodeSizeReport),
+        # `None` if the default constructor was generated
+        ('constructor', Optional[CodeSizeReport])
+    ]
+)
+
+
+def attribute_sizes(
+    root: Identifier,
+    asm: list[Asm],
+    invocations: dict[ObjectId, Identifier],
+    offsets: dict[MarkId, int],
+    code_size: int
+) -> list[MacroSize]:
+    '''Sizes of the macros expanded into `asm` (from `root`), `code_size` excludes code tables'''
+    totals: dict[Identifier, list[int]] = {root: [1, code_size, code_size]}
+    # Size of the open invocations together with the summed size of their direct children
+    open_invocations: list[list[int]] = [[code_size, 0]]
+    open_macros: list[Identifier] = [root]
+    for step in asm:
+        if not isinstance(step, Mark) or (macro := invocations.get(step.mid.obj_id)) is None:
+            continue
+        if step.mid.purpose == MarkPurpose.Start:
+            size = offsets[MarkId(step.mid.obj_id, MarkPurpose.End)] - offsets[step.mid]
+            open_invocations[-1][1] += size
+            open_invocations.append([size, 0])
+            open_macros.append(macro)
+            total = totals.setdefault(macro, [0, 0, 0])
+            total[0] += 1
+            total[1] += size
+        else:
+            size, children = open_invocations.pop()
+            totals[open_macros.pop()][2] += size - children
+    size, children = open_invocations.pop()
+    totals[root][2] = size - children
+    return sorted(
+        (MacroSize(macro, *total) for macro, total in totals.items()),
+        key=lambda m: (-m.inclusive, -m.exclusive, m.macro)
+    )
+
+
+def table_sizes(referenced: dict[Identifier, CodeTable]) -> list[TableSize]:
+    tables: dict[ObjectId, TableSize] = {}
+    for ident, table in referenced.items():
+        if table.obj_id not in tables:
+            tables[table.obj_id] = TableSize([], code_table_size(table))
+        tables[table.obj_id].names.append(ident)
+    return sorted(tables.values(), key=lambda t: (-t.size, t.names))
+
+
+def code_size_report_to_json(report: CodeSizeReport) -> dict[str, Json]:
+    return {
+        'total': report.total,
+        'code': report.code,
+        'macros': [m._asdict() for m in report.macros],
+        'tables': [t._asdict() for t in report.tables]
+    }
+
+
+def code_size_report_from_json(data: dict) -> CodeSizeReport:
+    return CodeSizeReport(
+        data['total'],
+        data['code'],
+        [MacroSize(**m) for m in data['macros']],
+        [TableSize(**t) for t in data['tables']]
+    )
+
+
+def size_report_to_json(report: SizeReport) -> dict[str, Json]:
+    return {
+        'runtime': code_size_report_to_json(report.runtime),
+        'constructor': None if report.constructor is None else code_size_report_to_json(report.constructor)
+    }
+
+
+def size_report_from_json(data: dict) -> SizeReport:
+    return SizeReport(
+        code_size_report_from_json(data['runtime']),
+        None if data['constructor'] is None else code_size_report_from_json(data['constructor'])
+    )
+
+
+def format_code_size_report(title: str, report: CodeSizeReport) -> list[str]:
+    name_width = max([len('macro'), *(len(m.macro) for m in report.macros)])
+    lines = [
+        f'{"macro":<{name_width}}  {"calls":>6}  {"inclusive":>9}  {"exclusive":>9}',
+        *(
+            f'{m.macro:<{name_width}}  {m.invocations:>6}  {m.inclusive:>9}  {m.exclusive:>9}'
+            for m in report.macros
+        )
+    ]
+    if report.tables:
+        table_bytes = report.total - report.code
+        lines.append(f'code tables: {table_bytes} byte{s(table_bytes)}')
+        lines.extend(f'  {", ".join(t.names)}: {t.size}' for t in report.tables)
+    return [f'{title}: {report.total} byte{s(report.total)}', *lines]
+
+
+def format_size_report(report: SizeReport) -> str:
+    runtime_title = f'runtime (EIP-170 limit {MAX_CODE_SIZE})'
+    if report.runtime.total > MAX_CODE_SIZE:
+        runtime_title += f', {report.runtime.total - MAX_CODE_SIZE} bytes over'
+    lines = format_code_size_report(runtime_title, report.runtime)
+    if report.constructor is not None:
+        lines.extend(['', *format_code_size_report('constructor (excluding runtime)', report.constructor)])
+    return '\n'.join(lines)
@@ -0,0 +1,149 @@
+'''
+Source providers used by the resolver to locate and read Huff files and binary code tables. Paths
+are always normalized to absolute paths so that include de-duplication and circular include
+detection behave identically for every provider.
+'''
+from typing import Protocol, IO
+from abc import ABC, abstractmethod
+import hashlib
+import os
+import posixpath
+import threading
+import zipfile
+from .assembler import Data
+from .utils import map_file
+
+
+class SourceProvider(Protocol):
+    def normalize(self, fp: str) -> str:
+        '''Converts `fp` into a canonical, absolute path'''
+        ...
+
+    def join(self, base_fp: str, rel_fp: str) -> str:
+        '''Resolves `rel_fp` relative to the directory of the file `base_fp`'''
+        ...
+
+    def read_text(self, fp: str) -> str:
+        ...
+
+    def read_binary(self, fp: str) -> Data:
+        ...
+
+
+class DiskSource:
+    '''Reads files from the real filesystem, binary files are memory mapped'''
+
+    def normalize(self, fp: str) -> str:
+        return os.path.abspath(fp)
+
+    def join(self, base_fp: str, rel_fp: str) -> str:
+        return os.path.abspath(os.path.join(os.path.dirname(base_fp), rel_fp))
+
+    def read_text(self, fp: str) -> str:
+        # Decoded like `VirtualSource`, without newline translation the text round-trips to the file
+        with open(fp, 'rb') as f:
+            return f.read().decode()
+
+    def read_binary(self, fp: str) -> Data:
+        return map_file(fp)
+
+
+class VirtualSource(ABC):
+    '''Base for providers with POSIX style paths relative to a virtual root "/"'''
+
+    def normalize(self, fp: str) -> str:
+        return posixpath.normpath(posixpath.join('/', fp))
+
+    def join(self, base_fp: str, rel_fp: str) -> str:
+        return self.normalize(posixpath.join(posixpath.dirname(base_fp), rel_fp))
+
+    def read_text(self, fp: str) -> str:
+        return self.read_binary(fp).decode()
+
+    @abstractmethod
+    def read_binary(self, fp: str) -> bytes:
+        ...
+
+
+class MemorySource(VirtualSource):
+    '''Serves files from an in-memory dict of path -> contents, performing no disk I/O'''
+
+    def __init__(self, files: dict[str, str | bytes]):
+        self.files: dict[str, bytes] = {
+            self.normalize(fp): contents.encode() if isinstance(contents, str) else contents
+            for fp, contents in files.items()
+        }
+
+    def read_binary(self, fp: str) -> bytes:
+        if (contents := self.files.get(self.normalize(fp))) is None:
+            raise FileNotFoundError(f'No such file in memory source: {fp!r}')
+        return contents
+
+
+class ZipSource(VirtualSource):
+    '''Serves files from a zip archive, paths are relative to the root of the archive'''
+
+    def __init__(self, archive: str | IO[bytes] | zipfile.ZipFile):
+        self.zf = archive if isinstance(archive, zipfile.ZipFile) else zipfile.ZipFile(archive)
+        # Reads share the archive's underlying file object
+        self.lock = threading.Lock()
+
+    def read_binary(self, fp: str) -> bytes:
+        name = self.normalize(fp).lstrip('/')
+        with self.lock:
+            try:
+                return self.zf.read(name)
+            except KeyError:
+                raise FileNotFoundError(f'No such file in zip source: {fp!r}')
+
+
+class OverlaySource:
+    '''Serves the text of `files` (e.g. unsaved editor buffers) in place of `base`'s contents'''
+
+    def __init__(self, base: SourceProvider, files: dict[str, str] | None = None):
+        self.base = base
+        self.files: dict[str, str] = {} if files is None else files
+
+    def normalize(self, fp: str) -> str:
+        return self.base.normalize(fp)
+
+    def join(self, base_fp: str, rel_fp: str) -> str:
+        return self.base.join(base_fp, rel_fp)
+
+    def read_text(self, fp: str) -> str:
+        if (text := self.files.get(self.normalize(fp))) is not None:
+            return text
+        return self.base.read_text(fp)
+
+    def read_binary(self, fp: str) -> Data:
+        return self.base.read_binary(fp)
+
+
+class RecordingSource:
+    '''
+    Forwards to `base`, recording the normalized path of every file read in order of first read
+    together with the SHA-256 of the contents it served (text as UTF-8)
+    '''
+
+    def __init__(self, base: SourceProvider):
+        self.base = base
+        self.read: dict[str, str] = {}
+
+    def normalize(self, fp: str) -> str:
+        return self.base.normalize(fp)
+
+    def join(self, base_fp: str, rel_fp: str) -> str:
+        return self.base.join(base_fp, rel_fp)
+
+    def read_text(self, fp: str) -> str:
+        text = self.base.read_text(fp)
+        self.read[self.normalize(fp)] = hashlib.sha256(text.encode()).hexdigest()
+        return text
+
+    def read_binary(self, fp: str) -> Data:
+        data = self.base.read_binary(fp)
+        self.read[self.normalize(fp)] = hashlib.sha256(data).hexdigest()
+        return data
+
+
+DISK_SOURCE = DiskSource()
@@ -0,0 +1,127 @@
+'''
+Constant synthesis: replaces wide `PUSH` literals with shorter instruction sequences computing the
+same value, e.g. `PUSH0 NOT` for `type(uint256).max` or `PUSH1 1 PUSH1 n SHL` for powers of two.
+
+Sequences are ranked by an objective:
+- `size`: bytes of code, then execution gas
+- `gas`: execution gas plus the cost of deploying the code (200 gas code deposit and the initcode
+  calldata gas per byte), then bytes of code
+
+Pushes wider than their value requires (e.g. `push4 0x01`) are assumed intentional and kept.
+'''
+from typing import Optional
+import typing
+from .assembler import Asm
+from .initcode import calldata_gas
+from .opcodes import Op, op, OP_MAP, BASE_GAS, create_push
+from .optimize import OptimizationNote
+from .utils import byte_size, s
+
+SynthesisObjective = typing.Literal['gas', 'size']
+SYNTHESIS_OBJECTIVES: tuple[SynthesisObjective, ...] = ('gas', 'size')
+
+CODE_DEPOSIT_GAS = 200
+MAX_U256 = (1 << 256) - 1
+PUSH0 = OP_MAP['push0']
+
+
+def validate_objective(objective: Optional[str]) -> Optional[SynthesisObjective]:
+    assert objective is None or objective in SYNTHESIS_OBJECTIVES, \
+        f'Unknown constant synthesis objective "{objective}", expected one of {", ".join(SYNTHESIS_OBJECTIVES)}'
+    return objective  # type: ignore
+
+
+def trailing_zeros(x: int) -> int:
+    return (x & -x).bit_length() - 1
+
+
+def sequence_code(seq: list[Op]) -> bytes:
+    return b''.join(bytes(step.get_bytes()) for step in seq)
+
+
+def sequence_cost(seq: list[Op], objective: SynthesisObjective) -> tuple[int, int]:
+    code = sequence_code(seq)
+    exec_gas = sum(BASE_GAS[step.op] for step in seq)
+    if objective == 'size':
+        return len(code), exec_gas
+    return exec_gas + CODE_DEPOSIT_GAS * len(code) + calldata_gas(code), len(code)
+
+
+def synthesis_candidates(value: int, avoid_push0: bool) -> list[list[Op]]:
+    '''Instruction sequences that push exactly `value`, the plain `PUSH` first'''
+    def push(x: int) -> Op:
+        if x == 0 and not avoid_push0:
+            return op('push0')
+        return create_push(x.to_bytes(32, 'big'))
+
+    inverted = MAX_U256 ^ value
+    candidates = [[push(value)], [push(inverted), op('not')]]
+    if value:
+        # value = x << k
+        if (tz := trailing_zeros(value)):
+            candidates.append([push(value >> tz), push(tz), op('shl')])
+        # value = ~x >> k, e.g. masks of the lower bits
+        if (lz := 256 - value.bit_length()):
+            filled = ((value << lz) & MAX_U256) | ((1 << lz) - 1)
+            candidates.append([push(MAX_U256 ^ filled), op('not'), push(lz), op('shr')])
+    # value = ~(x << k), e.g. masks clearing the lower bits
+    if inverted and (tz := trailing_zeros(inverted)):
+        candidates.append([push(inverted >> tz), push(tz), op('shl'), op('not')])
+    return candidates
+
+
+def synthesize(value: int, objective: SynthesisObjective, avoid_push0: bool) -> list[Op]:
+    '''Cheapest sequence pushing `value`, ties are resolved in favour of the plain `PUSH`'''
+    return min(
+        synthesis_candidates(value, avoid_push0),
+        key=lambda seq: sequence_cost(seq, objective)
+    )
+
+
+def is_minimal_push(step: Op, avoid_push0: bool) -> bool:
+    if step.op == PUSH0:
+        return True
+    if not (OP_MAP['push1'] <= step.op <= OP_MAP['push32']):
+        return False
+    value = int.from_bytes(step.extra_data, 'big')
+    if value == 0:
+        return avoid_push0 and len(step.extra_data) == 1
+    return len(step.extra_data) == byte_size(value)
+
+
+def synthesize_constants(
+    asm: list[Asm],
+    objective: SynthesisObjective,
+    avoid_push0: bool
+) -> tuple[list[Asm], list[OptimizationNote]]:
+    '''Replaces every minimal `PUSH` in `asm` by its cheapest synthesized sequence'''
+    best: dict[int, list[Op]] = {}
+    replaced: dict[int, int] = {}
+    new_asm: list[Asm] = []
+    for step in asm:
+        if not isinstance(step, Op) or not is_minimal_push(step, avoid_push0):
+            new_asm.append(step)
+            continue
+        value = int.from_bytes(step.extra_data, 'big')
+        if (seq := best.get(value)) is None:
+            best[value] = seq = synthesize(value, objective, avoid_push0)
+        if len(seq) == 1:
+            new_asm.append(step)
+            continue
+        new_asm.extend(seq)
+        replaced[value] = replaced.get(value, 0) + 1
+
+    notes: list[OptimizationNote] = []
+    for value, count in replaced.items():
+        seq = best[value]
+        plain = synthesis_candidates(value, avoid_push0)[0]
+        plain_code, seq_code = sequence_code(plain), sequence_code(seq)
+        extra_gas = sum(BASE_GAS[step.op] for step in seq) - BASE_GAS[plain[0].op]
+        notes.append(OptimizationNote(
+            'constants',
+            f'0x{value:x}',
+            count * (len(plain_code) - len(seq_code)),
+            count * extra_gas,
+            f'{count} push{s(count)} synthesized as {" ".join(map(repr, seq))}'
+        ))
+    return new_asm, notes
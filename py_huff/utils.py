@@ -1,4 +1,7 @@
 from typing import TypeVar, Iterable, Callable, Any
+from functools import lru_cache
+import mmap
+import os
 from Crypto.Hash import keccak
 
 T = TypeVar('T')
@@ -40,9 +43,23 @@ def s(x: int) -> str:
     return 's'
 
 
-def keccak256(preimage: bytes) -> bytes:
+def keccak256(preimage: bytes | bytearray | memoryview) -> bytes:
     return keccak.new(data=preimage, digest_bits=256).digest()
 
 
+@lru_cache(maxsize=4096)
+def sig_hash(sig: str) -> bytes:
+    '''Memoized keccak256 of a function, error or event signature'''
+    return keccak256(sig.encode())
+
+
 def byte_size(x: int) -> int:
     return max((x.bit_length() + 7) // 8, 1)
+
+
+def map_file(fp: str) -> memoryview:
+    '''Memory maps `fp` read-only, returning a zero-copy view of its contents'''
+    with open(fp, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b'')
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
@@ -0,0 +1,236 @@
+'''Minimal EVM interpreter used to check the behaviour & gas usage of generated bytecode'''
+from typing import NamedTuple
+from py_huff.opcodes import OP_MAP, BASE_GAS
+from py_huff.utils import keccak256
+
+U256 = 1 << 256
+MASK = U256 - 1
+
+ExecResult = NamedTuple(
+    'ExecResult',
+    [
+        ('success', bool),
+        ('output', bytes),
+        ('gas_used', int),
+        ('storage', dict[int, int]),
+        ('stack', list[int])
+    ]
+)
+
+OPS = {code: name for name, code in OP_MAP.items()}
+OPS[0x44] = 'prevrandao'
+
+
+def mem_cost(words: int) -> int:
+    return 3 * words + words * words // 512
+
+
+def valid_jumpdests(code: bytes) -> set[int]:
+    dests: set[int] = set()
+    i = 0
+    while i < len(code):
+        c = code[i]
+        if c == 0x5b:
+            dests.add(i)
+        if 0x60 <= c <= 0x7f:
+            i += c - 0x5f
+        i += 1
+    return dests
+
+
+def signed(x: int) -> int:
+    return x - U256 if x >> 255 else x
+
+
+def run_evm(code: bytes, calldata: bytes = b'', max_steps: int = 1_000_000) -> ExecResult:
+    stack: list[int] = []
+    memory = bytearray()
+    storage: dict[int, int] = {}
+    gas = 0
+    pc = 0
+    dests = valid_jumpdests(code)
+
+    def pop() -> int:
+        assert stack, 'Stack underflow'
+        return stack.pop()
+
+    def push(x: int):
+        stack.append(x & MASK)
+        assert len(stack) <= 1024, 'Stack overflow'
+
+    def expand(offset: int, size: int):
+        nonlocal gas
+        if size == 0:
+            return
+        new_words = (offset + size + 31) // 32
+        old_words = len(memory) // 32
+        if new_words > old_words:
+            gas += mem_cost(new_words) - mem_cost(old_words)
+            memory.extend(bytes(32 * (new_words - old_words)))
+
+    def copy_to_mem(dest: int, src: bytes, offset: int, size: int):
+        nonlocal gas
+        expand(dest, size)
+        gas += 3 * ((size + 31) // 32)
+        data = src[offset:offset + size] if offset < len(src) else b''
+        memory[dest:dest + size] = data + bytes(size - len(data))
+
+    for _ in range(max_steps):
+        if pc >= len(code):
+            return ExecResult(True, b'', gas, storage, stack)
+        c = code[pc]
+        name = OPS.get(c)
+        assert name is not None, f'Unknown opcode 0x{c:02x}'
+        gas += BASE_GAS[c]
+        pc += 1
+        if name.startswith('push') and name != 'push0':
+            size = c - 0x5f
+            push(int.from_bytes(code[pc:pc + size].ljust(size, b'\x00'), 'big'))
+            pc += size
+        elif name == 'push0':
+            push(0)
+        elif name.startswith('dup'):
+            n = int(name[3:])
+            assert len(stack) >= n, 'Stack underflow'
+            push(stack[-n])
+        elif name.startswith('swap'):
+            n = int(name[4:])
+            assert len(stack) > n, 'Stack underflow'
+            stack[-1], stack[-1 - n] = stack[-1 - n], stack[-1]
+        elif name == 'stop':
+            return ExecResult(True, b'', gas, storage, stack)
+        elif name in ('return', 'revert'):
+            offset, size = pop(), pop()
+            expand(offset, size)
+            return ExecResult(name == 'return', bytes(memory[offset:offset + size]), gas, storage, stack)
+        elif name == 'invalid':
+            return ExecResult(False, b'', gas, storage, stack)
+        elif name == 'jump':
+            dest = pop()
+            assert dest in dests, f'Invalid jump destination {dest}'
+            pc = dest
+        elif name == 'jumpi':
+            dest, cond = pop(), pop()
+            if cond:
+                assert dest in dests, f'Invalid jump destination {dest}'
+                pc = dest
+        elif name == 'jumpdest':
+            pass
+        elif name == 'pop':
+            pop()
+        elif name == 'add':
+            push(pop() + pop())
+        elif name == 'mul':
+            push(pop() * pop())
+        elif name == 'sub':
+            a, b = pop(), pop()
+            push(a - b)
+        elif name == 'div':
+            a, b = pop(), pop()
+            push(a // b if b else 0)
+        elif name == 'mod':
+            a, b = pop(), pop()
+            push(a % b if b else 0)
+        elif name == 'addmod':
+            a, b, n = pop(), pop(), pop()
+            push((a + b) % n if n else 0)
+        elif name == 'mulmod':
+            a, b, n = pop(), pop(), pop()
+            push((a * b) % n if n else 0)
+        elif name == 'exp':
+            a, b = pop(), pop()
+            gas += 50 * ((b.bit_length() + 7) // 8)
+            push(pow(a, b, U256))
+        elif name == 'lt':
+            push(int(pop() < pop()))
+        elif name == 'gt':
+            push(int(pop() > pop()))
+        elif name == 'slt':
+            push(int(signed(pop()) < signed(pop())))
+        elif name == 'sgt':
+            push(int(signed(pop()) > signed(pop())))
+        elif name == 'eq':
+            push(int(pop() == pop()))
+        elif name == 'iszero':
+            push(int(pop() == 0))
+        elif name == 'and':
+            push(pop() & pop())
+        elif name == 'or':
+            push(pop() | pop())
+        elif name == 'xor':
+            push(pop() ^ pop())
+        elif name == 'not':
+            push(~pop())
+        elif name == 'byte':
+            i, x = pop(), pop()
+            push((x >> (8 * (31 - i))) & 0xff if i < 32 else 0)
+        elif name == 'shl':
+            shift, x = pop(), pop()
+            push(x << shift if shift < 256 else 0)
+        elif name == 'shr':
+            shift, x = pop(), pop()
+            push(x >> shift if shift < 256 else 0)
+        elif name == 'sar':
+            shift, x = pop(), pop()
+            push(signed(x) >> min(shift, 255))
+        elif name == 'sha3':
+            offset, size = pop(), pop()
+            expand(offset, size)
+            gas += 6 * ((size + 31) // 32)
+            push(int.from_bytes(keccak256(bytes(memory[offset:offset + size])), 'big'))
+        elif name == 'calldataload':
+            offset = pop()
+            push(int.from_bytes(calldata[offset:offset + 32].ljust(32, b'\x00'), 'big'))
+        elif name == 'calldatasize':
+            push(len(calldata))
+        elif name == 'calldatacopy':
+            dest, offset, size = pop(), pop(), pop()
+            copy_to_mem(dest, calldata, offset, size)
+        elif name == 'codesize':
+            push(len(code))
+        elif name == 'codecopy':
+            dest, offset, size = pop(), pop(), pop()
+            copy_to_mem(dest, code, offset, size)
+        elif name == 'mcopy':
+            dest, src, size = pop(), pop(), pop()
+            expand(max(dest, src), size)
+            gas += 3 * ((size + 31) // 32)
+            memory[dest:dest + size] = memory[src:src + size]
+        elif name == 'returndatasize':
+            push(0)
+        elif name in ('caller', 'origin', 'address', 'callvalue', 'gasprice', 'coinbase', 'timestamp',
+                      'number', 'prevrandao', 'gaslimit', 'chainid', 'basefee', 'selfbalance'):
+            push(0)
+        elif name == 'mload':
+            offset = pop()
+            expand(offset, 32)
+            push(int.from_bytes(memory[offset:offset + 32], 'big'))
+        elif name == 'mstore':
+            offset, value = pop(), pop()
+            expand(offset, 32)
+            memory[offset:offset + 32] = value.to_bytes(32, 'big')
+        elif name == 'mstore8':
+            offset, value = pop(), pop()
+            expand(offset, 1)
+            memory[offset] = value & 0xff
+        elif name == 'msize':
+            push(len(memory))
+        elif name == 'sload':
+            push(storage.get(pop(), 0))
+        elif name == 'sstore':
+            key, value = pop(), pop()
+            storage[key] = value
+        elif name == 'pc':
+            push(pc - 1)
+        elif name == 'gas':
+            push(1_000_000_000 - gas)
+        else:
+            raise NotImplementedError(f'Opcode {name} not supported by test interpreter')
+    raise TimeoutError('Exceeded maximum steps')
+
+
+def deploy(initcode: bytes) -> tuple[bytes, int]:
+    '''Runs `initcode` returning the deployed code and the execution gas spent'''
+    result = run_evm(initcode)
+    assert result.success, 'Deployment failed'
+    return result.output, result.gas_used
@@ -0,0 +1,28 @@
+import io
+import json
+from py_huff.compile import compile_src
+from py_huff.artifacts import write_ndjson_artifact, artifact_json
+from py_huff.utils import keccak256
+
+
+def test_ndjson_lines_match_artifacts():
+    out = io.StringIO()
+    results = {}
+    for i in range(3):
+        src = f'#define function f{i}() view returns () #define macro MAIN() = takes(0) returns(0) {{ 0x{i + 1:02x} }}'
+        results[f'unit{i}'] = result = compile_src(src, {}, False)
+        write_ndjson_artifact(out, f'unit{i}', result, metadata={'index': i} if i else None)
+
+    lines = out.getvalue().splitlines()
+    assert len(lines) == 3
+    for i, line in enumerate(lines):
+        assert ': ' not in line and '\n' not in line
+        entry = json.loads(line)
+        result = results[entry['name']]
+        expected = artifact_json(result)
+        assert entry['abi'] == expected['abi']
+        assert entry['bytecode'] == expected['bytecode']
+        assert entry['deployedBytecode'] == expected['deployedBytecode']
+        assert entry['hashes']['bytecode'] == f'0x{keccak256(result.deploy).hex()}'
+        assert entry['hashes']['deployedBytecode'] == f'0x{keccak256(result.runtime).hex()}'
+        assert entry.get('metadata') == ({'index': i} if i else None)
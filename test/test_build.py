@@ -0,0 +1,140 @@
+import json
+import pytest
+from py_huff.artifacts import artifact_json
+from py_huff.build import build, load_manifest, main
+from py_huff.compile import compile
+
+LIB = '''
+#define constant OWNER = 0x01
+#define macro LIB() = takes(0) returns(0) { [OWNER] pop }
+'''
+TOKEN = '''
+#include "./lib.huff"
+#define table DATA = file("./data.bin")
+#define macro MAIN() = takes(0) returns(0) { LIB() __tablestart(DATA) }
+'''
+VAULT = '''
+#define macro MAIN() = takes(0) returns(0) { caller pop }
+'''
+
+
+@pytest.fixture
+def project(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    (src / 'lib.huff').write_text(LIB)
+    (src / 'Token.huff').write_text(TOKEN)
+    (src / 'Vault.huff').write_text(VAULT)
+    (src / 'data.bin').write_bytes(b'\x01\x02')
+    manifest = {
+        'outDir': 'build',
+        'options': {'evmVersion': 'paris'},
+        'profiles': {'mainnet': {'OWNER': '0xc0ffee'}},
+        'contracts': [
+            {'path': 'src/Token.huff', 'profiles': ['default', 'mainnet']},
+            {'name': 'Safe', 'path': 'src/Vault.huff', 'options': {'optimize': 'gas'}}
+        ]
+    }
+    (tmp_path / 'huff.json').write_text(json.dumps(manifest))
+    return tmp_path
+
+
+def test_builds_all_targets(project):
+    report = build(load_manifest(str(project / 'huff.json')), max_workers=2)
+    assert sorted(report.built) == ['Safe', 'Token', 'Token.mainnet']
+    assert report.failed == {}
+    token = str(project / 'src' / 'Token.huff')
+    expected = {
+        'Token': compile(token, {}, 'paris'),
+        'Token.mainnet': compile(token, {'OWNER': b'\xc0\xff\xee'}, 'paris'),
+        'Safe': compile(str(project / 'src' / 'Vault.huff'), {}, 'paris', 'gas')
+    }
+    for target, result in expected.items():
+        with open(project / 'build' / f'{target}.json') as f:
+            assert json.load(f) == artifact_json(result)
+
+
+@pytest.mark.parametrize('change, rebuilt', [
+    ('lib', ['Token', 'Token.mainnet']),
+    ('table', ['Token', 'Token.mainnet']),
+    ('vault', ['Safe']),
+    ('manifest', ['Token.mainnet']),
+    ('artifact', ['Safe'])
+])
+def test_rebuilds_only_stale_targets(project, change: str, rebuilt: list[str]):
+    manifest_fp = str(project / 'huff.json')
+    build(load_manifest(manifest_fp), max_workers=1)
+    assert build(load_manifest(manifest_fp), max_workers=1).built == []
+    if change == 'lib':
+        (project / 'src' / 'lib.huff').write_text(LIB.replace('0x01', '0x02'))
+    elif change == 'table':
+        (project / 'src' / 'data.bin').write_bytes(b'\x03')
+    elif change == 'vault':
+        (project / 'src' / 'Vault.huff').write_text(VAULT.replace('caller', 'origin'))
+    elif change == 'manifest':
+        manifest = json.loads((project / 'huff.json').read_text())
+        manifest['profiles']['mainnet']['OWNER'] = '0xbeef'
+        (project / 'huff.json').write_text(json.dumps(manifest))
+    else:
+        (project / 'build' / 'Safe.json').unlink()
+    report = build(load_manifest(manifest_fp), max_workers=1)
+    assert sorted(report.built) == rebuilt
+    assert len(report.up_to_date) == 3 - len(rebuilt)
+
+
+def test_crlf_sources_stay_up_to_date(project):
+    # Inputs are hashed as served to the compiler, which must match the files on disk
+    (project / 'src' / 'lib.huff').write_bytes(LIB.replace('\n', '\r\n').encode())
+    manifest_fp = str(project / 'huff.json')
+    assert sorted(build(load_manifest(manifest_fp), max_workers=1).built) == ['Safe', 'Token', 'Token.mainnet']
+    assert build(load_manifest(manifest_fp), max_workers=1).built == []
+
+
+@pytest.mark.parametrize('option, value, error', [
+    ('optimize', 'fast', 'Build option "optimize" must be one of size, gas'),
+    ('evmVersion', 'homestead', 'Build option "evmVersion" must be one of london, paris'),
+    ('strict', 'yes', 'Build option "strict" must be a bool'),
+    ('release', True, 'Unknown build option "release"')
+])
+def test_invalid_options(project, option: str, value: object, error: str):
+    manifest = json.loads((project / 'huff.json').read_text())
+    manifest['contracts'][1]['options'][option] = value
+    (project / 'huff.json').write_text(json.dumps(manifest))
+    with pytest.raises(AssertionError, match=f'Contract "Safe": {error}'):
+        load_manifest(str(project / 'huff.json'))
+
+
+def test_depfiles(project):
+    build(load_manifest(str(project / 'huff.json')), depfiles=True, max_workers=1)
+    depfile = (project / 'build' / 'Token.json.d').read_text()
+    rule, *phony = depfile.split('\n\n')
+    target, deps = rule.split(': ', 1)
+    assert target == str(project / 'build' / 'Token.json')
+    assert deps.replace('\\\n', ' ').split() == [
+        str(project / 'src' / 'Token.huff'),
+        str(project / 'src' / 'lib.huff'),
+        str(project / 'src' / 'data.bin')
+    ]
+    assert len(phony) == 3
+
+
+def test_unreachable_broken_macro(project):
+    (project / 'src' / 'lib.huff').write_text(LIB + '#define macro BROKEN() = takes(0) returns(0) { 0x }\n')
+    token = str(project / 'src' / 'Token.huff')
+    compile(token, {}, 'paris')
+    report = build(load_manifest(str(project / 'huff.json')), max_workers=1)
+    assert report.failed == {}
+    with open(project / 'build' / 'Token.json') as f:
+        assert json.load(f) == artifact_json(compile(token, {}, 'paris'))
+
+
+def test_failures(project, capsys):
+    (project / 'src' / 'Vault.huff').write_text('#define macro MAIN() = takes(0) returns(0) { MISSING() }')
+    with pytest.raises(SystemExit):
+        main([str(project / 'huff.json'), '-j', '1'])
+    err = capsys.readouterr().err
+    assert 'failed Safe: AssertionError' in err
+    assert '2 built, 0 up to date, 1 failed' in err
+    # Failed targets are retried, successful ones are not
+    (project / 'src' / 'Vault.huff').write_text(VAULT)
+    assert build(load_manifest(str(project / 'huff.json')), max_workers=1).built == ['Safe']
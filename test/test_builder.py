@@ -0,0 +1,95 @@
+import pytest
+from py_huff.builder import ProgramBuilder, arg, const, invoke, label, lit
+from py_huff.compile import compile_src
+from py_huff.lexer import lex_huff_cached
+from evm import run_evm
+
+SRC = '''
+#define function balanceOf(address) view returns (uint256)
+#define event Transfer(address indexed, address indexed, uint256)
+#define error Unauthorized()
+#define constant FIRST_SLOT = FREE_STORAGE_POINTER()
+#define constant BALANCE_SLOT = FREE_STORAGE_POINTER()
+#define constant MASK = 0xffffffffffffffffffffffffffffffffffffffff
+#define table DATA {
+    0xc0ffee
+}
+
+#define macro REQUIRE(fail) = takes(1) returns(0) {
+    <fail> jumpi
+}
+
+#define macro MAIN() = takes(0) returns(0) {
+    0x00 calldataload 0xe0 shr
+    __FUNC_SIG(balanceOf) eq iszero
+    REQUIRE(fail)
+    0x04 calldataload [MASK] and [BALANCE_SLOT] add sload
+    __tablesize(DATA) add
+    0x00 mstore 0x20 0x00 return
+    fail:
+        __FUNC_SIG(Unauthorized) 0x00 mstore 0x04 0x1c revert
+}
+'''
+
+
+def build() -> ProgramBuilder:
+    program = ProgramBuilder()
+    program.function('balanceOf(address) view returns (uint256)')
+    program.event('#define event Transfer(address indexed, address indexed, uint256)')
+    program.error('error Unauthorized()')
+    program.constant('FIRST_SLOT', None)
+    program.constant('BALANCE_SLOT', None)
+    program.constant('MASK', 2**160 - 1)
+    program.table('DATA', bytes.fromhex('c0ffee'))
+    program.macro('REQUIRE', [arg('fail'), 'jumpi'], params=['fail'])
+    program.macro('MAIN', [
+        0, 'calldataload', 0xe0, 'shr',
+        invoke('__FUNC_SIG', 'balanceOf'), 'eq', 'iszero',
+        invoke('REQUIRE', 'fail'),
+        4, 'calldataload', const('MASK'), 'and', const('BALANCE_SLOT'), 'add', 'sload',
+        invoke('__tablesize', 'DATA'), 'add',
+        0, 'mstore', 0x20, 0, 'return',
+        label('fail'),
+        invoke('__FUNC_SIG', 'Unauthorized'), 0, 'mstore', 4, 0x1c, 'revert'
+    ])
+    return program
+
+
+@pytest.mark.parametrize('evm_version', ['paris', 'prague'])
+def test_matches_source(evm_version: str):
+    built = build().compile({}, evm_version)
+    parsed = compile_src(SRC, {}, evm_version)
+    assert built == parsed
+    calldata = bytes.fromhex('70a08231') + bytes(32)
+    assert run_evm(built.runtime, calldata).output == (3).to_bytes(32, 'big')
+    assert run_evm(built.runtime, b'').output == bytes.fromhex('82b42900')
+
+
+def test_overrides_and_options():
+    overrides = {'MASK': b'\xff'}
+    assert build().compile({}, None, 'size') == compile_src(SRC, {}, None, 'size')
+    assert build().compile(overrides, None, 'gas').runtime == compile_src(SRC, overrides, None, 'gas').runtime
+
+
+def test_macros_are_not_lexed():
+    program = ProgramBuilder()
+    program.macro('INNER', [lit(1, 4), 'add'])
+    program.macro('MAIN', [2, invoke('INNER'), 0, 'mstore', 0x20, 0, 'return'])
+    before = lex_huff_cached.cache_info()
+    result = program.compile({}, None)
+    after = lex_huff_cached.cache_info()
+    assert (after.hits, after.misses) == (before.hits, before.misses)
+    assert run_evm(result.runtime, b'').output == (3).to_bytes(32, 'big')
+    assert result.runtime.startswith(bytes.fromhex('6002630000000101'))
+
+
+@pytest.mark.parametrize('action, error', [
+    (lambda p: p.macro('MAIN', [arg('x')]), 'Invalid macro arg x for MAIN'),
+    (lambda p: p.macro('MAIN', [label('1abel')]), 'Invalid identifier "1abel"'),
+    (lambda p: p.macro('MAIN', [lit(0x1234, 1)]), 'does not fit into push1'),
+    (lambda p: p.function('transfer(address)'), 'Expected a single function declaration'),
+    (lambda p: p.constant('BIG', 2**256), 'longer than 32 bytes')
+])
+def test_validation(action, error: str):
+    with pytest.raises(Exception, match=error):
+        action(ProgramBuilder())
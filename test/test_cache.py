@@ -0,0 +1,127 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pytest
+import py_huff.cache as cache
+from py_huff.cache import compile_cached, clear_cache, cache_entries, evict
+from py_huff.compile import compile
+
+MAIN = '''
+#include "./lib.huff"
+// #include "./commented_out.huff"
+#define table DATA = file("./data.bin")
+#define macro MAIN() = takes(0) returns(0) {
+    [VALUE] __tablestart(DATA) LIB()
+}
+'''
+LIB = '''
+#define constant VALUE = 0x01
+#define function f(uint256) view returns (uint256)
+#define macro LIB() = takes(0) returns(0) { __FUNC_SIG(f) }
+'''
+
+
+@pytest.fixture
+def project(tmp_path):
+    (tmp_path / 'main.huff').write_text(MAIN)
+    (tmp_path / 'lib.huff').write_text(LIB)
+    (tmp_path / 'data.bin').write_bytes(b'\x01\x02')
+    return tmp_path
+
+
+def compile_counting(monkeypatch) -> list[str]:
+    calls: list[str] = []
+
+    def counting_compile(entry_fp, *args):
+        calls.append(entry_fp)
+        return compile(entry_fp, *args)
+    monkeypatch.setattr(cache, 'compile', counting_compile)
+    return calls
+
+
+def test_hit_returns_stored_result(project, monkeypatch):
+    calls = compile_counting(monkeypatch)
+    cache_dir = str(project / 'cache')
+    main = str(project / 'main.huff')
+    first = compile_cached(main, {}, False, cache_dir=cache_dir)
+    second = compile_cached(main, {}, False, cache_dir=cache_dir)
+    assert len(calls) == 1
+    assert second == first == compile(main, {}, False)
+
+
+@pytest.mark.parametrize('change', ['lib', 'table', 'override', 'option'])
+def test_inputs_invalidate(project, monkeypatch, change: str):
+    calls = compile_counting(monkeypatch)
+    cache_dir = str(project / 'cache')
+    main = str(project / 'main.huff')
+    compile_cached(main, {}, False, cache_dir=cache_dir)
+    overrides, synthesize = {}, None
+    if change == 'lib':
+        (project / 'lib.huff').write_text(LIB.replace('0x01', '0x02'))
+    elif change == 'table':
+        (project / 'data.bin').write_bytes(b'\x03')
+    elif change == 'override':
+        overrides = {'VALUE': b'\x05'}
+    else:
+        synthesize = 'size'
+    result = compile_cached(main, overrides, False, synthesize=synthesize, cache_dir=cache_dir)
+    assert len(calls) == 2
+    assert result == compile(main, overrides, False, synthesize=synthesize)
+
+
+def test_commented_include_is_ignored(project, monkeypatch):
+    calls = compile_counting(monkeypatch)
+    cache_dir = str(project / 'cache')
+    compile_cached(str(project / 'main.huff'), {}, False, cache_dir=cache_dir)
+    (project / 'commented_out.huff').write_text('garbage')
+    compile_cached(str(project / 'main.huff'), {}, False, cache_dir=cache_dir)
+    assert len(calls) == 1
+
+
+def test_missing_input_is_not_cached(project):
+    with pytest.raises(FileNotFoundError):
+        compile_cached(str(project / 'missing.huff'), {}, False, cache_dir=str(project / 'cache'))
+    assert cache_entries(str(project / 'cache')) == []
+
+
+def test_corrupt_entry_recompiles(project, monkeypatch):
+    calls = compile_counting(monkeypatch)
+    cache_dir = str(project / 'cache')
+    main = str(project / 'main.huff')
+    expected = compile_cached(main, {}, False, cache_dir=cache_dir)
+    (_, _, fp), = cache_entries(cache_dir)
+    with open(fp, 'w') as f:
+        f.write('{"runtime": ')
+    assert compile_cached(main, {}, False, cache_dir=cache_dir) == expected
+    assert len(calls) == 2
+
+
+def test_lru_eviction(project):
+    cache_dir = str(project / 'cache')
+    main = str(project / 'main.huff')
+    for value in range(4):
+        compile_cached(main, {'VALUE': bytes([value])}, False, cache_dir=cache_dir)
+    entries = cache_entries(cache_dir)
+    assert len(entries) == 4
+    # Touch the oldest entry, the second oldest is now evicted first
+    os.utime(entries[0][2], (entries[-1][0] + 10, entries[-1][0] + 10))
+    evict(cache_dir, sum(size for _, size, _ in entries) - 1)
+    remaining = {fp for _, _, fp in cache_entries(cache_dir)}
+    assert remaining == {fp for _, _, fp in entries} - {entries[1][2]}
+    assert clear_cache(cache_dir) == 3
+    assert cache_entries(cache_dir) == []
+
+
+def compile_in_process(args: tuple[str, str, int]) -> bytes:
+    main, cache_dir, value = args
+    return compile_cached(main, {'VALUE': bytes([value % 3])}, False, cache_dir=cache_dir).runtime
+
+
+def test_concurrent_processes(project):
+    cache_dir = str(project / 'cache')
+    main = str(project / 'main.huff')
+    jobs = [(main, cache_dir, i) for i in range(24)]
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(compile_in_process, jobs))
+    assert results == [compile(main, {'VALUE': bytes([i % 3])}, False).runtime for i in range(24)]
+    assert len(cache_entries(cache_dir)) == 3
+    assert not [name for name in os.listdir(cache_dir) if name.startswith('.tmp-')]
@@ -0,0 +1,140 @@
+from py_huff.assembler import Mark, MarkId, MarkPurpose, MarkRef
+from py_huff.cfg import build_cfg, reachable_blocks, optimize_control_flow
+from py_huff.compile import compile_src
+from py_huff.context import ContextTracker
+from py_huff.opcodes import op
+from py_huff.utils import keccak256
+from evm import run_evm
+
+DEAD_CODE = '''
+#define macro FAIL() = takes(0) returns(0) {
+    0x00 0x00 revert
+    0x01 0x02 add pop
+}
+#define macro MAIN() = takes(0) returns(0) {
+    0x00 calldataload iszero fail jumpi
+    0x01 0x00 mstore 0x20 0x00 return
+    caller pop
+    fail:
+        FAIL()
+    unused:
+        0x02 0x00 mstore
+}
+'''
+
+TRAMPOLINES = '''
+#define macro MAIN() = takes(0) returns(0) {
+    0x00 calldataload first jumpi
+    0x00 0x00 revert
+    first:
+        second jump
+    second:
+        third jump
+    third:
+        0x01 0x00 mstore 0x20 0x00 return
+}
+'''
+
+ESCAPING = '''
+#define macro SUB() = takes(1) returns(0) {
+    0x07 0x00 mstore
+    jump
+}
+#define macro MAIN() = takes(0) returns(0) {
+    ret subroutine jump
+    ret:
+        0x20 0x00 return
+    subroutine:
+        SUB()
+}
+'''
+
+
+def test_unreachable_code_removed():
+    plain = compile_src(DEAD_CODE, {}, False)
+    optimized = compile_src(DEAD_CODE, {}, False, optimize='gas')
+    # `caller pop`, `0x01 0x02 add pop` and the unreferenced `unused` block
+    assert len(plain.runtime) - len(optimized.runtime) == 2 + 6 + 5
+    assert [note.pass_name for note in optimized.optimizations] == ['dead-code']
+    assert optimized.optimizations[0].bytes_saved == 13
+    for calldata in [bytes(32), (1).to_bytes(32, 'big')]:
+        expected, result = run_evm(plain.runtime, calldata), run_evm(optimized.runtime, calldata)
+        assert (result.success, result.output) == (expected.success, expected.output)
+
+
+def test_jump_threading():
+    plain = compile_src(TRAMPOLINES, {}, False)
+    optimized = compile_src(TRAMPOLINES, {}, False, optimize='gas')
+    calldata = (1).to_bytes(32, 'big')
+    expected, result = run_evm(plain.runtime, calldata), run_evm(optimized.runtime, calldata)
+    assert result.success and result.output == expected.output
+    # Both trampolines are skipped and become unreachable
+    assert result.gas_used == expected.gas_used - 2 * (3 + 8 + 1)
+    assert len(optimized.runtime) == len(plain.runtime) - 2 * 4
+    assert not run_evm(optimized.runtime, bytes(32)).success
+
+
+def test_escaping_labels_are_kept():
+    plain = compile_src(ESCAPING, {}, False)
+    optimized = compile_src(ESCAPING, {}, False, optimize='gas')
+    assert optimized.runtime == plain.runtime
+    assert run_evm(optimized.runtime).output == (7).to_bytes(32, 'big')
+
+
+def test_reachability_follows_escaping_references():
+    ctx = ContextTracker(())
+    label, dead = (MarkId(ctx.next_obj_id(), MarkPurpose.Label) for _ in range(2))
+    # The reference to `label` is itself unreachable
+    asm = [op('stop'), MarkRef(label), op('pop'), Mark(label), op('jumpdest'), op('stop')]
+    cfg = build_cfg(asm)
+    assert reachable_blocks(cfg) == {0}
+    assert reachable_blocks(build_cfg(asm, [MarkRef(label)])) == {0, 2}
+    optimized, _ = optimize_control_flow(asm + [Mark(dead)], 'MAIN')
+    assert optimized == [op('stop'), Mark(label), Mark(dead)]
+
+
+def test_literal_jumps_are_untouched():
+    src = '''
+    #define macro MAIN() = takes(0) returns(0) {
+        0x04 jump stop
+        0x00 jumpdest stop
+    }
+    '''
+    assert compile_src(src, {}, False, optimize='gas').runtime == compile_src(src, {}, False).runtime
+
+
+def test_computed_jump_to_bare_jumpdest_is_untouched():
+    src = '''
+    #define macro MAIN() = takes(0) returns(0) {
+        0x08 0x00 add jump
+        0x00 0x00 revert
+        jumpdest 0x01 0x00 mstore 0x20 0x00 return
+    }
+    '''
+    plain = compile_src(src, {}, False)
+    optimized = compile_src(src, {}, False, optimize='gas')
+    assert optimized.runtime == plain.runtime
+    result = run_evm(optimized.runtime)
+    assert result.success and result.output == (1).to_bytes(32, 'big')
+
+
+def test_jump_table_dispatch_and_size_report():
+    fns = ''.join(f'#define function f{i}() nonpayable returns ()\n' for i in range(20))
+    body = ''.join(f'f{i}: {hex(i)} 0x00 mstore 0x20 0x00 return\n' for i in range(20))
+    src = f'''
+    {fns}
+    #define macro MAIN() = takes(0) returns(0) {{
+        0x00 calldataload 0xe0 shr
+        __FUNC_DISPATCH()
+        0x00 0x00 revert
+        caller pop
+        {body}
+    }}
+    '''
+    result = compile_src(src, {}, False, optimize='gas', size_report=True)
+    for i in range(20):
+        out = run_evm(result.runtime, keccak256(f'f{i}()'.encode())[:4])
+        assert out.success and int.from_bytes(out.output, 'big') == i
+    report = result.size_report
+    assert report is not None
+    assert sum(m.exclusive for m in report.runtime.macros) == report.runtime.code
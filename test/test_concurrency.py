@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+import time
+import pytest
+from py_huff.compile import compile, compile_src
+from py_huff.lexer import lex_huff, lex_huff_cached
+from py_huff.sources import MemorySource
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+ENTRIES = ['including.huff', 'code_tables.huff', 'outlining.huff', 'binary_table.huff']
+
+CONSTRUCTOR_SRC = '''
+#define function transfer(address, uint256) nonpayable returns (uint256)
+#define event Transfer(address indexed, address indexed, uint256)
+#define macro CONSTRUCTOR() = takes(0) returns(0) {
+    __RETURN_RUNTIME(0x0)
+}
+#define macro MAIN() = takes(0) returns(0) {
+    __FUNC_SIG(transfer) __EVENT_HASH(Transfer) stop
+}
+'''
+
+
+def is_free_threaded() -> bool:
+    return not getattr(sys, '_is_gil_enabled', lambda: True)()
+
+
+def compile_job(i: int):
+    entry = ENTRIES[i % len(ENTRIES)]
+    if i % 5 == 0:
+        return entry, compile_src(CONSTRUCTOR_SRC, {}, i % 2 == 0)
+    return entry, compile(os.path.join(EXAMPLES, entry), {}, i % 2 == 0, 'size' if i % 3 == 0 else None)
+
+
+def run_jobs(jobs: int, workers: int):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(compile_job, range(jobs)))
+
+
+def test_constructor_builtins_do_not_print(capsys):
+    compile_src(CONSTRUCTOR_SRC, {}, False)
+    assert capsys.readouterr().out == ''
+
+
+def test_lex_cache_returns_equal_tree():
+    src = '#define macro MAIN() = takes(0) returns(0) { 0x01 }'
+    assert lex_huff_cached(src) is lex_huff_cached(src)
+    assert lex_huff_cached(src) == lex_huff(src)
+
+
+def test_concurrent_compiles_are_deterministic():
+    jobs = 200
+    expected = [compile_job(i) for i in range(jobs)]
+    assert run_jobs(jobs, workers=16) == expected
+
+
+def test_concurrent_memory_source_compiles():
+    files = {
+        'main.huff': '#include "./lib.huff"\n#define macro MAIN() = takes(0) returns(0) { LIB() }',
+        'lib.huff': '#define table T {0xc0ffee}\n#define macro LIB() = takes(0) returns(0) { __tablestart(T) }',
+    }
+    source = MemorySource(files)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: compile('main.huff', {}, False, source=source), range(64)))
+    assert all(result == results[0] for result in results)
+
+
+@pytest.mark.skipif(not os.environ.get('PY_HUFF_BENCH'), reason='timing sensitive, set PY_HUFF_BENCH=1 to run')
+def test_throughput_scaling():
+    jobs = 120
+    run_jobs(jobs, workers=1)
+    start = time.perf_counter()
+    run_jobs(jobs, workers=1)
+    serial = time.perf_counter() - start
+    start = time.perf_counter()
+    run_jobs(jobs, workers=8)
+    threaded = time.perf_counter() - start
+    if is_free_threaded() and (os.cpu_count() or 1) >= 4:
+        # Without a GIL independent compilations should actually run in parallel
+        assert threaded < serial, f'No speedup: serial {serial:.3f}s, threaded {threaded:.3f}s'
+    else:
+        # With the GIL threads can't speed up compilation but contention mustn't slow it down much
+        assert threaded < 2 * serial + 0.5, f'Contention: serial {serial:.3f}s, threaded {threaded:.3f}s'
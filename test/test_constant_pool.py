@@ -0,0 +1,101 @@
+from py_huff.compile import compile_src
+from py_huff.constant_pool import load_gas, EXPANSION_GAS
+from py_huff.opcodes import op
+from evm import run_evm
+
+HASH = '0x' + 'ab' * 32
+
+REPEATED = f'''
+#define constant SLOT = {HASH}
+#define macro MAIN() = takes(0) returns(0) {{
+    0x00 calldataload
+    dup1 [SLOT] add 0x00 sstore
+    dup1 [SLOT] xor 0x01 sstore
+    [SLOT] sub 0x02 sstore
+    stop
+}}
+'''
+
+
+def test_repeated_constant_pooled():
+    plain = compile_src(REPEATED, {}, None)
+    optimized = compile_src(REPEATED, {}, None, 'size')
+    # 3 * 33 byte pushes become 3 * 13 byte loads, a `STOP` isn't needed and the word is stored once
+    assert len(plain.runtime) - len(optimized.runtime) == 3 * 33 - 3 * 13 - 32
+    assert optimized.runtime.endswith(bytes.fromhex('ab' * 32))
+    assert optimized.runtime.count(bytes.fromhex('ab' * 32)) == 1
+    note, = optimized.optimizations
+    assert note.pass_name == 'constant-pool'
+    assert note.bytes_saved == 3 * 33 - 3 * 13 - 32
+    assert note.extra_gas == 3 * (load_gas(op('push0')) - 3) + EXPANSION_GAS
+    for value in [0, 7, 2**255]:
+        calldata = value.to_bytes(32, 'big')
+        expected, result = run_evm(plain.runtime, calldata), run_evm(optimized.runtime, calldata)
+        assert result.success and result.storage == expected.storage
+        assert result.gas_used - expected.gas_used == note.extra_gas
+
+
+def test_pre_shanghai_zero():
+    # Loads are wider with `PUSH1 0`, a fourth site makes pooling worth it
+    src = REPEATED.replace('dup1 [SLOT] xor', 'dup1 [SLOT] xor [SLOT] or')
+    plain = compile_src(src, {}, 'paris')
+    optimized = compile_src(src, {}, 'paris', 'size')
+    assert bytes.fromhex('5f') not in optimized.runtime[:-32]
+    # `RETURNDATASIZE` isn't zero after calls
+    assert bytes.fromhex('3d') not in optimized.runtime[:-32]
+    assert [note.pass_name for note in optimized.optimizations] == ['constant-pool']
+    calldata = (5).to_bytes(32, 'big')
+    assert run_evm(optimized.runtime, calldata).storage == run_evm(plain.runtime, calldata).storage
+
+
+def test_not_worth_pooling():
+    once = REPEATED.replace('dup1 [SLOT] xor', 'dup1 0x01 xor').replace('[SLOT] sub', '0x02 sub')
+    assert compile_src(once, {}, None, 'size').optimizations == []
+    # Narrow constants are cheaper to push
+    narrow = REPEATED.replace(HASH, '0xabcdef')
+    assert compile_src(narrow, {}, None, 'size').optimizations == []
+
+
+def test_stop_guard():
+    falls_off = REPEATED.replace('stop', '')
+    optimized = compile_src(falls_off, {}, None, 'size')
+    assert optimized.runtime[-33] == 0x00
+    result = run_evm(optimized.runtime, b'')
+    assert result.success
+
+
+def test_memory_preserved():
+    src = f'''
+    #define constant MASK = {HASH}
+    #define macro MAIN() = takes(0) returns(0) {{
+        0x00 calldataload 0x00 mstore
+        0x20 calldataload [MASK] and 0x20 mstore
+        [MASK] 0x00 mload xor 0x40 mstore
+        [MASK] 0x00 mload or 0x60 mstore
+        0x80 0x00 return
+    }}
+    '''
+    plain = compile_src(src, {}, None)
+    optimized = compile_src(src, {}, None, 'size')
+    assert [note.pass_name for note in optimized.optimizations] == ['constant-pool']
+    calldata = bytes(range(64))
+    expected, result = run_evm(plain.runtime, calldata), run_evm(optimized.runtime, calldata)
+    assert result.success and result.output == expected.output
+    mask = int(HASH, 16)
+    words = [int.from_bytes(calldata[i:i + 32], 'big') for i in (0, 32)]
+    assert result.output == b''.join(
+        word.to_bytes(32, 'big') for word in (words[0], words[1] & mask, words[0] ^ mask, words[0] | mask)
+    )
+
+
+def test_msize_not_pooled():
+    src = REPEATED.replace('stop', 'msize 0x03 sstore stop')
+    assert compile_src(src, {}, None, 'size').optimizations == []
+
+
+def test_constructor_and_size_report():
+    src = REPEATED.replace('MAIN', 'CONSTRUCTOR') + '#define macro MAIN() = takes(0) returns(0) { stop }'
+    result = compile_src(src, {}, None, 'size', size_report=True)
+    assert [(note.pass_name, note.target) for note in result.optimizations] == [('constant-pool', 'CONSTRUCTOR')]
+    plain = compile_src(src, {}, None)
+    assert run_evm(result.deploy, b'').storage == run_evm(plain.deploy, b'').storage
@@ -0,0 +1,66 @@
+import json
+import pytest
+from py_huff.compile import compile_src
+from py_huff.create2 import (
+    MineParams, create2_address, init_code_hash, leading_zero_bytes, mine, main, to_salt
+)
+from py_huff.utils import keccak256
+
+SRC = '''
+#define macro MAIN() = takes(0) returns(0) { caller 0x00 mstore 0x20 0x00 return }
+'''
+
+PARAMS = MineParams(bytes.fromhex('deadbeef' * 5), keccak256(b'\x00'), b'\x01\x02', 1)
+
+
+@pytest.mark.parametrize('deployer, salt, code, address', [
+    ('00' * 20, '00' * 32, '00', '4d1a2e2bb4f88f0250f26ffff098b0b30b26bf38'),
+    ('00' * 16 + 'deadbeef', '00' * 28 + 'cafebabe', 'deadbeef', '60f3f640a8508fc6a86d45df051962668e1e8ac7'),
+    ('00' * 20, '00' * 32, '', 'e33c0c7f7df4809055c3eba6c09cfe4baf1bd9e0')
+])
+def test_eip1014_examples(deployer: str, salt: str, code: str, address: str):
+    code_hash = keccak256(bytes.fromhex(code))
+    assert create2_address(bytes.fromhex(deployer), bytes.fromhex(salt), code_hash).hex() == address
+
+
+def test_mine_matches_serial_search():
+    serial = mine(PARAMS, limit=3000, max_matches=None, max_workers=1)
+    assert serial.searched == serial.next_counter == 3000
+    expected = [
+        to_salt(PARAMS, counter) for counter in range(3000)
+        if leading_zero_bytes(create2_address(PARAMS.deployer, to_salt(PARAMS, counter), PARAMS.init_code_hash)) >= 1
+    ]
+    assert [match.salt for match in serial.matches] == expected
+    for match in serial.matches:
+        assert match.address == create2_address(PARAMS.deployer, match.salt, PARAMS.init_code_hash)
+        assert match.salt.startswith(b'\x01\x02')
+
+    parallel = mine(PARAMS, limit=3000, max_matches=None, max_workers=2, batch_size=400)
+    assert parallel.matches == serial.matches
+    # Stops once enough matches were found below the searched frontier
+    first = mine(PARAMS, max_matches=2, max_workers=2, batch_size=100)
+    assert len(first.matches) >= 2
+    assert first.matches == serial.matches[:len(first.matches)]
+
+
+def test_cli_resume(tmp_path, capsys):
+    path = tmp_path / 'c.huff'
+    path.write_text(SRC)
+    code_hash = init_code_hash(compile_src(SRC, {}, None))
+    deployer = '0x' + '11' * 20
+    main([str(path), '--deployer', deployer, '--salt', '0x' + '00' * 32])
+    assert capsys.readouterr().out.strip() == \
+        '0x' + create2_address(bytes.fromhex('11' * 20), bytes(32), code_hash).hex()
+
+    state = tmp_path / 'state.json'
+    args = [str(path), '--deployer', deployer, '--matches', '0', '--resume', str(state), '-j', '1']
+    main([*args, '--limit', '500', '--batch-size', '100'])
+    first = capsys.readouterr().out.split('\n')
+    assert json.loads(state.read_text())['nextCounter'] == 500
+    main([*args, '--limit', '500', '--batch-size', '100'])
+    out, err = capsys.readouterr()
+    assert 'resuming at counter 500' in err
+    assert json.loads(state.read_text())['nextCounter'] == 1000
+    full = mine(MineParams(bytes.fromhex('11' * 20), code_hash, b'', 1), limit=1000, max_matches=None, max_workers=1)
+    assert out.strip().split('\n') == [f'0x{m.salt.hex()} 0x{m.address.hex()}' for m in full.matches]
+    assert set(filter(None, first)) <= set(out.split('\n'))
@@ -0,0 +1,150 @@
+import pytest
+import py_huff.codegen
+from py_huff.assembler import Asm, Mark, MarkId, MarkPurpose, assemble, to_start_mark, to_end_mark
+from py_huff.compile import compile_src
+from py_huff.context import ContextTracker
+from py_huff.dispatch import (
+    DispatchEntry, DispatchStrategy, DISPATCH_STRATEGIES, gen_dispatch, dispatch_costs,
+    select_strategy
+)
+from py_huff.opcodes import Op, op, create_push
+from py_huff.utils import keccak256
+from evm import run_evm
+
+ZERO = op('push0')
+
+
+def selector(i: int) -> bytes:
+    return keccak256(f'f{i}()'.encode())[:4]
+
+
+def build_dispatcher(n: int, strategy: DispatchStrategy) -> bytes:
+    '''Dispatcher over `f0()`..`f{n-1}()`, each function stops with its index on the stack'''
+    ctx = ContextTracker(())
+    labels = [MarkId(ctx.next_obj_id(), MarkPurpose.Label) for _ in range(n)]
+    entries = [DispatchEntry(int.from_bytes(selector(i), 'big'), labels[i]) for i in range(n)]
+    dispatch, table, table_id = gen_dispatch(entries, ctx, ZERO, strategy)
+    asm: list[Asm] = [
+        ZERO, op('calldataload'), create_push(b'\xe0'), op('shr'),
+        *dispatch,
+        ZERO, ZERO, op('revert')
+    ]
+    for i, label in enumerate(labels):
+        asm.extend([
+            Mark(label), op('jumpdest'),
+            create_push(bytes([i])), op('stop')
+        ])
+    if table is not None:
+        assert table_id is not None
+        asm.extend([to_start_mark(table_id), *table, to_end_mark(table_id)])
+    code, _ = assemble(asm)
+    return code
+
+
+def average_gas(code: bytes, n: int) -> float:
+    return sum(run_evm(code, selector(i)).gas_used for i in range(n)) / n
+
+
+@pytest.mark.parametrize('strategy', DISPATCH_STRATEGIES)
+@pytest.mark.parametrize('n', [2, 3, 7, 16, 41])
+def test_routes_selectors(strategy: DispatchStrategy, n: int):
+    code = build_dispatcher(n, strategy)
+    for i in range(n):
+        result = run_evm(code, selector(i))
+        assert result.success and result.stack[-1] == i
+    for miss in [b'\x00' * 4, b'\xff' * 4, selector(n)]:
+        assert not run_evm(code, miss).success
+
+
+def test_strategy_by_function_count():
+    def entries(n: int) -> list[DispatchEntry]:
+        return [DispatchEntry(int.from_bytes(selector(i), 'big'), MarkId(None, i)) for i in range(n)]  # type: ignore
+    assert select_strategy(entries(2), ZERO) == 'linear'
+    assert select_strategy(entries(8), ZERO) == 'binary'
+    assert select_strategy(entries(40), ZERO) == 'jump_table'
+
+
+@pytest.mark.parametrize('n', [8, 40])
+def test_gas_against_linear(n: int):
+    linear = average_gas(build_dispatcher(n, 'linear'), n)
+    ctx = ContextTracker(())
+    entries = [
+        DispatchEntry(int.from_bytes(selector(i), 'big'), MarkId(ctx.next_obj_id(), MarkPurpose.Label))
+        for i in range(n)
+    ]
+    costs = dispatch_costs(entries, ZERO)
+    chosen = min(costs, key=lambda strategy: costs[strategy])
+    assert average_gas(build_dispatcher(n, chosen), n) < linear
+    # The model is exact up to the constant cost of the code around the dispatcher
+    offset = linear - costs['linear']
+    for strategy in DISPATCH_STRATEGIES:
+        assert average_gas(build_dispatcher(n, strategy), n) - offset == pytest.approx(costs[strategy], abs=1)
+
+
+def test_builtin():
+    fns = ''.join(f'#define function f{i}() nonpayable returns ()\n' for i in range(20))
+    body = ''.join(f'f{i}: {hex(i)} 0x00 mstore 0x20 0x00 return\n' for i in range(20))
+    src = f'''
+    {fns}
+    #define macro MAIN() = takes(0) returns(0) {{
+        0x00 calldataload 0xe0 shr
+        __FUNC_DISPATCH()
+        0x00 0x00 revert
+        {body}
+    }}
+    '''
+    for avoid_push0 in [False, True]:
+        result = compile_src(src, {}, avoid_push0, size_report=True)
+        for i in range(20):
+            out = run_evm(result.runtime, selector(i))
+            assert out.success and int.from_bytes(out.output, 'big') == i
+        assert not run_evm(result.runtime, b'\x00' * 4).success
+        # The jump table is appended like a code table
+        report = result.size_report
+        assert report is not None and report.runtime.tables[0].names == ['__FUNC_DISPATCH#0']
+
+
+def test_builtin_subset_and_missing_label():
+    src = '''
+    #define function f0() nonpayable returns ()
+    #define function f1() nonpayable returns ()
+    #define macro MAIN() = takes(0) returns(0) {
+        0x00 calldataload 0xe0 shr
+        __FUNC_DISPATCH(f1)
+        0x00 0x00 revert
+        f1: 0x01 0x00 mstore 0x20 0x00 return
+    }
+    '''
+    runtime = compile_src(src, {}, False).runtime
+    assert int.from_bytes(run_evm(runtime, selector(1)).output, 'big') == 1
+    assert not run_evm(runtime, selector(0)).success
+    with pytest.raises(AssertionError, match='No label "f0" for function "f0\\(\\)"'):
+        compile_src(src.replace('(f1)', '(f0, f1)'), {}, False)
+
+
+@pytest.mark.parametrize('version, zero', [('paris', create_push(b'\x00')), ('shanghai', ZERO)])
+def test_builtin_zero_safe_after_calls(monkeypatch: pytest.MonkeyPatch, version: str, zero: Op):
+    # `RETURNDATASIZE` is only zero until the first call, which may precede the dispatcher
+    zeros: list[Op] = []
+
+    def recording_gen_dispatch(entries, ctx, zero_op, strategy=None):
+        zeros.append(zero_op)
+        return gen_dispatch(entries, ctx, zero_op, strategy)
+
+    monkeypatch.setattr(py_huff.codegen, 'gen_dispatch', recording_gen_dispatch)
+    fns = ''.join(f'#define function f{i}() nonpayable returns ()\n' for i in range(20))
+    body = ''.join(f'f{i}: {hex(i)} 0x00 mstore 0x20 0x00 return\n' for i in range(20))
+    src = f'''
+    {fns}
+    #define macro MAIN() = takes(0) returns(0) {{
+        0x00 calldataload 0xe0 shr
+        __FUNC_DISPATCH()
+        0x00 0x00 revert
+        {body}
+    }}
+    '''
+    runtime = compile_src(src, {}, version).runtime
+    assert zeros == [zero]
+    for i in range(20):
+        out = run_evm(runtime, selector(i))
+        assert out.success and int.from_bytes(out.output, 'big') == i
@@ -0,0 +1,75 @@
+import pytest
+from py_huff.compile import compile_src
+from py_huff.evm_version import EVM_VERSIONS, supports_opcode, validate_evm_version
+from py_huff.opcodes import OP_MAP
+from evm import run_evm
+
+MCOPY = '''
+#define macro COPY(dest) = takes(0) returns(0) {
+    0x20 0x00 <dest> mcopy
+}
+#define macro MAIN() = takes(0) returns(0) {
+    0x01 0x00 mstore
+    COPY(0x20)
+    0x20 0x20 return
+}
+'''
+
+
+def test_opcode_availability():
+    assert [supports_opcode(v, OP_MAP['push0']) for v in EVM_VERSIONS] == [False, False, True, True, True]
+    for name in ['tload', 'tstore', 'mcopy', 'blobhash', 'blobbasefee']:
+        assert not supports_opcode('shanghai', OP_MAP[name])
+        assert supports_opcode('cancun', OP_MAP[name])
+    # Always available opcodes, incl. `prevrandao` which reuses `difficulty`'s opcode
+    assert all(supports_opcode('london', OP_MAP[name]) for name in ['basefee', 'prevrandao', 'shr'])
+
+
+def test_new_opcodes():
+    result = compile_src(MCOPY, {}, 'cancun')
+    assert bytes.fromhex('60205f60205e') in result.runtime
+    assert run_evm(result.runtime).output == (1).to_bytes(32, 'big')
+    src = '#define macro MAIN() = takes(0) returns(0) { 0x00 blobhash blobbasefee }'
+    assert compile_src(src, {}, 'cancun').runtime == bytes.fromhex('5f494a')
+
+
+@pytest.mark.parametrize('version, opcode', [
+    ('shanghai', 'mcopy'), ('paris', 'push0'), ('shanghai', 'tstore')
+])
+def test_unsupported_opcodes(version: str, opcode: str):
+    src = MCOPY.replace('mcopy', opcode)
+    error = f'Opcode "{opcode}" requires EVM version .* \\(target: {version}\\) in MAIN -> COPY'
+    with pytest.raises(AssertionError, match=error):
+        compile_src(src, {}, version)
+
+
+def test_zero_selection():
+    src = '''
+    #define macro MAIN() = takes(0) returns(0) { 0x00 0x00 sstore }
+    '''
+    shanghai = compile_src(src, {}, 'shanghai')
+    paris = compile_src(src, {}, 'paris')
+    assert shanghai.runtime == bytes.fromhex('5f5f55')
+    assert paris.runtime == bytes.fromhex('6000600055')
+    assert b'\x5f' not in paris.deploy
+    # The former `avoid_push0` flag maps to the last version without `PUSH0`
+    assert compile_src(src, {}, True) == paris
+    assert compile_src(src, {}, False) == compile_src(src, {}, 'prague')
+
+
+@pytest.mark.parametrize('version', ['london', 'paris'])
+def test_zero_constants_without_push0(version: str):
+    src = '''
+    #define constant Z = 0x00
+    #define constant O = 0x05
+    #define constant SLOT = FREE_STORAGE_POINTER()
+    #define macro MAIN() = takes(0) returns(0) { [Z] [O] [SLOT] }
+    '''
+    assert compile_src(src, {}, version).runtime == bytes.fromhex('600060056000')
+    assert compile_src(src, {'O': b'\x00'}, version).runtime == bytes.fromhex('600060006000')
+    assert compile_src(src, {}, 'shanghai').runtime == bytes.fromhex('5f60055f')
+
+
+def test_unknown_version():
+    with pytest.raises(AssertionError, match='Unknown EVM version "homestead"'):
+        validate_evm_version('homestead')  # type: ignore
@@ -0,0 +1,87 @@
+import tracemalloc
+import pytest
+from py_huff.codegen import CompileOptions, GlobalScope, Scope, expand_macro_to_asm
+from py_huff.context import ContextTracker
+from py_huff.parser import Macro, Invocation, GeneralRef, LabelDef
+from py_huff.compile import compile_src
+
+
+def nested_scope(depth: int) -> GlobalScope:
+    '''MAIN -> M0 -> M1 -> ... -> M{depth}, each macro defining and jumping to a label'''
+    macros = {
+        f'M{i}': Macro(f'M{i}', [], [
+            GeneralRef('caller'), LabelDef('l'), GeneralRef('l'), Invocation(f'M{i + 1}', [])
+        ])
+        for i in range(depth)
+    }
+    macros[f'M{depth}'] = Macro(f'M{depth}', [], [GeneralRef('caller')])
+    macros['MAIN'] = Macro('MAIN', [], [Invocation('M0', [])])
+    return GlobalScope(macros, {}, {}, {}, {}, {}, {})
+
+
+def expand(depth: int, track_invocations: bool = False):
+    scope = Scope(nested_scope(depth), None, track_invocations)
+    return expand_macro_to_asm(CompileOptions('prague'), 'MAIN', scope, [], {}, ContextTracker(tuple()), tuple())
+
+
+def peak_memory(depth: int) -> int:
+    tracemalloc.start()
+    asm = expand(depth)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert len(asm) == 4 * depth + 1
+    return peak
+
+
+def test_deep_nesting_does_not_recurse():
+    asm = expand(20_000, track_invocations=True)
+    assert len(asm) == 6 * 20_000 + 3
+
+
+def test_deep_nesting_compiles_by_default():
+    depth = 2_000
+    src = '\n'.join(
+        f'#define macro M{i}() = takes(0) returns(0) {{ caller M{i + 1}() }}' for i in range(depth)
+    ) + f'''
+    #define macro M{depth}() = takes(0) returns(0) {{ stop }}
+    #define macro MAIN() = takes(0) returns(0) {{ M0() }}
+    '''
+    assert compile_src(src, {}, False).runtime == bytes.fromhex('33') * depth + bytes.fromhex('00')
+
+
+def test_nesting_linear_memory():
+    small, large = peak_memory(2_000), peak_memory(8_000)
+    # 4x the depth, allow for slack but reject quadratic growth (16x)
+    assert large < 8 * small
+
+
+def test_circular_and_label_errors_keep_trace():
+    with pytest.raises(AssertionError, match='Circular macro refrence in A'):
+        compile_src('''
+        #define macro A() = takes(0) returns(0) { B() }
+        #define macro B() = takes(0) returns(0) { A() }
+        #define macro MAIN() = takes(0) returns(0) { A() }
+        ''', {}, False)
+    with pytest.raises(AssertionError, match='Label "nope" not found in MAIN -> A -> B'):
+        compile_src('''
+        #define macro A() = takes(0) returns(0) { B() }
+        #define macro B() = takes(0) returns(0) { nope }
+        #define macro MAIN() = takes(0) returns(0) { A() }
+        ''', {}, False)
+    with pytest.raises(AssertionError, match='Duplicate label "x" in macro "MAIN -> A"'):
+        compile_src('''
+        #define macro A() = takes(0) returns(0) { x: x: }
+        #define macro MAIN() = takes(0) returns(0) { A() }
+        ''', {}, False)
+
+
+def test_global_labels_visible_in_children_only():
+    src = '''
+    #define macro C() = takes(0) returns(0) { global_end jump }
+    #define macro B(lbl) = takes(0) returns(0) { C() <lbl> jump }
+    #define macro MAIN() = takes(0) returns(0) { B(local) local: global_end: stop }
+    '''
+    # C: push1 07 jump, B: push1 06 jump, local: 06 jumpdest, global_end: 07 jumpdest
+    assert compile_src(src, {}, False).runtime.hex() == '600756600656' '5b5b00'
+    with pytest.raises(AssertionError, match='Label "local" not found in MAIN -> B -> C'):
+        compile_src(src.replace('global_end jump', 'local jump'), {}, False)
@@ -0,0 +1,69 @@
+import pytest
+import py_huff.compile
+from py_huff.codegen import CompileOptions, GlobalScope, Scope, expand_macro_to_asm
+from py_huff.compile import compile_src
+from py_huff.context import ContextTracker
+from py_huff.expansion import ExpansionLimits, check_expansion, predict_expansion
+from py_huff.parser import Invocation, GeneralRef, LabelDef, Macro
+
+
+def exponential(levels: int, fanout: int = 4) -> str:
+    '''MAIN -> M0 -> M1 -> ..., every macro invoking the next `fanout` times'''
+    macros = [f'#define macro M{levels}() = takes(0) returns(0) {{ caller pop }}']
+    for i in reversed(range(levels)):
+        invocations = ' '.join([f'M{i + 1}()'] * fanout)
+        macros.append(f'#define macro M{i}() = takes(0) returns(0) {{ {invocations} }}')
+    macros.append('#define macro MAIN() = takes(0) returns(0) { M0() }')
+    return '\n'.join(macros)
+
+
+def test_prediction_matches_expansion():
+    macros = {
+        'LEAF': Macro('LEAF', [], [GeneralRef('caller'), LabelDef('l'), GeneralRef('l')]),
+        'MID': Macro('MID', [], [Invocation('LEAF', []), GeneralRef('pop'), Invocation('LEAF', [])]),
+        'MAIN': Macro('MAIN', [], [Invocation('MID', []), Invocation('MID', []), Invocation('LEAF', [])])
+    }
+    costs = predict_expansion('MAIN', macros, {})
+    assert costs is not None
+    scope = Scope(GlobalScope(macros, {}, {}, {}, {}, {}, {}), None)
+    asm = expand_macro_to_asm(CompileOptions('prague'), 'MAIN', scope, [], {}, ContextTracker(tuple()), tuple())
+    assert costs['MAIN'].steps == len(asm) == 2 * (2 * 4 + 1) + 4
+    assert costs['MAIN'].depth == 3
+
+
+def test_exponential_blow_up_fails_fast(monkeypatch: pytest.MonkeyPatch):
+    def never_expand(*args, **kwargs):
+        raise AssertionError('expand_macro_to_asm entered')
+
+    monkeypatch.setattr(py_huff.compile, 'expand_macro_to_asm', never_expand)
+    with pytest.raises(AssertionError) as err:
+        compile_src(exponential(40), {}, None)
+    message = str(err.value)
+    assert 'MAIN is predicted to expand to 2417851639229258349412352 steps, exceeding the limit of 1000000' in message
+    assert 'MAIN (2417851639229258349412352 steps) -> M0 (1x 2417851639229258349412352 steps) -> M1 (4x ' in message
+    assert message.endswith('-> M40 (4x 2 steps)')
+
+
+def test_configurable_limits():
+    src = exponential(3)
+    assert len(compile_src(src, {}, None).runtime) == 4 ** 3 * 2
+    with pytest.raises(AssertionError, match='predicted to expand to 128 steps, exceeding the limit of 100'):
+        compile_src(src, {}, None, expansion_limits=ExpansionLimits(100, 1024))
+    error = 'Macro nesting depth 5 of MAIN exceeds the limit of 4: MAIN -> M0 -> M1 -> M2 -> M3'
+    with pytest.raises(AssertionError, match=error):
+        compile_src(src, {}, None, expansion_limits=ExpansionLimits(1000, 4))
+
+
+def test_deep_chain_shortened():
+    macros = {f'M{i}': Macro(f'M{i}', [], [Invocation(f'M{i + 1}', [])]) for i in range(2000)}
+    macros['M2000'] = Macro('M2000', [], [GeneralRef('stop')])
+    error = r'depth 2001 of M0 exceeds the limit of 1024: M0 -> M1 -> M2 -> M3 -> \.\.\. -> M1998 -> M1999 -> M2000$'
+    with pytest.raises(AssertionError, match=error):
+        check_expansion('M0', macros, {}, ExpansionLimits(1_000_000, 1024))
+    check_expansion('M0', macros, {})
+
+
+def test_circular_left_to_expansion():
+    macros = {'A': Macro('A', [], [Invocation('B', [])]), 'B': Macro('B', [], [Invocation('A', [])])}
+    assert predict_expansion('A', macros, {}) is None
+    check_expansion('A', macros, {})
@@ -0,0 +1,52 @@
+import random
+import pytest
+import py_huff.fuzz
+from py_huff.compile import compile_src
+from py_huff.fuzz import ProgramGenerator, fuzz, run_case, shrink, measure_scaling, stress_comments
+
+
+def test_generated_programs_compile():
+    gen = ProgramGenerator(random.Random(1234))
+    for _ in range(50):
+        compile_src(gen.program(), {}, False)
+
+
+def test_fuzz_smoke():
+    report = fuzz(40, seed=7, scaling=False)
+    assert report.compiles == 40
+    assert report.failures == []
+
+
+def test_shrink_to_minimal_reproducer():
+    src = '\n'.join(f'#define constant C{i} = 0x{i:02x}' for i in range(40))
+    src += '\n#define macro MAIN() = takes(0) returns(0) { caller BAD caller }\n'
+    assert shrink(src, lambda candidate: 'BAD' in candidate) == 'BAD'
+
+
+def test_push0_followed_by_literal():
+    src = '#define macro MAIN() = takes(0) returns(0) { push0 0x1234 push2 0x01 }'
+    assert compile_src(src, {}, False).runtime.hex() == '5f611234610001'
+
+
+def test_scaling_measurement():
+    result, failure = measure_scaling('comments', stress_comments, start=16, max_seconds=0.01)
+    assert failure is None
+    assert len(result.sizes) >= 2 and result.sizes == sorted(result.sizes)
+
+
+def test_rejected_generated_program_is_finding(monkeypatch):
+    def reject(*_, **__):
+        raise AssertionError('Unused macro "X"')
+    monkeypatch.setattr(py_huff.fuzz, 'compile_src', reject)
+    report = fuzz(10, seed=3, mutate_ratio=0.0, scaling=False, shrink_budget=0)
+    assert report.rejected == 0
+    assert [(f.kind, f.error) for f in report.failures] == [('rejected', 'AssertionError: Unused macro "X"')]
+    assert run_case('#define macro MAIN() = takes(0) returns(0) { stop', None)[0] == 'rejected'
+
+
+def test_interrupt_not_swallowed(monkeypatch):
+    def interrupt(*_, **__):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(py_huff.fuzz, 'compile_src', interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        fuzz(1, scaling=False)
@@ -0,0 +1,95 @@
+import os
+import random
+import pytest
+from parsimonious.exceptions import ParseError
+from py_huff.incremental import (
+    TextEdit, apply_edit, parse_incremental, tree_root, tree_macros, benchmark
+)
+from py_huff.lexer import lex_huff
+from py_huff.parser import parse_macro, get_defs
+
+SRC = '''#define constant X = 0x01
+// helper
+#define macro A(x) = takes(0) returns(0) { <x> 0x02 add }
+
+#define macro MAIN() = takes(0) returns(0) {
+    A(0x03) [X]
+}
+'''
+
+SNIPPETS = [' ', '\n', '0', 'a', '//', '/*', '*/', '}', '{', '#define macro B() = takes(0) returns(0) {}\n']
+
+
+def check(tree, src):
+    assert tree.src == src
+    assert tree_root(tree) == lex_huff(src)
+    assert tree_macros(tree) == [parse_macro(m) for m in get_defs(lex_huff(src), 'macro')]
+
+
+def test_unaffected_macros_reused():
+    tree = parse_incremental(SRC)
+    a, main = tree_macros(tree)
+    pos = SRC.index('0x01') + 3
+    new_tree = apply_edit(tree, TextEdit(pos, pos, '2'))
+    check(new_tree, SRC[:pos] + '2' + SRC[pos:])
+    assert new_tree.relexed == 1
+    new_a, new_main = tree_macros(new_tree)
+    assert new_a is a and new_main is main
+
+
+def test_edit_inside_macro_shifts_later_defs():
+    tree = parse_incremental(SRC)
+    pos = SRC.index('add')
+    new_tree = apply_edit(tree, TextEdit(pos, pos + 3, 'sub dup1'))
+    check(new_tree, SRC.replace('add', 'sub dup1'))
+    assert new_tree.relexed == 1
+
+
+def test_line_comment_cannot_swallow_next_definition():
+    src = '#define constant X = 0x01 #define constant Y = 0x02\n#define constant Z = 0x03\n'
+    tree = parse_incremental(src)
+    pos = src.index('#define constant Y')
+    new_tree = apply_edit(tree, TextEdit(pos - 1, pos - 1, '//'))
+    check(new_tree, src[:pos - 1] + '//' + src[pos - 1:])
+    assert len(new_tree.defs) == 2
+
+
+def test_opened_block_comment_falls_back_to_full_parse():
+    tree = parse_incremental(SRC)
+    pos = SRC.index('#define macro A')
+    with pytest.raises(ParseError):
+        apply_edit(tree, TextEdit(pos, pos, '/*'))
+    closed = apply_edit(tree, TextEdit(pos, pos, '/* */'))
+    check(closed, SRC[:pos] + '/* */' + SRC[pos:])
+
+
+def test_out_of_bounds_edit():
+    with pytest.raises(AssertionError):
+        apply_edit(parse_incremental(SRC), TextEdit(0, len(SRC) + 1, ''))
+
+
+def test_random_edits_match_full_parse():
+    rng = random.Random(7)
+    tree = parse_incremental(SRC)
+    applied = 0
+    while applied < 300:
+        start = rng.randint(0, len(tree.src))
+        end = min(len(tree.src), start + rng.choice([0, 0, 1, 3]))
+        edit = TextEdit(start, end, rng.choice(SNIPPETS))
+        src = tree.src[:start] + edit.text + tree.src[end:]
+        try:
+            lex_huff(src)
+            [parse_macro(m) for m in get_defs(lex_huff(src), 'macro')]
+        except (ParseError, AssertionError):
+            with pytest.raises((ParseError, AssertionError)):
+                apply_edit(tree, edit)
+            continue
+        tree = apply_edit(tree, edit)
+        check(tree, src)
+        applied += 1
+
+
+@pytest.mark.skipif(not os.environ.get('PY_HUFF_BENCH'), reason='timing sensitive, set PY_HUFF_BENCH=1 to run')
+def test_incremental_faster_on_large_file():
+    full, incremental = benchmark(macros=300, edits=5)
+    assert incremental * 5 < full
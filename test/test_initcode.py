@@ -0,0 +1,53 @@
+import pytest
+from py_huff.assembler import asm_to_bytecode
+from py_huff.context import ContextTracker
+from py_huff.initcode import gen_init_candidates, select_init, deploy_gas
+from py_huff.opcodes import op
+from evm import deploy
+
+RUNTIME_SIZES = [1, 2, 17, 31, 32, 33, 63, 64, 65, 100, 256, 511, 512, 513, 1000]
+
+
+def sample_runtime(size: int, zero_every: int) -> bytes:
+    return bytes(
+        0 if zero_every and i % zero_every == 0 else (i * 97 + 13) % 255 + 1
+        for i in range(size)
+    )
+
+
+@pytest.mark.parametrize('size', RUNTIME_SIZES)
+@pytest.mark.parametrize('zero_op', ['push0', 'returndatasize'])
+@pytest.mark.parametrize('zero_every', [0, 3, 1])
+def test_init_strategies_deploy_runtime(size: int, zero_op: str, zero_every: int):
+    runtime = sample_runtime(size, zero_every)
+    runtime_id = ContextTracker(tuple()).next_obj_id()
+    for strategy in gen_init_candidates(runtime, runtime_id, op(zero_op)):
+        code, gas_used = deploy(asm_to_bytecode(strategy.asm))
+        assert code == runtime, f'Strategy {strategy.name} deployed wrong code'
+        assert gas_used == strategy.exec_gas, f'Strategy {strategy.name} mispriced'
+
+
+@pytest.mark.parametrize('size', RUNTIME_SIZES)
+def test_init_selection_is_cheapest(size: int):
+    runtime = sample_runtime(size, 5)
+    runtime_id = ContextTracker(tuple()).next_obj_id()
+    choice = select_init(runtime, runtime_id, op('push0'))
+    code, gas_used = deploy(choice.deploy)
+    assert code == runtime
+    for strategy in gen_init_candidates(runtime, runtime_id, op('push0')):
+        assert choice.total_gas <= deploy_gas(asm_to_bytecode(strategy.asm), strategy.exec_gas)
+
+
+def test_empty_runtime():
+    choice = select_init(b'', ContextTracker(tuple()).next_obj_id(), op('push0'))
+    assert choice.deploy == bytes.fromhex('00')
+
+
+def test_mstore_init_skips_zero_words():
+    runtime = bytes([0xaa] * 32) + bytes(64) + bytes([0xbb] * 32)
+    mstore_init, *_ = gen_init_candidates(runtime, ContextTracker(tuple()).next_obj_id(), op('push0'))
+    assert mstore_init.name == 'mstore'
+    assert sum(step == op('mstore') for step in mstore_init.asm) == 2
+    code, gas_used = deploy(asm_to_bytecode(mstore_init.asm))
+    assert code == runtime
+    assert gas_used == mstore_init.exec_gas
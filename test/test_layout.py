@@ -0,0 +1,74 @@
+from py_huff.assembler import Mark, MarkId, MarkPurpose, MarkRef
+from py_huff.compile import compile_src
+from py_huff.context import ContextTracker
+from py_huff.layout import layout_units, optimize_layout
+from py_huff.opcodes import op
+from evm import run_evm
+
+BIG = ' '.join(['caller pop'] * 130)
+
+LATE_HANDLERS = f'''
+#define macro BIG() = takes(0) returns(0) {{
+    {BIG}
+}}
+#define macro MAIN() = takes(0) returns(0) {{
+    0x00 calldataload
+    dup1 0x01 eq one jumpi
+    dup1 0x02 eq two jumpi
+    dup1 0x03 eq one jumpi
+    dup1 0x04 eq big jumpi
+    two jump
+    big:
+        BIG()
+        stop
+    one:
+        0x01 0x00 mstore 0x20 0x00 return
+    two:
+        0x02 0x00 mstore 0x20 0x00 return
+}}
+'''
+
+
+def test_late_labels_moved_forward():
+    plain = compile_src(LATE_HANDLERS, {}, False)
+    optimized = compile_src(LATE_HANDLERS, {}, False, optimize='gas')
+    # The 4 references to `one` & `two` fit into `PUSH1`
+    assert len(plain.runtime) - len(optimized.runtime) == 4
+    assert [note.pass_name for note in optimized.optimizations] == ['layout']
+    assert optimized.optimizations[0].bytes_saved == 4
+    assert optimized.optimizations[0].extra_gas == 0
+    for selector in range(6):
+        calldata = selector.to_bytes(32, 'big')
+        assert run_evm(optimized.runtime, calldata) == run_evm(plain.runtime, calldata)
+
+
+def test_size_report_with_layout():
+    result = compile_src(LATE_HANDLERS, {}, False, optimize='gas', size_report=True)
+    assert result.size_report is not None
+    report = result.size_report.runtime
+    assert report.total == len(result.runtime)
+    big, = [m for m in report.macros if m.macro == 'BIG']
+    assert big.inclusive == big.exclusive == 260
+
+
+def test_entry_and_open_tail_stay_in_place():
+    ctx = ContextTracker(tuple())
+    a, b = MarkId(ctx.next_obj_id(), MarkPurpose.Label), MarkId(ctx.next_obj_id(), MarkPurpose.Label)
+    asm = [
+        MarkRef(b), op('jump'),
+        Mark(a), op('jumpdest'), op('stop'),
+        Mark(b), op('jumpdest'), MarkRef(a), op('jump'),
+        op('caller')
+    ]
+    units = layout_units(asm)
+    assert [unit.closed for unit in units] == [True, True, True, False]
+    # Nothing to gain, code is too small for wider pushes
+    assert optimize_layout(asm, 'MAIN') == (asm, [])
+
+
+def test_pc_prevents_layout():
+    src = LATE_HANDLERS.replace('two jump', 'pc pop two jump')
+    plain = compile_src(src, {}, False)
+    optimized = compile_src(src, {}, False, optimize='gas')
+    assert plain.runtime == optimized.runtime
+    assert optimized.optimizations == []
@@ -0,0 +1,151 @@
+import io
+import time
+from py_huff.lsp import LanguageServer, path_to_uri, read_message, write_message, serve
+from py_huff.incremental import gen_library
+
+LIB = '''#define constant OWNER_SLOT = 0x00
+#define function owner() view returns (address)
+
+#define macro ADD_ONE(x) = takes(1) returns(1) {
+    <x> add
+}
+'''
+
+MAIN = '''#include "./lib/math.huff"
+
+#define macro MAIN() = takes(0) returns(0) {
+    [OWNER_SLOT] ADD_ONE(0x01)
+    __FUNC_SIG(owner) pop
+    done jump
+    done:
+        stop
+}
+'''
+
+
+def open_project(tmp_path, main=MAIN):
+    (tmp_path / 'lib').mkdir()
+    (tmp_path / 'lib' / 'math.huff').write_text(LIB)
+    main_path = tmp_path / 'main.huff'
+    main_path.write_text(main)
+    server = LanguageServer()
+    server.handle({'jsonrpc': '2.0', 'id': 0, 'method': 'initialize', 'params': {}})
+    out = server.handle({
+        'jsonrpc': '2.0',
+        'method': 'textDocument/didOpen',
+        'params': {'textDocument': {'uri': path_to_uri(str(main_path)), 'text': main}}
+    })
+    return server, str(main_path), out
+
+
+def position(text: str, needle: str, delta: int = 0):
+    offset = text.index(needle) + delta
+    line = text.count('\n', 0, offset)
+    return {'line': line, 'character': offset - (text.rfind('\n', 0, offset) + 1)}
+
+
+def request(server, method, path, pos, **extra):
+    params = {'textDocument': {'uri': path_to_uri(path)}, 'position': pos, **extra}
+    res, *_ = server.handle({'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params})
+    return res['result']
+
+
+def test_definition_across_includes(tmp_path):
+    server, main_path, _ = open_project(tmp_path)
+    locs = request(server, 'textDocument/definition', main_path, position(MAIN, 'ADD_ONE'))
+    assert locs == [{
+        'uri': path_to_uri(str(tmp_path / 'lib' / 'math.huff')),
+        'range': {'start': position(LIB, 'ADD_ONE'), 'end': position(LIB, 'ADD_ONE', 7)}
+    }]
+    locs = request(server, 'textDocument/definition', main_path, position(MAIN, 'done jump'))
+    assert [loc['range']['start'] for loc in locs] == [position(MAIN, 'done:')]
+    locs = request(server, 'textDocument/definition', main_path, position(MAIN, 'owner)'))
+    assert locs[0]['range']['start'] == position(LIB, 'owner()')
+
+
+def test_references_and_hover(tmp_path):
+    server, main_path, _ = open_project(tmp_path)
+    refs = request(
+        server, 'textDocument/references', main_path, position(MAIN, 'OWNER_SLOT'),
+        context={'includeDeclaration': True}
+    )
+    assert len(refs) == 2
+    hover = request(server, 'textDocument/hover', main_path, position(MAIN, 'ADD_ONE'))
+    assert hover['contents']['value'] == (
+        '#define macro ADD_ONE(x) = takes(1) returns(1)\nexpanded size: 2 bytes'
+    )
+    hover = request(server, 'textDocument/hover', main_path, position(MAIN, 'MAIN', 1))
+    # push0 push1 add push4 pop push1 jump jumpdest stop
+    assert hover['contents']['value'].endswith('expanded size: 15 bytes')
+
+
+def test_diagnostics_follow_incremental_edits(tmp_path):
+    server, main_path, out = open_project(tmp_path)
+    assert out[0]['params']['diagnostics'] == []
+    start = position(MAIN, 'ADD_ONE')
+    end = position(MAIN, 'ADD_ONE', 7)
+    out = server.handle({
+        'jsonrpc': '2.0',
+        'method': 'textDocument/didChange',
+        'params': {
+            'textDocument': {'uri': path_to_uri(main_path), 'version': 2},
+            'contentChanges': [{'range': {'start': start, 'end': end}, 'text': 'ADD_TWO'}]
+        }
+    })
+    messages = [d['message'] for d in out[0]['params']['diagnostics']]
+    assert messages == ['Undefined macro "ADD_TWO"']
+    assert server.index.files[main_path].tree.relexed == 1
+
+    out = server.handle({
+        'jsonrpc': '2.0',
+        'method': 'textDocument/didChange',
+        'params': {
+            'textDocument': {'uri': path_to_uri(main_path), 'version': 3},
+            'contentChanges': [{'range': {'start': start, 'end': start}, 'text': '#define macro ('}]
+        }
+    })
+    assert out[0]['params']['diagnostics'][0]['message'].startswith('Parse error')
+
+
+def test_unused_macro_warning(tmp_path):
+    server, main_path, out = open_project(tmp_path, MAIN + '#define macro UNUSED() = takes(0) returns(0) {}\n')
+    diags = out[0]['params']['diagnostics']
+    assert [(d['severity'], d['message']) for d in diags] == [(2, 'Unused macro "UNUSED"')]
+
+
+def test_stdio_framing(tmp_path):
+    stdin = io.BytesIO()
+    for msg in [
+        {'jsonrpc': '2.0', 'id': 1, 'method': 'initialize', 'params': {}},
+        {'jsonrpc': '2.0', 'id': 2, 'method': 'shutdown'},
+        {'jsonrpc': '2.0', 'method': 'exit'}
+    ]:
+        write_message(stdin, msg)
+    stdin.seek(0)
+    stdout = io.BytesIO()
+    assert serve(stdin, stdout) == 0
+    stdout.seek(0)
+    init = read_message(stdout)
+    assert init['result']['capabilities']['definitionProvider']
+    assert read_message(stdout) == {'jsonrpc': '2.0', 'id': 2, 'result': None}
+
+
+def test_query_latency_on_large_project(tmp_path):
+    lib = gen_library(2000)
+    main = '#include "./big.huff"\n#define macro MAIN() = takes(0) returns(0) { 0x01 M1999(0x02) }\n'
+    (tmp_path / 'big.huff').write_text(lib)
+    (tmp_path / 'lib').mkdir()
+    main_path = tmp_path / 'main.huff'
+    server = LanguageServer()
+    server.handle({
+        'jsonrpc': '2.0',
+        'method': 'textDocument/didOpen',
+        'params': {'textDocument': {'uri': path_to_uri(str(main_path)), 'text': main}}
+    })
+    pos = position(main, 'M1999')
+    start = time.perf_counter()
+    for _ in range(100):
+        locs = request(server, 'textDocument/definition', str(main_path), pos)
+    elapsed = (time.perf_counter() - start) / 100
+    assert locs[0]['uri'].endswith('big.huff')
+    assert elapsed < 0.005
@@ -1,5 +1,6 @@
 import os
 from py_huff.compile import compile
+from py_huff.utils import map_file
 
 
 def compile_test(
@@ -68,7 +69,7 @@ def test_deep_args():
 
 def test_simple_adjust():
     compile_test(
-        fp='../examples/simple_adjust.huff', expected_deploy='61010480600a5f395ff36003565b00000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000',
+        fp='../examples/simple_adjust.huff', expected_deploy='636003565b5f52610104601cf3',
         expected_runtime='6003565b00000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000'
 
     )
@@ -120,3 +121,27 @@ def test_free_storage_pointer():
         expected_deploy='645f600160025f526005601bf3',
         expected_runtime=' 5f60016002'
     )
+
+
+def test_code_tables_deduplicated():
+    compile_test(
+        fp='../examples/code_tables.huff',
+        expected_deploy='6004601b60036011600b8060145f395ff3c0ffee60046007600700deadbeef',
+        expected_runtime='                                           60046007600700deadbeef'
+    )
+
+
+def test_binary_file_table():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../examples/binary_table.huff')
+    result = compile(path, {}, False)
+    with open(os.path.join(os.path.dirname(path), 'data/blob.bin'), 'rb') as f:
+        blob = f.read()
+    assert result.runtime.hex() == '610bb8600c5f39610bb85ff3' + blob.hex()
+
+
+def test_map_file_is_zero_copy():
+    import mmap
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../examples/data/blob.bin')
+    view = map_file(path)
+    assert isinstance(view.obj, mmap.mmap) and view.readonly
+    assert len(view) == 3000
@@ -0,0 +1,126 @@
+import json
+import os
+import pytest
+from py_huff.compile import compile, compile_src
+from py_huff.objects import compile_object, object_to_json, object_from_json, save_object, load_object
+from py_huff.parser import ConstRef, MacroParam
+from py_huff.relocation import Symbol, SymbolicMarkRef
+from py_huff.sources import MemorySource
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+
+LIB = '''
+#define constant SLOT = FREE_STORAGE_POINTER()
+#define constant FEE = 0x1234
+#define table T { 0xdeadbeef }
+#define function transfer(address, uint256) nonpayable returns (uint256)
+#define event Transfer(address indexed, uint256)
+
+#define macro INNER(x) = takes(0) returns(0) {
+    <x> skip jumpi
+    [FEE] pop
+    skip:
+    global_done jump
+}
+#define macro DISPATCH(dest) = takes(1) returns(0) {
+    __FUNC_SIG(transfer) eq <dest> jumpi
+    INNER(<dest>)
+    __tablesize(T) __tablestart(T)
+    [SLOT] sload
+    __EVENT_HASH(Transfer)
+}
+#define macro DEPLOY() = takes(0) returns(0) {
+    __RETURN_RUNTIME(0x00)
+}
+'''
+
+MAIN = '''
+#define constant OWN = FREE_STORAGE_POINTER()
+#define macro MAIN() = takes(0) returns(0) {
+    0x00 calldataload 0xe0 shr
+    DISPATCH(target)
+    [OWN]
+    DISPATCH(target)
+    target:
+    global_done:
+    stop
+}
+#define macro CONSTRUCTOR() = takes(0) returns(0) {
+    __tablestart(T) DEPLOY()
+}
+'''
+
+
+def lib_object(avoid_push0: bool = False):
+    return compile_object('lib.huff', avoid_push0, MemorySource({'lib.huff': LIB}))
+
+
+def from_source(src: str, overrides={}, avoid_push0: bool = False, **kwargs):
+    source = MemorySource({'lib.huff': LIB})
+    return compile_src('#include "./lib.huff"\n' + src, overrides, avoid_push0, source=source, **kwargs)
+
+
+@pytest.mark.parametrize('avoid_push0', [False, True])
+def test_linked_matches_source(avoid_push0: bool):
+    expected = from_source(MAIN, avoid_push0=avoid_push0)
+    linked = compile_src(MAIN, {}, avoid_push0, objects=[lib_object(avoid_push0)])
+    assert linked.runtime == expected.runtime
+    assert linked.deploy == expected.deploy
+    assert linked.abi == expected.abi
+
+
+def test_overrides_apply_to_linked_constants():
+    overrides = {'FEE': b'\xff', 'OWN': b'\x07'}
+    linked = compile_src(MAIN, overrides, False, objects=[lib_object()])
+    assert linked.runtime == from_source(MAIN, overrides).runtime
+
+
+def test_outlining_linked_macros():
+    expected = from_source(MAIN, optimize='size')
+    linked = compile_src(MAIN, {}, False, optimize='size', objects=[lib_object()])
+    assert len(linked.runtime) <= len(expected.runtime)
+
+
+def test_json_roundtrip(tmp_path):
+    obj = lib_object()
+    assert object_from_json(json.loads(json.dumps(object_to_json(obj)))) == obj
+    fp = str(tmp_path / 'lib.hobj')
+    save_object(obj, fp)
+    assert load_object(fp) == obj
+
+
+def test_example_library():
+    obj = compile_object(os.path.join(EXAMPLES, 'included', 'first.huff'), False)
+    with open(os.path.join(EXAMPLES, 'including.huff')) as f:
+        main = f.read().replace('#include "./included/first.huff"', '')
+    linked = compile_src(main, {}, False, objects=[obj])
+    assert linked.runtime == compile(os.path.join(EXAMPLES, 'including.huff'), {}, False).runtime
+
+
+def test_link_errors():
+    obj = lib_object()
+    with pytest.raises(AssertionError, match='Label "global_done" not found'):
+        compile_src('#define macro MAIN() = takes(0) returns(0) { DISPATCH(t) t: }', {}, False, objects=[obj])
+    with pytest.raises(AssertionError, match='DEPLOY uses constructor built-ins'):
+        compile_src('#define macro MAIN() = takes(0) returns(0) { DEPLOY() }', {}, False, objects=[obj])
+    with pytest.raises(AssertionError, match='defined in source and linked object'):
+        compile_src(MAIN + '#define macro INNER() = takes(0) returns(0) {}', {}, False, objects=[obj])
+    with pytest.raises(AssertionError, match='Duplicate linked macro "INNER"'):
+        compile_src(MAIN, {}, False, objects=[obj, obj])
+    with pytest.raises(AssertionError, match='compiled for EVM version prague into program compiled for paris'):
+        compile_src(MAIN, {}, True, objects=[obj])
+
+
+def test_library_must_be_self_contained():
+    lib = '#define macro HOOKED() = takes(0) returns(0) { USER_HOOK() }'
+    with pytest.raises(AssertionError, match='Undefined macro "USER_HOOK"'):
+        compile_object('lib.huff', False, MemorySource({'lib.huff': lib}))
+
+
+def test_unbound_params_and_constants():
+    inner = lib_object().macros['INNER'].asm
+    assert inner[0] == MacroParam('x')
+    assert ConstRef('FEE') in inner
+    assert [step.mid.symbol for step in inner if isinstance(step, SymbolicMarkRef)] == [
+        Symbol('local', 0), Symbol('label', 'global_done')
+    ]
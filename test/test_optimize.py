@@ -0,0 +1,23 @@
+import os
+from py_huff.compile import compile
+from evm import run_evm
+
+
+def example_path(fp: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples', fp)
+
+
+def test_outline_repeated_macro():
+    path = example_path('outlining.huff')
+    plain = compile(path, {}, False)
+    outlined = compile(path, {}, False, 'size')
+
+    assert len(outlined.runtime) < len(plain.runtime)
+    assert [(note.pass_name, note.target) for note in outlined.optimizations] == [('outline', 'MIX')]
+    assert outlined.optimizations[0].bytes_saved > 0
+
+    for seed in range(4):
+        calldata = bytes((seed * 37 + i) % 256 for i in range(0xa0))
+        expected = run_evm(plain.runtime, calldata)
+        result = run_evm(outlined.runtime, calldata)
+        assert result.success and result.output == expected.output
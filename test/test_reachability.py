@@ -0,0 +1,87 @@
+import os
+import pytest
+import py_huff.compile
+from py_huff.compile import compile, compile_src
+from py_huff.incremental import gen_library
+from py_huff.node import ExNode
+from py_huff.parser import Macro, parse_macro
+from py_huff.sources import MemorySource
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+
+SRC = '''
+#define constant A = FREE_STORAGE_POINTER()
+#define constant B = FREE_STORAGE_POINTER()
+#define constant UNUSED = 0x1234
+#define table T = file("./missing.bin")
+
+#define macro BROKEN() = takes(0) returns(0) { <undeclared> }
+
+#define macro MAIN() = takes(0) returns(0) {
+    [B] HELPER()
+}
+#define macro HELPER() = takes(0) returns(0) { [A] }
+'''
+
+
+def test_unreachable_definitions_are_skipped():
+    result = compile_src(SRC, {}, False)
+    # B is still the second free storage slot even though A is unused by MAIN directly
+    assert result.runtime.hex() == '60015f'
+    assert result.warnings == [
+        'Unused macro "BROKEN"',
+        'Unused constant "UNUSED"',
+        'Unused code table "T"'
+    ]
+
+
+def test_strict_validates_everything():
+    with pytest.raises(AssertionError, match='Invalid macro arg undeclared'):
+        compile_src(SRC, {}, False, strict=True)
+    src = SRC.replace('<undeclared>', '').replace('= file("./missing.bin")', '{0x00}')
+    result = compile_src(src, {}, False, strict=True)
+    assert result.runtime.hex() == '60015f'
+    assert result.warnings == compile_src(src, {}, False).warnings
+
+
+def test_unreachable_syntax_errors_only_fail_strict():
+    src = '#define macro MAIN() = takes(0) returns(0) { 0x01 }\n#define macro BAD() = takes(0) returns(0) { ) }\n'
+    assert compile_src(src, {}, False).runtime.hex() == '6001'
+    with pytest.raises(Exception):
+        compile_src(src, {}, False, strict=True)
+
+
+def test_override_of_unused_constant():
+    assert compile_src(SRC, {'UNUSED': b'\x01'}, False).runtime.hex() == '60015f'
+    with pytest.raises(AssertionError, match='nonexistent constant'):
+        compile_src(SRC, {'NOPE': b'\x01'}, False)
+
+
+@pytest.mark.parametrize('entry', ['including.huff', 'code_tables.huff', 'binary_table.huff', 'outlining.huff'])
+def test_lazy_matches_strict(entry: str):
+    path = os.path.join(EXAMPLES, entry)
+    lazy, strict = compile(path, {}, False), compile(path, {}, False, strict=True)
+    assert lazy._replace(warnings=[]) == strict._replace(warnings=[])
+    assert lazy.warnings == strict.warnings
+
+
+def test_unused_library_macros_never_parsed(monkeypatch: pytest.MonkeyPatch):
+    source = MemorySource({
+        'lib.huff': gen_library(300),
+        'main.huff': '#include "./lib.huff"\n#define macro MAIN() = takes(0) returns(0) { 0x01 M7(0x02) }\n'
+    })
+    parsed: list[str] = []
+
+    def recording_parse_macro(node: ExNode) -> Macro:
+        macro = parse_macro(node)
+        parsed.append(macro.ident)
+        return macro
+
+    monkeypatch.setattr(py_huff.compile, 'parse_macro', recording_parse_macro)
+    lazy = compile('main.huff', {}, False, source=source)
+    assert sorted(parsed) == ['M7', 'MAIN']
+    assert len(lazy.warnings) == 299
+    parsed.clear()
+    strict = compile('main.huff', {}, False, source=source, strict=True)
+    assert len(parsed) == 301
+    assert lazy.runtime == strict.runtime
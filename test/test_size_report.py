@@ -0,0 +1,72 @@
+import os
+from py_huff.compile import compile, compile_src
+from py_huff.size_report import (
+    MacroSize, TableSize, format_size_report, size_report_to_json, size_report_from_json
+)
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+
+SRC = '''
+#define table T { 0xc0ffee }
+#define macro LEAF() = takes(0) returns(0) { caller pop }
+#define macro MID() = takes(0) returns(0) {
+    LEAF() LEAF()
+    end jump
+    end:
+}
+#define macro MAIN() = takes(0) returns(0) {
+    MID() LEAF() __tablesize(T) __tablestart(T) stop
+}
+#define macro CONSTRUCTOR() = takes(0) returns(0) {
+    LEAF() __RETURN_RUNTIME(0x00)
+}
+'''
+
+
+def test_not_generated_unless_requested():
+    assert compile_src(SRC, {}, False).size_report is None
+
+
+def test_attribution():
+    result = compile_src(SRC, {}, False, size_report=True)
+    report = result.size_report
+    assert report is not None
+    runtime = report.runtime
+    assert runtime.total == len(result.runtime)
+    assert runtime.tables == [TableSize(['T'], 3)]
+    assert runtime.code == runtime.total - 3
+    assert runtime.macros == [
+        # Label push is relaxed to a single byte: PUSH1 JUMP JUMPDEST
+        MacroSize('MAIN', 1, runtime.code, 2 + 2 + 1),
+        MacroSize('MID', 1, 2 * 2 + 4, 4),
+        MacroSize('LEAF', 3, 3 * 2, 3 * 2)
+    ]
+    assert sum(m.exclusive for m in runtime.macros) == runtime.code
+
+    constructor = report.constructor
+    assert constructor is not None
+    assert constructor.total == len(result.deploy) - len(result.runtime)
+    assert constructor.tables == []
+    assert [m.macro for m in constructor.macros] == ['CONSTRUCTOR', 'LEAF']
+    assert sum(m.exclusive for m in constructor.macros) == constructor.code
+
+
+def test_default_constructor_and_outlining():
+    path = os.path.join(EXAMPLES, 'outlining.huff')
+    result = compile(path, {}, False, optimize='size', size_report=True)
+    report = result.size_report
+    assert report is not None and report.constructor is None
+    assert report.runtime.total == len(result.runtime)
+    assert sum(m.exclusive for m in report.runtime.macros) == report.runtime.code
+    # Outlining is unaffected by the report
+    assert result.runtime == compile(path, {}, False, optimize='size').runtime
+
+
+def test_json_and_table():
+    report = compile_src(SRC, {}, False, size_report=True).size_report
+    assert report is not None
+    assert size_report_from_json(size_report_to_json(report)) == report
+    lines = format_size_report(report).splitlines()
+    assert lines[0] == f'runtime (EIP-170 limit 24576): {report.runtime.total} bytes'
+    assert lines[2].split() == ['MAIN', '1', str(report.runtime.code), '5']
+    assert 'code tables: 3 bytes' in lines
@@ -0,0 +1,64 @@
+import builtins
+import io
+import os
+import zipfile
+import pytest
+from py_huff.compile import compile, compile_src
+from py_huff.sources import MemorySource, ZipSource
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+
+
+def example_files() -> dict[str, bytes]:
+    files: dict[str, bytes] = {}
+    for dirpath, _, filenames in os.walk(EXAMPLES):
+        for name in filenames:
+            fp = os.path.join(dirpath, name)
+            with open(fp, 'rb') as f:
+                files[os.path.relpath(fp, EXAMPLES)] = f.read()
+    return files
+
+
+@pytest.fixture
+def no_disk(monkeypatch):
+    def deny_open(*args, **kwargs):
+        raise AssertionError(f'Unexpected disk access: {args}')
+    monkeypatch.setattr(builtins, 'open', deny_open)
+
+
+@pytest.mark.parametrize('entry', ['including.huff', 'binary_table.huff', 'code_tables.huff'])
+def test_memory_source_matches_disk(entry: str):
+    expected = compile(os.path.join(EXAMPLES, entry), {}, False)
+    source = MemorySource(example_files())
+    assert compile(entry, {}, False, source=source) == expected
+
+
+@pytest.mark.parametrize('entry', ['including.huff', 'binary_table.huff'])
+def test_zip_source_matches_disk(entry: str):
+    expected = compile(os.path.join(EXAMPLES, entry), {}, False)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        for name, contents in example_files().items():
+            zf.writestr(name, contents)
+    archive.seek(0)
+    assert compile(f'/{entry}', {}, False, source=ZipSource(archive)) == expected
+
+
+def test_compile_src_with_includes_without_disk(no_disk):
+    source = MemorySource({
+        'lib/math.huff': '#include "./consts.huff"\n#define macro DOUBLE() = takes(1) returns(1) { dup1 add }',
+        'lib/consts.huff': '#define constant TWO = 0x02',
+    })
+    src = '#include "lib/math.huff"\n#define macro MAIN() = takes(0) returns(0) { [TWO] DOUBLE() }'
+    result = compile_src(src, {}, False, source=source, src_path='/gen/../main.huff')
+    assert result.runtime.hex() == '60028001'
+
+
+def test_compile_src_includes_require_source():
+    with pytest.raises(AssertionError):
+        compile_src('#include "x.huff"\n#define macro MAIN() = takes(0) returns(0) {}', {}, False)
+
+
+def test_missing_memory_file():
+    with pytest.raises(FileNotFoundError):
+        compile('missing.huff', {}, False, source=MemorySource({}))
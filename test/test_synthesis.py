@@ -0,0 +1,69 @@
+import random
+import pytest
+from py_huff.assembler import asm_to_bytecode
+from py_huff.compile import compile_src
+from py_huff.synthesis import synthesize, synthesis_candidates, MAX_U256
+from evm import run_evm
+
+rng = random.Random(3)
+VALUES = [
+    0, 1, 0xff, MAX_U256, MAX_U256 >> 1, 1 << 255, 1 << 160, (1 << 160) - 1, (1 << 96) - 1,
+    MAX_U256 ^ 0xff, MAX_U256 ^ ((1 << 160) - 1), 0xffff << 240, 0x1234 << 200, 0xdeadbeef,
+    *(rng.getrandbits(rng.randint(1, 256)) << rng.randint(0, 64) & MAX_U256 for _ in range(40)),
+    *(MAX_U256 ^ (rng.getrandbits(rng.randint(1, 64)) << rng.randint(0, 192)) for _ in range(40))
+]
+
+SRC = '''
+#define constant MASK = 0x000000000000000000000000ffffffffffffffffffffffffffffffffffffffff
+#define constant HIGH = 0x8000000000000000000000000000000000000000000000000000000000000000
+#define constant OVERRIDDEN = 0x01
+
+#define macro MAIN() = takes(0) returns(0) {
+    [MASK] 0x00 sstore
+    [HIGH] 0x01 sstore
+    [OVERRIDDEN] 0x02 sstore
+    0xffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff 0x03 sstore
+    push32 0xffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff00 0x04 sstore
+    push4 0x00000001 0x05 sstore
+    stop
+}
+'''
+
+
+def run_sequence(seq) -> list[int]:
+    result = run_evm(asm_to_bytecode([*seq]))
+    assert result.success
+    return result.stack
+
+
+@pytest.mark.parametrize('avoid_push0', [False, True])
+def test_all_candidates_equivalent(avoid_push0: bool):
+    for value in VALUES:
+        for seq in synthesis_candidates(value, avoid_push0):
+            assert run_sequence(seq) == [value], f'{seq} != 0x{value:x}'
+
+
+@pytest.mark.parametrize('objective', ['gas', 'size'])
+def test_synthesized_never_larger(objective: str):
+    for value in VALUES:
+        plain = asm_to_bytecode(synthesis_candidates(value, False)[:1][0])
+        best = asm_to_bytecode(synthesize(value, objective, False))
+        assert len(best) <= len(plain)
+    assert asm_to_bytecode(synthesize(MAX_U256, objective, False)).hex() == '5f19'
+
+
+@pytest.mark.parametrize('objective', ['gas', 'size'])
+@pytest.mark.parametrize('avoid_push0', [False, True])
+def test_program_equivalent(objective: str, avoid_push0: bool):
+    overrides = {'OVERRIDDEN': (1 << 200).to_bytes(26, 'big')}
+    plain = compile_src(SRC, overrides, avoid_push0)
+    synthesized = compile_src(SRC, overrides, avoid_push0, synthesize=objective)
+    assert len(synthesized.runtime) < len(plain.runtime)
+    assert run_evm(synthesized.runtime).storage == run_evm(plain.runtime).storage
+    targets = {note.target for note in synthesized.optimizations}
+    assert targets == {
+        f'0x{(1 << 160) - 1:x}', f'0x{1 << 255:x}', f'0x{1 << 200:x}', f'0x{MAX_U256:x}',
+        f'0x{MAX_U256 ^ 0xff:x}'
+    }
+    # Pushes wider than their value are kept as written
+    assert bytes.fromhex('6300000001') in synthesized.runtime